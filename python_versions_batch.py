@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+'''Run python-versions on many Koji builds in a single process.
+
+The list of builds is a file with a Koji build NVR and a directory
+with its downloaded RPMs and build.logs on each line,
+empty lines and lines starting with # are ignored.
+Builds listed repeatedly are only checked once.
+'''
+
+import logging
+if __name__ == '__main__':
+    logging.basicConfig()
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from python_versions_check import (
+    add_options,
+    run_batch,
+    run_options,
+    split_arches,
+)
+from taskotron_python_versions.common import log
+
+
+def read_builds(path):
+    '''Return: (list) (koji_build, workdir) pairs listed in the file'''
+    builds = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                koji_build, workdir = line.split(None, 1)
+                if koji_build in builds:
+                    log.warning('Ignoring duplicate build {}'.format(
+                        koji_build))
+                    continue
+                builds[koji_build] = workdir
+    return list(builds.items())
+
+
+def parse_args(argv=None):
+    '''Parse the command line arguments'''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('builds', type=read_builds,
+                        help='file with "<koji_build> <workdir>" lines')
+    parser.add_argument('artifactsdir')
+    parser.add_argument('testcase')
+    parser.add_argument('arches', type=split_arches,
+                        help='comma separated list of architectures')
+    add_options(parser)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    rc = run_batch(args.builds,
+                   artifactsdir=args.artifactsdir,
+                   testcase=args.testcase,
+                   arches=args.arches,
+                   **run_options(args))
+    sys.exit(rc)
@@ -7,6 +7,7 @@ if __name__ == '__main__':
     # that then.
     logging.basicConfig()
 
+import argparse
 import os
 import pathlib
 import sys
@@ -16,71 +17,189 @@ from libtaskotron import check
 # before we import from pyversions, let's add our dir to sys.path
 sys.path.insert(0, os.path.dirname(__file__))
 
-from taskotron_python_versions import (
-    task_two_three,
-    task_naming_scheme,
-    task_requires_naming_scheme,
-    task_executables,
-    task_unversioned_shebangs,
-    task_py3_support,
-    task_python_usage,
+from taskotron_python_versions.cache import HeaderCache
+from taskotron_python_versions.common import (
+    ArtifactWriter,
+    load_packages,
+    log,
+)
+from taskotron_python_versions.instrumentation import measure, write_timing
+from taskotron_python_versions.prefilter import involves_python
+from taskotron_python_versions.py3_support import (
+    set_bugzilla_deadline,
+    use_tracker_snapshot,
+)
+from taskotron_python_versions.requires import (
+    cancel_prefetch,
+    prefetch_repoquery,
+    release_from_build,
+    repoquery_stats,
+    set_repoquery_budget,
+    unversioned_requires,
+    use_repo_service,
+    use_versioned_name_cache,
+)
+from taskotron_python_versions.repo_service import DEFAULT_SOCKET
+from taskotron_python_versions.repos import (
+    configure_repos,
+    use_provides_indexes,
+)
+from taskotron_python_versions.subchecks import (
+    prefiltered_details,
+    run_subchecks,
+)
+from taskotron_python_versions.unversioned_shebangs import (
+    DEFAULT_SCAN_LIMITS,
+    ScanLimits,
+    set_scan_jobs,
+    set_scan_limits,
+    use_scan_cache,
 )
-from taskotron_python_versions.common import log, Package, PackageException
 
 
 def run(koji_build, workdir='.', artifactsdir='artifacts',
-        testcase='dist.python-versions', arches=['x86_64', 'noarch', 'src']):
-    '''The main method to run from Taskotron'''
+        testcase='dist.python-versions', arches=['x86_64', 'noarch', 'src'],
+        header_cache=None, jobs=1, pool='process', verify=True,
+        check_jobs=1, profile=False, compress_artifact=False,
+        max_artifact_size=None, provides_index=None, repo_config=None,
+        repo_service=None, repoquery_budget=None, name_cache=None,
+        name_cache_ttl=None, bugzilla_snapshot=None,
+        bugzilla_snapshot_ttl=None, bugzilla_deadline=60, scan_jobs=1,
+        scan_max_size=DEFAULT_SCAN_LIMITS.max_bytes // 1024 ** 2,
+        scan_max_files=DEFAULT_SCAN_LIMITS.max_entries,
+        scan_timeout=DEFAULT_SCAN_LIMITS.max_time, scan_cache=None,
+        scan_cache_size=None):
+    '''The main method to run from Taskotron
+
+    header_cache is an optional directory to cache RPM headers in.
+    RPM headers are loaded by a pool of jobs workers, either
+    'process' or 'thread', verify=False skips signature and digest checks.
+    Up to check_jobs independent subchecks run concurrently.
+    With profile=True, cProfile data of each subcheck are stored
+    in the artifacts.
+    The output.log artifact can be gzipped and truncated
+    to max_artifact_size bytes.
+    provides_index is an optional directory with offline provides indexes
+    named <release>.sqlite, used instead of loading the DNF repositories.
+    repo_config is an optional INI file with the repositories (or provides
+    indexes) of releases, see repos.configure_repos().
+    repo_service is an optional socket of the repo service, used instead
+    of loading the DNF repositories in this process, if it is running.
+    repoquery_budget limits the memory (in MiB) of the repoqueries kept
+    for later runs in this process, the least recently used are dropped.
+    name_cache is an optional directory to remember the versioned names
+    of requires in across runs, for name_cache_ttl seconds.
+    bugzilla_snapshot is an optional file to store all bugs tracked
+    by the Python 3 tracker in, fetched again after bugzilla_snapshot_ttl
+    seconds, instead of querying Bugzilla for each build.
+    Bugzilla lookups taking more than bugzilla_deadline seconds are given up
+    and the py3_support subcheck reports INFO then.
+    Payloads of the packages are scanned for shebangs by a pool
+    of scan_jobs processes. Scanning a payload is given up, if it has
+    more than scan_max_size MiB of files, more than scan_max_files files
+    or takes more than scan_timeout seconds, and the unversioned_shebangs
+    subcheck reports NEEDS_INSPECTION then. None means no limit.
+    scan_cache is an optional directory to remember the shebangs found
+    in payloads in, taking at most scan_cache_size MiB, so identical
+    payloads are only scanned once.
+    '''
     artifactsdir = pathlib.Path(artifactsdir)
     workdir = pathlib.Path(workdir).resolve()
     resultsdir = artifactsdir / 'taskotron'
     resultspath = resultsdir / 'results.yml'
-    artifact = artifactsdir / 'output.log'
+    timingpath = resultsdir / 'timing.json'
+    profiledir = artifactsdir / 'profile' if profile else None
+    artifact = ArtifactWriter(artifactsdir / 'output.log',
+                              compress=compress_artifact,
+                              max_size=max_artifact_size)
 
     artifactsdir.mkdir(parents=True, exist_ok=True)
     resultsdir.mkdir(parents=True, exist_ok=True)
 
+    cache = HeaderCache(header_cache) if header_cache else None
+    configure_repos(repo_config)
+    use_provides_indexes(provides_index)
+    use_repo_service(repo_service)
+    set_repoquery_budget(None if repoquery_budget is None
+                         else repoquery_budget * 1024)
+    use_versioned_name_cache(name_cache, name_cache_ttl)
+    use_tracker_snapshot(bugzilla_snapshot, bugzilla_snapshot_ttl)
+    set_bugzilla_deadline(bugzilla_deadline)
+    set_scan_jobs(scan_jobs)
+    set_scan_limits(ScanLimits(
+        max_bytes=None if scan_max_size is None else scan_max_size * 1024 ** 2,
+        max_entries=scan_max_files, max_time=scan_timeout))
+    use_scan_cache(scan_cache, None if scan_cache_size is None
+                   else scan_cache_size * 1024 ** 2)
+    # loading the repositories takes long, overlap it with the headers;
+    # the header loading processes are not forked, so this thread is safe
+    release = release_from_build(koji_build)
+    prefetch_repoquery(release)
+
     # find files to run on
     files = sorted(os.listdir(workdir))
     logs = []
-    packages = []
-    srpm_packages = []
+    rpms = []
     for file_ in files:
         path = workdir / file_
         if file_.endswith('.rpm'):
-            try:
-                package = Package(path)
-            except PackageException as err:
-                log.error('{}: {}'.format(file_, err))
-            else:
-                if package.is_srpm:
-                    srpm_packages.append(package)
-                else:
-                    packages.append(package)
+            rpms.append(path)
         elif file_.startswith('build.log'):  # it's build.log.{arch}
             logs.append(path)
         else:
             log.debug('Ignoring non-rpm, non-build.log file: {}'.format(path))
 
+    measurements = []
+    with measure('load_packages') as measurement:
+        # the checks only need a few tags, so do not keep the headers around
+        loaded = load_packages(rpms, jobs=jobs, pool=pool, cache=cache,
+                               verify=verify, snapshot=True)
+    measurements.append(measurement)
+
+    packages = []
+    srpm_packages = []
+    for package in loaded:
+        if package.is_srpm:
+            srpm_packages.append(package)
+        else:
+            packages.append(package)
+
     if not packages:
         log.warn('No binary rpm files found')
 
     if not logs:
         log.warn('No build.log found, that should not happen')
 
+    # most builds have nothing to do with Python, don't bother then
+    with measure('prefilter') as measurement:
+        python_build = any(involves_python(package)
+                           for package in srpm_packages + packages)
+    measurements.append(measurement)
+
+    if not (python_build and any(unversioned_requires(package)
+                                 for package in srpm_packages + packages)):
+        # skips the repositories not downloaded yet, not the sack
+        cancel_prefetch(release)
+
     # put all the details form subtask in this list
-    details = []
-    details.append(task_two_three(packages, koji_build, artifact))
-    details.append(task_naming_scheme(packages, koji_build, artifact))
-    details.append(task_requires_naming_scheme(
-        srpm_packages + packages, koji_build, artifact))
-    details.append(task_executables(packages, koji_build, artifact))
-    details.append(task_unversioned_shebangs(
-        packages, logs, koji_build, artifact))
-    details.append(task_py3_support(
-        srpm_packages + packages, koji_build, artifact))
-    details.append(task_python_usage(
-        srpm_packages + packages, koji_build, artifact))
+    inputs = {
+        'packages': packages,
+        'all_packages': srpm_packages + packages,
+        'logs': logs,
+    }
+    try:
+        if not python_build:
+            # the build.log may still show mangled shebangs
+            details = prefiltered_details(
+                inputs, koji_build, artifact, 'No Python involved.',
+                profile_dir=profiledir, measurements=measurements)
+        else:
+            details = run_subchecks(inputs, koji_build, artifact,
+                                    jobs=check_jobs, profile_dir=profiledir,
+                                    measurements=measurements)
+    finally:
+        artifact.flush()
+    write_timing(timingpath, measurements)
 
     for detail in details:
         # update testcase for all subtasks (use their existing testcase as a
@@ -114,11 +233,169 @@ def run(koji_build, workdir='.', artifactsdir='artifacts',
     return 0 if overall_detail.outcome in ['PASSED', 'INFO'] else 1
 
 
+def run_batch(builds, artifactsdir='artifacts',
+              testcase='dist.python-versions',
+              arches=['x86_64', 'noarch', 'src'], **options):
+    '''Run the checks on several Koji builds in this process,
+    so the imported modules, the DNF sacks, the Bugzilla session
+    and the caches are reused.
+
+    builds: iterable of (koji_build, workdir) pairs
+    Results of each build are stored in <artifactsdir>/<koji_build>.
+    options are passed to run().
+
+    Return: (int) 0 if all builds passed, 1 otherwise
+    '''
+    rc = 0
+    for koji_build, workdir in builds:
+        try:
+            rc |= run(koji_build, workdir,
+                      artifactsdir=pathlib.Path(artifactsdir) / koji_build,
+                      testcase=testcase, arches=arches, **options)
+        except Exception:
+            log.exception('python-versions crashed for {}'.format(
+                koji_build))
+            rc = 1
+    log.info('Repoqueries: {}'.format(', '.join(
+        '{} {}'.format(value, key)
+        for key, value in sorted(repoquery_stats().items()))))
+    return rc
+
+
+# keyword arguments of run() set by the command line options
+RUN_OPTIONS = (
+    'header_cache',
+    'jobs',
+    'pool',
+    'verify',
+    'check_jobs',
+    'profile',
+    'compress_artifact',
+    'max_artifact_size',
+    'provides_index',
+    'repo_config',
+    'repo_service',
+    'repoquery_budget',
+    'name_cache',
+    'name_cache_ttl',
+    'bugzilla_snapshot',
+    'bugzilla_snapshot_ttl',
+    'bugzilla_deadline',
+    'scan_jobs',
+    'scan_max_size',
+    'scan_max_files',
+    'scan_timeout',
+    'scan_cache',
+    'scan_cache_size',
+)
+
+
+def add_options(parser):
+    '''Add the command line options of run() to the parser'''
+    parser.add_argument('--header-cache', metavar='DIR',
+                        help='cache RPM headers in DIR across runs')
+    parser.add_argument('--jobs', type=int, default=1, metavar='N',
+                        help='load RPM headers in N parallel workers')
+    parser.add_argument('--pool', choices=('process', 'thread'),
+                        default='process',
+                        help='kind of workers used to load RPM headers')
+    parser.add_argument('--no-verify', dest='verify', action='store_false',
+                        help='do not verify RPM signatures and digests')
+    parser.add_argument('--check-jobs', type=int, default=1, metavar='N',
+                        help='run up to N independent subchecks concurrently')
+    parser.add_argument('--profile', action='store_true',
+                        help='store cProfile data of each subcheck '
+                             'in ARTIFACTSDIR/profile')
+    parser.add_argument('--compress-artifact', action='store_true',
+                        help='gzip the output.log artifact')
+    parser.add_argument('--max-artifact-size', type=int, metavar='BYTES',
+                        help='truncate the output.log artifact to BYTES')
+    parser.add_argument('--provides-index', metavar='DIR',
+                        help='look up provides in DIR/<release>.sqlite '
+                             'indexes instead of the DNF repositories')
+    parser.add_argument('--repo-config', metavar='FILE',
+                        help='INI file with local repositories of releases '
+                             'to use instead of the Fedora metalinks')
+    parser.add_argument('--repo-service', metavar='SOCKET',
+                        default=DEFAULT_SOCKET,
+                        help='ask the repo service listening on SOCKET, '
+                             'if running (default: %(default)s)')
+    parser.add_argument('--no-repo-service', dest='repo_service',
+                        action='store_const', const=None,
+                        help='always load the repositories in this process')
+    parser.add_argument('--repoquery-budget', type=int, metavar='MIB',
+                        help='keep at most MIB of loaded repositories '
+                             'for later builds (batch mode)')
+    parser.add_argument('--name-cache', metavar='DIR',
+                        help='remember versioned names of requires in DIR '
+                             'until the repositories change')
+    parser.add_argument('--name-cache-ttl', type=int, metavar='SECONDS',
+                        help='forget remembered versioned names '
+                             'after SECONDS (default: a day)')
+    parser.add_argument('--bugzilla-snapshot', metavar='FILE',
+                        help='look up Python 3 tracker bugs in FILE, '
+                             'fetching all of them at once')
+    parser.add_argument('--bugzilla-snapshot-ttl', type=int,
+                        metavar='SECONDS',
+                        help='fetch the tracker bugs again when FILE is '
+                             'older than SECONDS (default: an hour)')
+    parser.add_argument('--bugzilla-deadline', type=float, default=60,
+                        metavar='SECONDS',
+                        help='give up Bugzilla lookups after SECONDS '
+                             '(default: %(default)s)')
+    parser.add_argument('--scan-jobs', type=int, default=1, metavar='N',
+                        help='scan RPM payloads for shebangs '
+                             'in N parallel processes')
+    parser.add_argument('--scan-max-size', type=int, metavar='MIB',
+                        default=DEFAULT_SCAN_LIMITS.max_bytes // 1024 ** 2,
+                        help='give up scanning payloads with more than MIB '
+                             'of files (default: %(default)s)')
+    parser.add_argument('--scan-max-files', type=int, metavar='N',
+                        default=DEFAULT_SCAN_LIMITS.max_entries,
+                        help='give up scanning payloads with more than N '
+                             'files (default: %(default)s)')
+    parser.add_argument('--scan-timeout', type=float, metavar='SECONDS',
+                        default=DEFAULT_SCAN_LIMITS.max_time,
+                        help='give up scanning a payload after SECONDS '
+                             '(default: %(default)s)')
+    parser.add_argument('--scan-cache', metavar='DIR',
+                        help='remember shebangs found in RPM payloads '
+                             'in DIR across runs')
+    parser.add_argument('--scan-cache-size', type=int, metavar='MIB',
+                        help='keep at most MIB of remembered shebangs '
+                             '(default: 256)')
+
+
+def run_options(args):
+    '''Return: (dict) keyword arguments of run() from parsed args'''
+    return {option: getattr(args, option) for option in RUN_OPTIONS}
+
+
+def split_arches(arches):
+    '''Convert comma separated list of arches to a list'''
+    return arches.split(',')
+
+
+def parse_args(argv=None):
+    '''Parse the command line arguments'''
+    parser = argparse.ArgumentParser(
+        description='Run the python-versions checks on a Koji build')
+    parser.add_argument('koji_build')
+    parser.add_argument('workdir')
+    parser.add_argument('artifactsdir')
+    parser.add_argument('testcase')
+    parser.add_argument('arches', type=split_arches,
+                        help='comma separated list of architectures')
+    add_options(parser)
+    return parser.parse_args(argv)
+
+
 if __name__ == '__main__':
-    arches = sys.argv[5].split(',')
-    rc = run(koji_build=sys.argv[1],
-             workdir=sys.argv[2],
-             artifactsdir=sys.argv[3],
-             testcase=sys.argv[4],
-             arches=arches)
+    args = parse_args()
+    rc = run(koji_build=args.koji_build,
+             workdir=args.workdir,
+             artifactsdir=args.artifactsdir,
+             testcase=args.testcase,
+             arches=args.arches,
+             **run_options(args))
     sys.exit(rc)
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from .common import log
+from .header import HeaderError, header_digest
+
+
+class DiskCache:
+
+    """Directory of JSON documents addressed by a string key.
+
+    Entries are written to a temporary file and atomically renamed,
+    so several processes can share the same directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = str(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path_for(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + '.json')
+
+    def get(self, key):
+        """Return the value stored for the key or None."""
+        try:
+            with open(self.path_for(key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as err:
+            log.warning('Ignoring corrupted cache entry {}: {}'.format(
+                key, err))
+            return None
+
+    def put(self, key, value):
+        """Store the JSON serializable value for the key."""
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(value, f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+class HeaderCache(DiskCache):
+
+    """Cache of the RPM header tags used by the checks.
+
+    Packages are addressed by their file size, mtime and header digest,
+    so rebuilt or modified files are never served stale data.
+    """
+
+    # Bump when the stored tags change
+    VERSION = 4
+
+    def key_for(self, path):
+        """Return the cache key of the RPM file on the given path or None,
+        if the file is not a valid RPM.
+        """
+        stat = os.stat(str(path))
+        try:
+            with open(str(path), 'rb') as f:
+                digest = header_digest(f)
+        except HeaderError as err:
+            log.debug('Not caching {}: {}'.format(path, err))
+            return None
+        return 'v{}:{}:{}:{}'.format(
+            self.VERSION, stat.st_size, stat.st_mtime_ns, digest)
+
+
+class VersionedNameCache(DiskCache):
+
+    """Cache of the versioned names available for unversioned requires.
+
+    Entries are addressed by the release, the revision of its repositories
+    and the require, so they are never served for changed repositories.
+    They expire after ttl seconds anyway.
+    """
+
+    # Bump when the stored values change
+    VERSION = 1
+
+    def __init__(self, directory, ttl=24 * 60 * 60):
+        super().__init__(directory)
+        self.ttl = ttl
+
+    def key_for(self, release, revision, require):
+        return 'v{}:{}:{}:{}'.format(self.VERSION, release, revision, require)
+
+    def get(self, key):
+        """Return the stored value for the key or None, if expired."""
+        entry = super().get(key)
+        if entry is None or time.time() - entry['time'] > self.ttl:
+            return None
+        return entry['value']
+
+    def put(self, key, value):
+        super().put(key, {'time': time.time(), 'value': value})
+
+
+class ScanCache(DiskCache):
+
+    """Cache of the shebangs found in RPM payloads.
+
+    Payloads are addressed by their digest from the header, so identical
+    payloads of rebuilt or retriggered packages are only scanned once.
+    The least recently used entries are removed once the cache grows
+    over max_size bytes.
+    """
+
+    # Bump when the stored values change
+    VERSION = 1
+
+    # Number of entries stored between two checks of the cache size
+    EVICT_EVERY = 64
+
+    def __init__(self, directory, max_size=256 * 1024 ** 2):
+        super().__init__(directory)
+        self.max_size = max_size
+        self._puts = 0
+
+    def key_for(self, payload_digest):
+        return 'v{}:{}'.format(self.VERSION, payload_digest)
+
+    def get(self, key):
+        """Return the value stored for the key or None
+        and mark the entry as recently used.
+        """
+        value = super().get(key)
+        if value is not None:
+            try:
+                os.utime(self.path_for(key))
+            except OSError:
+                pass  # evicted by another process meanwhile
+        return value
+
+    def put(self, key, value):
+        super().put(key, value)
+        if self.max_size is not None and self._puts % self.EVICT_EVERY == 0:
+            self.evict()
+        self._puts += 1
+
+    def evict(self):
+        """Remove the least recently used entries, if the cache takes
+        more than max_size bytes, until it takes at most 90 % of them.
+
+        Return: (int) The number of removed entries
+        """
+        entries = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.endswith('.json'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        if size <= self.max_size:
+            return 0
+        removed = 0
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size * 0.9:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass  # evicted by another process
+            size -= entry_size
+            removed += 1
+        if removed:
+            log.debug('Evicted {} entries from {}'.format(
+                removed, self.directory))
+        return removed
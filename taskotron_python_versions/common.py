@@ -1,10 +1,20 @@
 import collections
+import concurrent.futures
+import gzip
+import io
+import itertools
 import logging
+import multiprocessing
 import os
+import threading
+import time
 
 import mmap
 import rpm
 
+from .header import RPMSIGTAG_MD5, HeaderError, get_binary, read_headers
+from .instrumentation import add_worker_cpu_time
+
 log = logging.getLogger('python-versions')
 log.setLevel(logging.DEBUG)
 log.addHandler(logging.NullHandler())
@@ -25,9 +35,100 @@ If you think the result is false or intentional, file a bug against:
 """
 
 
+TRUNCATED = """
+[{} more bytes of the output were truncated]
+"""
+
+
+class ArtifactSection:
+
+    """Part of an artifact reserved for a single subcheck.
+
+    Can be passed to write_to_artifact() instead of the artifact path,
+    str() of the section is the path of the artifact.
+    """
+
+    def __init__(self, writer, name):
+        self.writer = writer
+        self.name = name
+        self.messages = []
+
+    def write(self, message, info_url):
+        """Buffer failed check result details."""
+        text = TEMPLATE.format(
+            message=message,
+            info_url=info_url,
+            bug_url=BUG_URL)
+        with self.writer.lock:
+            self.messages.append(text)
+
+    def __str__(self):
+        return str(self.writer)
+
+
+class ArtifactWriter:
+
+    """Buffer of the failed check result details of a single run.
+
+    The details are kept in memory and written to the artifact at once
+    in flush(), section by section, in the order the sections were created.
+    Sections can be filled concurrently.
+
+    compress: gzip the artifact (and add .gz to its name)
+    max_size: (int) truncate the written details to this many bytes
+    """
+
+    def __init__(self, path, compress=False, max_size=None):
+        self.path = '{}.gz'.format(path) if compress else str(path)
+        self.compress = compress
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.sections = []
+
+    def section(self, name):
+        """Return: (ArtifactSection) New section, written after
+        all the sections created before
+        """
+        section = ArtifactSection(self, name)
+        with self.lock:
+            self.sections.append(section)
+        return section
+
+    def flush(self):
+        """Append all the buffered details to the artifact."""
+        with self.lock:
+            data = ''.join(text for section in self.sections
+                           for text in section.messages)
+            for section in self.sections:
+                section.messages.clear()
+        if not data:
+            return
+
+        data = data.encode('utf-8', errors='surrogateescape')
+        if self.max_size is not None and len(data) > self.max_size:
+            omitted = len(data) - self.max_size
+            data = data[:self.max_size] + TRUNCATED.format(omitted).encode()
+
+        opener = gzip.open if self.compress else open
+        with opener(self.path, 'ab') as f:
+            f.write(data)
+
+    def __str__(self):
+        return self.path
+
+
+# Subchecks may run concurrently
+_artifact_lock = threading.Lock()
+
+
 def write_to_artifact(artifact, message, info_url):
-    """Write failed check result details to atrifact."""
-    with open(artifact, 'a') as f:
+    """Write failed check result details to atrifact
+    (a path or an ArtifactSection).
+    """
+    if isinstance(artifact, ArtifactSection):
+        artifact.write(message, info_url)
+        return
+    with _artifact_lock, open(artifact, 'a') as f:
         f.write(TEMPLATE.format(
             message=message,
             info_url=info_url,
@@ -59,6 +160,10 @@ def file_contains(path, needle):
     needle = needle.encode('ascii')
 
     with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            # an empty file cannot be mapped
+            return False
+
         # build.logs tend to be laaaarge, so using a single read() is bad idea;
         # let's optimize prematurely because practicality beats purity
 
@@ -89,22 +194,110 @@ class Package:
 
     """RPM Package API."""
 
-    def __init__(self, path):
+    # Header tags the checks use, as stored in the header cache
+    TAGS = {
+        'name': rpm.RPMTAG_NAME,
+        'nvr': rpm.RPMTAG_NVR,
+        'require_names': rpm.RPMTAG_REQUIRENAME,
+        'require_nevrs': rpm.RPMTAG_REQUIRENEVRS,
+        'provide_names': rpm.RPMTAG_PROVIDENAME,
+        'files': rpm.RPMTAG_FILENAMES,
+        'file_modes': rpm.RPMTAG_FILEMODES,
+        'file_sizes': rpm.RPMTAG_FILESIZES,
+        'file_classes': rpm.RPMTAG_FILECLASS,
+        'payload_digests': rpm.RPMTAG_PAYLOADDIGEST,
+        'sigmd5': rpm.RPMTAG_SIGMD5,
+    }
+
+    # Binary tags of TAGS, decoded as hex strings
+    BINARY_TAGS = ('sigmd5',)
+
+    def __init__(self, path, cache=None, verify=True):
         """Given the path to the RPM package, initialize
         the RPM package header containing its metadata.
+
+        If a HeaderCache is given, the tags are loaded from it
+        and the header is only read on a cache miss.
+        With verify=False, signatures and digests are not checked.
         """
         self.filename = os.path.basename(path)
         self.path = path
         # To be populated in the first check.
         self.py_versions = None
+        self.hdr = None
+        self._cached = None
+
+        key = cache.key_for(path) if cache is not None else None
+        if key is not None:
+            self._cached = cache.get(key)
+            if self._cached is not None:
+                log.debug('{}: header loaded from cache'.format(
+                    self.filename))
+                return
 
         ts = rpm.TransactionSet()
+        if not verify:
+            ts.setVSFlags(rpm._RPMVSF_NOSIGNATURES | rpm._RPMVSF_NODIGESTS)
         with open(path, 'rb') as fdno:
             try:
                 self.hdr = ts.hdrFromFdno(fdno)
             except rpm.error as err:
                 raise PackageException('{}: {}'.format(self.filename, err))
 
+        if key is not None:
+            cache.put(key, {tag: self._tag(tag) for tag in self.TAGS})
+
+    @classmethod
+    def from_stream(cls, stream, path=None):
+        """Initialize the package from a binary file-like object or bytes.
+
+        Only the lead, the signature and the main header are read,
+        so a truncated download is enough as long as it contains the whole
+        header. Signatures are not verified. The package has no payload
+        to inspect unless path points to the complete RPM file,
+        its path is None then and the payload checks report
+        it was not scanned.
+        """
+        if isinstance(stream, (bytes, bytearray, memoryview)):
+            stream = io.BytesIO(stream)
+        if path is None and isinstance(getattr(stream, 'name', None), str):
+            path = stream.name
+
+        try:
+            signature, blob = read_headers(stream)
+            # librpm loads the header without its 8 bytes of magic
+            hdr = rpm.hdr(blob[8:])
+            # and merges the signature tags into it when reading a file
+            sigmd5 = get_binary(signature, RPMSIGTAG_MD5)
+            if sigmd5 is not None:
+                hdr[rpm.RPMTAG_SIGMD5] = sigmd5
+        except (HeaderError, rpm.error) as err:
+            raise PackageException('{}: {}'.format(path or '<stream>', err))
+
+        package = cls.__new__(cls)
+        package.hdr = hdr
+        package._cached = None
+        package.py_versions = None
+        package.path = path
+        if path is not None:
+            package.filename = os.path.basename(path)
+        else:
+            package.filename = '{}.{}.rpm'.format(
+                package.nvr,
+                'src' if hdr.isSource() else surrogate(hdr[rpm.RPMTAG_ARCH]))
+        return package
+
+    def _tag(self, tag):
+        """Return the decoded value of the tag (a key of TAGS)."""
+        if self._cached is not None:
+            return self._cached[tag]
+        value = self.hdr[self.TAGS[tag]]
+        if tag in self.BINARY_TAGS:
+            return value.hex() if value else None
+        if isinstance(value, list):
+            return [surrogate(item) for item in value]
+        return surrogate(value)
+
     @property
     def is_srpm(self):
         return self.filename.endswith('.src.rpm')
@@ -112,22 +305,171 @@ class Package:
     @property
     def name(self):
         """Package name as a string."""
-        return surrogate(self.hdr[rpm.RPMTAG_NAME])
+        return self._tag('name')
 
     @property
     def nvr(self):
         """Package name and version as a string."""
-        return surrogate(self.hdr[rpm.RPMTAG_NVR])
+        return self._tag('nvr')
 
     @property
     def require_names(self):
-        return [surrogate(r) for r in self.hdr[rpm.RPMTAG_REQUIRENAME]]
+        return self._tag('require_names')
 
     @property
     def require_nevrs(self):
-        return [surrogate(r) for r in self.hdr[rpm.RPMTAG_REQUIRENEVRS]]
+        return self._tag('require_nevrs')
+
+    @property
+    def provide_names(self):
+        return self._tag('provide_names')
 
     @property
     def files(self):
         """Package file names as a list of strings."""
-        return [surrogate(name) for name in self.hdr[rpm.RPMTAG_FILENAMES]]
+        return self._tag('files')
+
+    @property
+    def file_modes(self):
+        """Modes of the files, in the order of files."""
+        return self._tag('file_modes')
+
+    @property
+    def file_sizes(self):
+        """Sizes of the files in bytes, in the order of files."""
+        return self._tag('file_sizes')
+
+    @property
+    def file_classes(self):
+        """file(1) descriptions of the files, in the order of files,
+        empty if the package does not record them.
+        """
+        return self._tag('file_classes')
+
+    @property
+    def payload_digests(self):
+        """Digests of the compressed payload, empty for packages
+        built before RPM 4.14.
+        """
+        return self._tag('payload_digests')
+
+    @property
+    def sigmd5(self):
+        """MD5 of the header and the payload as a hex string or None."""
+        return self._tag('sigmd5')
+
+    @property
+    def payload_digest(self):
+        """Identifier of the payload: its digest from the header,
+        the MD5 from the signature for older packages or None.
+        """
+        if self.payload_digests:
+            return 'payload:{}'.format(self.payload_digests[0])
+        if self.sigmd5:
+            return 'sigmd5:{}'.format(self.sigmd5)
+        return None
+
+    def snapshot(self):
+        """Return a PackageSnapshot of this package."""
+        return PackageSnapshot.from_package(self)
+
+
+class PackageSnapshot:
+
+    """Compact and picklable RPM Package API.
+
+    The header tags are decoded only once, into tuples,
+    so the header can be dropped and the snapshot sent to other processes.
+    Can be used instead of Package in all the checks.
+    """
+
+    __slots__ = ('filename', 'path', 'py_versions') + tuple(Package.TAGS)
+
+    def __init__(self, filename, path, py_versions=None, **tags):
+        self.filename = filename
+        self.path = path
+        self.py_versions = py_versions
+        for tag in Package.TAGS:
+            value = tags[tag]
+            setattr(self, tag, tuple(value) if isinstance(value, list)
+                    else value)
+
+    @classmethod
+    def from_package(cls, package):
+        return cls(package.filename, package.path, package.py_versions,
+                   **{tag: getattr(package, tag) for tag in Package.TAGS})
+
+    @property
+    def is_srpm(self):
+        return self.filename.endswith('.src.rpm')
+
+    payload_digest = Package.payload_digest
+
+    def snapshot(self):
+        return self
+
+    def __repr__(self):
+        return '<{} {}>'.format(type(self).__name__, self.filename)
+
+
+def process_pool(max_workers):
+    """Return a pool of max_workers processes started by a fork server.
+
+    Workers forked from this process could inherit locks held by its
+    other threads (e.g. the one loading the repoquery), never released.
+
+    Return: (ProcessPoolExecutor) The pool
+    """
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context('forkserver'))
+
+
+POOLS = {
+    'process': process_pool,
+    'thread': concurrent.futures.ThreadPoolExecutor,
+}
+
+
+def _load_package(path, cache, verify, snapshot):
+    """Load a single package, return the package or the exception
+    and the CPU time it took. Runs in the pool workers, hence
+    it does not log the error itself.
+    """
+    cpu = time.thread_time()
+    try:
+        package = Package(path, cache=cache, verify=verify)
+    except PackageException as err:
+        return err, time.thread_time() - cpu
+    package = package.snapshot() if snapshot else package
+    return package, time.thread_time() - cpu
+
+
+def load_packages(paths, jobs=1, pool='process', cache=None, verify=True,
+                  snapshot=False):
+    """Load the RPM packages on given paths, optionally in a pool
+    of jobs workers (either 'process' or 'thread').
+    Packages that fail to load are logged and skipped.
+    With snapshot=True, PackageSnapshots are returned instead of Packages.
+
+    Return: (list) Packages in the order of paths
+    """
+    paths = list(paths)
+    args = (paths, itertools.repeat(cache), itertools.repeat(verify),
+            itertools.repeat(snapshot))
+    pooled = jobs > 1 and len(paths) > 1
+    if pooled:
+        with POOLS[pool](max_workers=jobs) as executor:
+            results = list(executor.map(_load_package, *args))
+    else:
+        results = list(map(_load_package, *args))
+
+    packages = []
+    for path, (result, cpu_time) in zip(paths, results):
+        if pooled:
+            add_worker_cpu_time(cpu_time)
+        if isinstance(result, PackageException):
+            log.error('{}: {}'.format(os.path.basename(path), result))
+        else:
+            packages.append(result)
+    return packages
@@ -0,0 +1,142 @@
+"""Minimal reader for the RPM file layout.
+
+An RPM file is a 96 bytes long lead, followed by a signature header
+(padded to 8 bytes), the main header and the payload.
+Only the parts needed to address a package without librpm are parsed here.
+"""
+
+import hashlib
+import struct
+
+LEAD_MAGIC = b'\xed\xab\xee\xdb'
+LEAD_SIZE = 96
+HEADER_MAGIC = b'\x8e\xad\xe8\x01'
+HEADER_INTRO = struct.Struct('>4s4xII')
+INDEX_ENTRY = struct.Struct('>iIiI')
+
+RPM_STRING_TYPE = 6
+RPM_BIN_TYPE = 7
+
+# Signature header tags
+RPMSIGTAG_SHA1 = 269
+RPMSIGTAG_SHA256 = 273
+RPMSIGTAG_MD5 = 1004
+
+
+class HeaderError(Exception):
+
+    """The data does not look like an RPM package."""
+
+
+def read_exactly(stream, size):
+    """Read exactly size bytes from the stream.
+
+    Raises: HeaderError if the stream ends prematurely
+    """
+    data = stream.read(size)
+    if len(data) != size:
+        raise HeaderError('truncated RPM: expected {} bytes, got {}'.format(
+            size, len(data)))
+    return data
+
+
+def read_lead(stream):
+    """Read and validate the RPM lead.
+
+    Return: (bytes) The lead
+    """
+    lead = read_exactly(stream, LEAD_SIZE)
+    if not lead.startswith(LEAD_MAGIC):
+        raise HeaderError('bad lead magic')
+    return lead
+
+
+def read_header(stream, pad=False):
+    """Read one header structure from the stream, including its magic.
+
+    The signature header is padded to a multiple of 8 bytes,
+    set pad to True to consume the padding as well.
+
+    Return: (bytes) The raw header
+    """
+    intro = read_exactly(stream, HEADER_INTRO.size)
+    magic, index_count, store_size = HEADER_INTRO.unpack(intro)
+    if magic != HEADER_MAGIC:
+        raise HeaderError('bad header magic')
+    size = index_count * INDEX_ENTRY.size + store_size
+    header = intro + read_exactly(stream, size)
+    if pad:
+        read_exactly(stream, -store_size % 8)
+    return header
+
+
+def read_headers(stream):
+    """Read the lead, the signature and the main header from the stream.
+    The stream is left positioned at the start of the payload,
+    which is never read.
+
+    Return: (tuple) The raw signature and main headers, including magic
+    """
+    read_lead(stream)
+    signature = read_header(stream, pad=True)
+    return signature, read_header(stream)
+
+
+def _find_entry(header, tag, entry_type):
+    """Return: (tuple) Offset of the data of the tag in the raw header
+    and its count or None
+
+    Raises: HeaderError if the entry points outside of the header
+    """
+    _, index_count, store_size = HEADER_INTRO.unpack_from(header)
+    store = HEADER_INTRO.size + index_count * INDEX_ENTRY.size
+    for position in range(index_count):
+        entry_tag, type_, offset, count = INDEX_ENTRY.unpack_from(
+            header, HEADER_INTRO.size + position * INDEX_ENTRY.size)
+        if entry_tag == tag and type_ == entry_type:
+            if not 0 <= offset < store_size or count > store_size - offset:
+                raise HeaderError('bad offset of tag {}'.format(tag))
+            return store + offset, count
+    return None
+
+
+def get_string(header, tag):
+    """Return the string value of the tag in the raw header or None."""
+    entry = _find_entry(header, tag, RPM_STRING_TYPE)
+    if entry is None:
+        return None
+    start, _ = entry
+    end = header.find(b'\0', start)
+    if end < 0:
+        raise HeaderError('unterminated string of tag {}'.format(tag))
+    try:
+        return header[start:end].decode('ascii')
+    except UnicodeDecodeError as err:
+        raise HeaderError('bad string of tag {}: {}'.format(tag, err))
+
+
+def get_binary(header, tag):
+    """Return the binary value of the tag in the raw header or None."""
+    entry = _find_entry(header, tag, RPM_BIN_TYPE)
+    if entry is None:
+        return None
+    start, count = entry
+    return header[start:start + count]
+
+
+def header_digest(stream):
+    """Return the digest of the main header, as recorded in the signature.
+
+    Only the lead and the signature header are read from the stream.
+    Packages without a header digest in their signature
+    are identified by the SHA-256 of the signature header instead.
+
+    Return: (str) Hexadecimal digest
+    """
+    read_lead(stream)
+    signature = read_header(stream)
+    for tag in RPMSIGTAG_SHA256, RPMSIGTAG_SHA1:
+        digest = get_string(signature, tag)
+        if digest:
+            return digest
+    return hashlib.sha256(signature).hexdigest()
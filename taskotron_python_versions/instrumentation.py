@@ -0,0 +1,169 @@
+import collections
+import contextlib
+import cProfile
+import functools
+import json
+import logging
+import os
+import resource
+import threading
+import time
+
+# the logger of common, which measures the package loading
+log = logging.getLogger('python-versions')
+
+# The measurement of the current thread
+_local = threading.local()
+
+# Measurements in progress: thread ident of each
+_active = {}
+_active_lock = threading.Lock()
+
+
+def peak_rss():
+    """Return the peak resident set size of this process in KiB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def current_rss():
+    """Return the current resident set size of this process in KiB,
+    the peak one where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return peak_rss()
+    return pages * resource.getpagesize() // 1024
+
+
+class Measurement:
+
+    """Resources used by a single measured step (usually a subcheck).
+
+    counters hold the number of external calls made, e.g. DNF queries.
+    worker_cpu_time is the CPU time spent in pool workers on behalf
+    of the step, it is not part of cpu_time. The peak RSS is shared
+    by the whole process, so peak_rss_delta is None if steps were
+    measured in other threads meanwhile.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.wall_time = None
+        self.cpu_time = None
+        self.worker_cpu_time = 0.0
+        self.peak_rss_delta = None
+        self.concurrent = False
+        self.profile_skipped = False
+        self.counters = collections.Counter()
+
+    def as_dict(self):
+        """Return: (dict) The measured values, suitable for keyvals"""
+        values = {
+            'wall_time': round(self.wall_time, 6),
+            'cpu_time': round(self.cpu_time, 6),
+        }
+        if self.worker_cpu_time:
+            values['worker_cpu_time'] = round(self.worker_cpu_time, 6)
+        if self.peak_rss_delta is not None:
+            values['peak_rss_delta_kib'] = self.peak_rss_delta
+        if self.profile_skipped:
+            values['profile_skipped'] = True
+        values.update(self.counters)
+        return values
+
+
+def count(counter, n=1):
+    """Add n to the counter of the step measured in this thread, if any."""
+    measurement = getattr(_local, 'measurement', None)
+    if measurement is not None:
+        measurement.counters[counter] += n
+
+
+def add_worker_cpu_time(seconds):
+    """Add the CPU time a pool worker spent on behalf of the step
+    measured in this thread, if any.
+    """
+    measurement = getattr(_local, 'measurement', None)
+    if measurement is not None:
+        measurement.worker_cpu_time += seconds
+
+
+def bind_measurement(func):
+    """Return func counting into the measurement of this thread,
+    wherever it is called, e.g. in a helper thread.
+    """
+    measurement = getattr(_local, 'measurement', None)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_local, 'measurement', None)
+        _local.measurement = measurement
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.measurement = previous
+    return wrapper
+
+
+@contextlib.contextmanager
+def measure(name, profile_dir=None):
+    """Measure the wall time, CPU time, peak RSS growth and external calls
+    of the code run in this block. If profile_dir is given,
+    dump the cProfile data into <profile_dir>/<name>.prof.
+
+    CPU time is measured for the current thread only, the peak RSS growth
+    only if no other thread measures anything meanwhile.
+
+    Yield: (Measurement) Populated once the block is finished
+    """
+    measurement = Measurement(name)
+    previous = getattr(_local, 'measurement', None)
+    _local.measurement = measurement
+    ident = threading.get_ident()
+    with _active_lock:
+        for other, other_ident in _active.items():
+            if other_ident != ident:
+                other.concurrent = measurement.concurrent = True
+        _active[measurement] = ident
+
+    profiler = None
+    if profile_dir is not None:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as err:
+            # Only one profiler may be active at once on new Pythons
+            log.warning('Profile of {} skipped, it runs concurrently with '
+                        'another profiled step: {}'.format(name, err))
+            measurement.profile_skipped = True
+            profiler = None
+
+    rss = peak_rss()
+    cpu = time.thread_time()
+    wall = time.monotonic()
+    try:
+        yield measurement
+    finally:
+        measurement.wall_time = time.monotonic() - wall
+        measurement.cpu_time = time.thread_time() - cpu
+        with _active_lock:
+            del _active[measurement]
+        if not measurement.concurrent:
+            measurement.peak_rss_delta = peak_rss() - rss
+        _local.measurement = previous
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(str(profile_dir), exist_ok=True)
+            profiler.dump_stats(os.path.join(str(profile_dir),
+                                             name + '.prof'))
+        log.debug('{} took {:.3f} s (CPU {:.3f} s)'.format(
+            name, measurement.wall_time, measurement.cpu_time))
+
+
+def write_timing(path, measurements):
+    """Write the measurements into a JSON file on the given path."""
+    with open(str(path), 'w') as f:
+        json.dump({m.name: m.as_dict() for m in measurements},
+                  f, indent=2, sort_keys=True)
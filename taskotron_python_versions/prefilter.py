@@ -0,0 +1,37 @@
+import itertools
+
+from .two_three import NAME_STARTS, NAME_EXACTS
+from .unversioned_shebangs import FORBIDDEN_SHEBANGS, shebang_to_require
+
+
+# Names without "python" that the subchecks still consider
+PYTHON_STARTS = tuple(itertools.chain.from_iterable(NAME_STARTS.values()))
+PYTHON_EXACTS = tuple(itertools.chain.from_iterable(NAME_EXACTS.values()))
+# Scripts of packages requiring these are scanned for forbidden shebangs
+SHEBANG_REQUIRES = tuple(shebang_to_require(shebang)
+                         for shebang in FORBIDDEN_SHEBANGS)
+
+
+def python_related(name):
+    """Check if the name of a Require, a Provide or a file
+    could have anything to do with Python.
+
+    Return: (bool) True if it could, False if it certainly has not
+    """
+    return (
+        'python' in name.lower() or
+        name.startswith(PYTHON_STARTS) or
+        name in PYTHON_EXACTS or
+        name in SHEBANG_REQUIRES)
+
+
+def involves_python(package):
+    """Check if any Require, Provide or file of the package could have
+    anything to do with Python, so the subchecks need to inspect it.
+
+    Return: (bool) True if it could, False if it certainly has not
+    """
+    names = itertools.chain(package.require_names,
+                            package.provide_names,
+                            package.files)
+    return any(python_related(name) for name in names)
@@ -0,0 +1,343 @@
+"""Offline index of the provides of a Fedora release.
+
+Loading the DNF sack of a release takes tens of seconds and hundreds of MB,
+the index answers which packages provide a name from a small SQLite file.
+Export or refresh it with:
+
+    python3 -m taskotron_python_versions.provides_index RELEASE PATH
+
+The revision of each repository is stored in the index. On refresh, only
+the repomd.xml (or the metalink) of the repositories is fetched and only
+the repositories that changed since are loaded and replaced.
+"""
+
+import collections
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import threading
+import urllib.request
+import xml.etree.ElementTree as ET
+
+from .common import log
+from .instrumentation import count
+from .repoquery import DNFQuery, provides_of
+from .repos import provides_index_path, repo_sources, repo_url
+
+SCHEMA = """
+CREATE TABLE provides (
+    provide TEXT NOT NULL,
+    package TEXT NOT NULL,
+    repo TEXT NOT NULL
+);
+CREATE INDEX provides_provide ON provides (provide);
+CREATE TABLE repos (
+    repo TEXT PRIMARY KEY,
+    revision TEXT NOT NULL
+);
+"""
+
+REPO_NS = '{http://linux.duke.edu/metadata/repo}'
+METALINK_NS = '{http://www.metalinker.org/}'
+
+# seconds
+FETCH_TIMEOUT = 60
+
+# Mimics the hawkey package, get_versioned_name() only needs the name
+Provider = collections.namedtuple('Provider', 'name')
+
+
+def _write_index(path, update, base=None):
+    """Write the index on the given path by calling update with
+    an open connection. The index is written to a temporary file first,
+    so readers never see it incomplete.
+
+    base: path to an index to start with, instead of an empty one
+    """
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    if base is not None:
+        shutil.copyfile(str(base), tmp)
+    connection = sqlite3.connect(tmp)
+    try:
+        with connection:
+            if base is None:
+                connection.executescript(SCHEMA)
+            update(connection)
+        connection.close()
+        os.replace(tmp, str(path))
+    except BaseException:
+        connection.close()
+        os.unlink(tmp)
+        raise
+
+
+def _insert_query(connection, query):
+    for package in query:
+        connection.executemany(
+            'INSERT INTO provides VALUES (?, ?, ?)',
+            ((provide, package.name, package.reponame)
+             for provide in sorted(provides_of(package))))
+
+
+def export_query(query, path, revisions=None):
+    """Export the provides of all the packages of a hawkey query
+    into a new index on the given path.
+
+    revisions: (dict) reponame: revision of the exported repositories
+    """
+    def update(connection):
+        _insert_query(connection, query)
+        connection.executemany('INSERT INTO repos VALUES (?, ?)',
+                               sorted((revisions or {}).items()))
+
+    _write_index(path, update)
+
+
+def update_index(path, query, revisions, removed=()):
+    """Replace the provides of the repositories in the existing index
+    on the given path by those of the hawkey query.
+    The provides of other repositories are kept untouched.
+
+    revisions: (dict) reponame: revision of the repositories in query
+    removed: reponames to drop from the index
+    """
+    def update(connection):
+        for repo in sorted(set(revisions) | set(removed)):
+            connection.execute('DELETE FROM provides WHERE repo = ?', (repo,))
+            connection.execute('DELETE FROM repos WHERE repo = ?', (repo,))
+        _insert_query(connection, query)
+        connection.executemany('INSERT INTO repos VALUES (?, ?)',
+                               sorted(revisions.items()))
+
+    _write_index(path, update, base=path)
+
+
+def read_revisions(path):
+    """Return: (dict) reponame: revision of the repositories in the index
+    on the given path, empty if there is no index or it has no revisions
+    """
+    if not os.path.exists(str(path)):
+        return {}
+    connection = sqlite3.connect('file:{}?mode=ro'.format(path), uri=True)
+    try:
+        return dict(connection.execute('SELECT repo, revision FROM repos'))
+    except sqlite3.OperationalError:
+        # exported before revisions were stored
+        return {}
+    finally:
+        connection.close()
+
+
+def _fetch(url):
+    with urllib.request.urlopen(url, timeout=FETCH_TIMEOUT) as response:
+        return response.read()
+
+
+def repomd_revision(repomd):
+    """Return: (str) Revision of the repomd.xml content, changed whenever
+    the primary metadata (where the provides are) changes;
+    new revisions of other metadata, e.g. updateinfo, are ignored
+    """
+    root = ET.fromstring(repomd)
+    for data in root.iter(REPO_NS + 'data'):
+        if data.get('type') == 'primary':
+            checksum = data.findtext(REPO_NS + 'checksum')
+            return 'repomd:{}'.format(checksum.strip())
+    raise ValueError('no primary metadata in repomd.xml')
+
+
+def metalink_revision(metalink):
+    """Return: (str) Revision of the repomd.xml described by the metalink"""
+    root = ET.fromstring(metalink)
+    for file_ in root.iter(METALINK_NS + 'file'):
+        if file_.get('name') == 'repomd.xml':
+            for hash_ in file_.iter(METALINK_NS + 'hash'):
+                if hash_.get('type') == 'sha256':
+                    return 'metalink:{}'.format(hash_.text.strip())
+    raise ValueError('no repomd.xml checksum in metalink')
+
+
+# $basearch of the machines DNF maps to another architecture,
+# used when the dnf module is not available
+BASEARCHES = {
+    'i486': 'i386',
+    'i586': 'i386',
+    'i686': 'i386',
+    'athlon': 'i386',
+    'amd64': 'x86_64',
+    'armv7l': 'armhfp',
+    'armv7hl': 'armhfp',
+    'armv6l': 'armhfp',
+    'ppc64p7': 'ppc64',
+    'sparc64v': 'sparc',
+}
+
+
+def basearch():
+    """Return: (str) Base architecture of this machine, as DNF substitutes
+    for $basearch in the repository configuration
+    """
+    try:
+        import dnf.rpm
+        import hawkey
+    except ImportError:
+        machine = platform.machine()
+        return BASEARCHES.get(machine, machine)
+    return dnf.rpm.basearch(hawkey.detect_arch())
+
+
+def repo_revision(repourl, release, arch=None):
+    """Fetch the revision of the repository, only its repomd.xml
+    (or the metalink describing it) is downloaded.
+
+    repourl: source of the repository, as in the repository configuration
+    arch: base architecture substituted for $basearch,
+          by default the one of this machine
+
+    Return: (str) Revision of the repository
+    """
+    kind, url = repo_url(repourl)
+    url = url.replace('$releasever', release)
+    url = url.replace('$basearch', arch or basearch())
+    if kind == 'metalink':
+        return metalink_revision(_fetch(url))
+    return repomd_revision(_fetch(url.rstrip('/') + '/repodata/repomd.xml'))
+
+
+def refresh_index(path, release, sources=None):
+    """Bring the index on the given path up to date with the repositories
+    of the release. Only the repositories with a new revision are loaded
+    and replaced, the index is created if it does not exist yet.
+
+    sources: (dict) reponame: source of the repository;
+             by default the configured sources of the release
+
+    Return: (list) Names of the repositories loaded
+    """
+    sources = sources or repo_sources(release)
+    revisions = {reponame: repo_revision(repourl, release)
+                 for reponame, repourl in sorted(sources.items())}
+    stored = read_revisions(path)
+    changed = sorted(reponame for reponame in sources
+                     if stored.get(reponame) != revisions[reponame])
+    removed = sorted(set(stored) - set(sources))
+    if not changed and not removed:
+        log.info('Provides index {} is up to date'.format(path))
+        return []
+
+    query = []
+    if changed:
+        log.info('Loading changed repositories: {}'.format(
+            ', '.join(changed)))
+        repoquery = DNFQuery(release, sources={reponame: sources[reponame]
+                                               for reponame in changed})
+        query = repoquery.query
+        if query is None:
+            raise RuntimeError('Could not load the repositories of {}'.format(
+                release))
+    revisions = {reponame: revisions[reponame] for reponame in changed}
+    if stored:
+        update_index(path, query, revisions, removed)
+    else:
+        export_query(query, path, revisions)
+    return changed
+
+
+class ProvidesIndex:
+
+    """Provides index API.
+
+    Can be used instead of DNFQuery as a repoquery.
+    """
+
+    # Older SQLite allows at most 999 parameters in a statement
+    BATCH = 500
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._connection = None
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            uri = 'file:{}?mode=ro'.format(self.path)
+            self._connection = sqlite3.connect(uri, uri=True,
+                                               check_same_thread=False)
+        return self._connection
+
+    def get_packages_by(self, provides):
+        """Return the packages providing the given name, like hawkey would.
+
+        Return: (list of Provider) Packages providing it
+        """
+        count('index_queries')
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT package FROM provides WHERE provide = ? '
+                'GROUP BY package ORDER BY MIN(rowid)', (provides,))
+            return [Provider(name=name) for name, in rows]
+
+    def get_providers(self, names):
+        """Return the packages providing any of the names,
+        using a single lookup per BATCH names.
+
+        Return: (dict) name: list of Providers
+        """
+        names = sorted(set(names))
+        providers = {name: [] for name in names}
+        for start in range(0, len(names), self.BATCH):
+            batch = names[start:start + self.BATCH]
+            count('index_queries')
+            with self._lock:
+                rows = self.connection.execute(
+                    'SELECT provide, package FROM provides '
+                    'WHERE provide IN ({}) GROUP BY provide, package '
+                    'ORDER BY MIN(rowid)'.format(', '.join('?' * len(batch))),
+                    batch)
+                for provide, name in rows:
+                    providers[provide].append(Provider(name=name))
+        return providers
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def local_repoquery(release):
+    """Return: (DNFQuery or ProvidesIndex) A new query of the release,
+    answered in this process
+    """
+    index = provides_index_path(release)
+    if index is not None:
+        log.debug('Using provides index {}'.format(index))
+        return ProvidesIndex(index)
+    return DNFQuery(release)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print('Usage: python3 -m {} RELEASE PATH'.format(__spec__.name),
+              file=sys.stderr)
+        return 2
+    release, path = argv
+
+    try:
+        changed = refresh_index(path, release)
+    except (OSError, ValueError, ET.ParseError, RuntimeError) as err:
+        log.error('Could not refresh {}: {}'.format(path, err))
+        return 1
+    if changed:
+        log.info('Provides of {} exported to {}'.format(
+            ', '.join(changed), path))
+    return 0
+
+
+if __name__ == '__main__':
+    import logging
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
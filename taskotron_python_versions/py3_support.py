@@ -1,6 +1,15 @@
+import collections
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+
 import bugzilla
 
 from .common import log, write_to_artifact, packages_by_version
+from .instrumentation import bind_measurement, count
 
 
 INFO_URL = 'https://fedoraproject.org/wiki/Packaging:Python'
@@ -55,18 +64,253 @@ def filter_urls(bugs):
     return [bug.weburl for bug in bugs if not ignored(bug)]
 
 
+# Idle Bugzilla sessions, reused by all the runs in this process
+_bzapis = []
+_bzapis_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def bugzilla_session():
+    """Borrow a Bugzilla session, a new one is created if all are in use.
+    Sessions that failed are not reused.
+
+    Yield: (bugzilla.Bugzilla) The session
+    """
+    with _bzapis_lock:
+        bzapi = _bzapis.pop() if _bzapis else None
+    if bzapi is None:
+        bzapi = bugzilla.Bugzilla(BUGZILLA_URL, cookiefile=None,
+                                  tokenfile=None)
+    yield bzapi
+    with _bzapis_lock:
+        _bzapis.append(bzapi)
+
+
+class BugzillaTimeout(Exception):
+
+    """Bugzilla did not answer before the deadline."""
+
+
+# seconds a Bugzilla lookup may take or None
+_deadline = 60
+
+
+def set_bugzilla_deadline(deadline):
+    """Give up Bugzilla lookups after deadline seconds, None to wait."""
+    global _deadline
+    _deadline = deadline
+
+
+def call_with_deadline(func, *args, deadline=None):
+    """Call func in a helper thread and wait for deadline seconds at most.
+    The thread cannot be stopped, it is left to finish in the background.
+
+    Raises: BugzillaTimeout if the deadline expires
+    Return: The return value of func
+    """
+    if deadline is None:
+        return func(*args)
+    result = {}
+    func = bind_measurement(func)
+
+    def target():
+        try:
+            result['value'] = func(*args)
+        except Exception as err:
+            result['error'] = err
+
+    thread = threading.Thread(target=target, name='bugzilla', daemon=True)
+    thread.start()
+    thread.join(deadline)
+    if thread.is_alive():
+        raise BugzillaTimeout('Bugzilla did not answer in {} s'.format(
+            deadline))
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+
+# The fields of tracked bugs needed by ignored() and filter_urls()
+TrackerBug = collections.namedtuple(
+    'TrackerBug', 'id, component, status, blocks, weburl')
+
+# weburl is computed from the id by python-bugzilla
+BUG_FIELDS = ['id', 'status', 'blocks']
+SNAPSHOT_FIELDS = BUG_FIELDS + ['component']
+
+
+def bug_url(bug_id):
+    """Return: (str) Web URL of the bug"""
+    return 'https://{}/show_bug.cgi?id={}'.format(BUGZILLA_URL, bug_id)
+
+
+# Bugs fetched per query, Bugzilla caps the results of a single query
+SNAPSHOT_PAGE = 500
+
+
+def fetch_tracker_bugs(bzapi, page=SNAPSHOT_PAGE):
+    """Fetch all the bugs blocking PY3_TRACKER_BUG, page bugs per query,
+    with the fields needed to filter them only.
+
+    Return: (dict) component: list of TrackerBugs
+    """
+    query = bzapi.build_query(product="Fedora",
+                              include_fields=SNAPSHOT_FIELDS)
+    query['blocks'] = PY3_TRACKER_BUG
+    query['limit'] = page
+    bugs = collections.defaultdict(list)
+    offset = 0
+    while True:
+        query['offset'] = offset
+        count('bugzilla_queries')
+        results = bzapi.query(query)
+        for bug in results:
+            components = bug.component
+            if isinstance(components, str):
+                components = [components]
+            for component in components:
+                bugs[component].append(TrackerBug(
+                    bug.id, component, bug.status, list(bug.blocks),
+                    bug_url(bug.id)))
+        # a short page is the last one
+        if len(results) < page:
+            return dict(bugs)
+        offset += len(results)
+
+
+class TrackerSnapshot:
+
+    """All bugs blocking PY3_TRACKER_BUG, indexed by component
+    and stored in a JSON file on the given path.
+
+    The file is fetched again when older than ttl seconds.
+    It is replaced atomically, so several processes can share it.
+    A failed fetch is remembered in failure and not retried
+    until it is cleared.
+    """
+
+    def __init__(self, path, ttl=60 * 60):
+        self.path = str(path)
+        self.ttl = ttl
+        self.failure = None
+        self._bugs = None
+        self._loaded = 0
+        self._lock = threading.Lock()
+
+    def _fresh(self, timestamp):
+        return time.time() - timestamp <= self.ttl
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as err:
+            log.warning('Ignoring corrupted snapshot {}: {}'.format(
+                self.path, err))
+            return None
+        if data.get('tracker') != PY3_TRACKER_BUG or \
+                not self._fresh(data['time']):
+            return None
+        return data
+
+    def _write(self, data):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def bugs(self):
+        """Return: (dict) component: list of TrackerBugs,
+        fetched from Bugzilla if the snapshot is too old
+        """
+        with self._lock:
+            if self._bugs is None or not self._fresh(self._loaded):
+                data = self._read()
+                if data is None:
+                    if self.failure is not None:
+                        raise self.failure
+                    log.info('Fetching Python 3 tracker snapshot')
+                    try:
+                        with bugzilla_session() as bzapi:
+                            bugs = fetch_tracker_bugs(bzapi)
+                    except Exception as err:
+                        self.failure = err
+                        raise
+                    data = {
+                        'tracker': PY3_TRACKER_BUG,
+                        'time': time.time(),
+                        'bugs': {component: [bug._asdict() for bug in items]
+                                 for component, items in bugs.items()},
+                    }
+                    self._write(data)
+                self._bugs = {
+                    component: [TrackerBug(**bug) for bug in items]
+                    for component, items in data['bugs'].items()}
+                self._loaded = data['time']
+            return self._bugs
+
+    def bugs_for(self, component):
+        """Return: (list) TrackerBugs of the component"""
+        return self.bugs().get(component, [])
+
+
+# Tracker snapshot used instead of querying each component, or None
+_snapshot = None
+
+
+def use_tracker_snapshot(path, ttl=None):
+    """Look up bugs in a snapshot of the tracker stored on the path,
+    refreshed after ttl seconds. Pass None to query Bugzilla
+    for each component. A snapshot that failed to be fetched
+    in the previous run is tried again.
+    """
+    global _snapshot
+    if path is None:
+        _snapshot = None
+    elif _snapshot is None or _snapshot.path != str(path):
+        _snapshot = TrackerSnapshot(path)
+    if _snapshot is not None:
+        _snapshot.failure = None
+        if ttl is not None:
+            _snapshot.ttl = ttl
+
+
 def get_py3_bugzillas_for(srpm_name):
     """Fetch all Bugzillas for the package given it's SRPM name,
-    which are tracked by PY3_TRACKER_BUG.
+    which are tracked by PY3_TRACKER_BUG. They are looked up
+    in the tracker snapshot, if used.
 
+    Raises: BugzillaTimeout if Bugzilla does not answer in time
     Return: (list) List of Bugzilla URLs
     """
-    bzapi = bugzilla.Bugzilla(BUGZILLA_URL, cookiefile=None, tokenfile=None)
-    query = bzapi.build_query(
-        product="Fedora",
-        component=srpm_name)
-    query['blocks'] = PY3_TRACKER_BUG
-    bugs = bzapi.query(query)
+    return call_with_deadline(_get_py3_bugzillas_for, srpm_name,
+                              deadline=_deadline)
+
+
+def _get_py3_bugzillas_for(srpm_name):
+    if _snapshot is not None:
+        try:
+            return filter_urls(_snapshot.bugs_for(srpm_name))
+        except Exception as err:
+            log.warning('Tracker snapshot not available, '
+                        'querying Bugzilla: {}'.format(err))
+
+    with bugzilla_session() as bzapi:
+        query = bzapi.build_query(
+            product="Fedora",
+            component=srpm_name,
+            include_fields=BUG_FIELDS)
+        query['blocks'] = PY3_TRACKER_BUG
+        count('bugzilla_queries')
+        bugs = bzapi.query(query)
     return filter_urls(bugs)
 
 
@@ -96,14 +340,20 @@ def task_py3_support(packages, koji_build, artifact):
 
     srpm, packages = packages[0], packages[1:]
     if not ported_to_py3(packages):
-        bugzilla_urls = get_py3_bugzillas_for(srpm.name)
+        try:
+            bugzilla_urls = get_py3_bugzillas_for(srpm.name)
+        except BugzillaTimeout as err:
+            # better an INFO than a stalled task
+            outcome = 'INFO'
+            bugzilla_urls = []
+            log.warning('{}, skipping Py3 support check'.format(err))
         if bugzilla_urls:
             outcome = 'FAILED'
             log.error(
                 'This software supports Python 3 upstream,'
                 ' but is not packaged for Python 3 in Fedora')
             message = ', '.join(bugzilla_urls)
-        else:
+        elif outcome != 'INFO':
             log.info(
                 'This software does not support Python 3'
                 ' upstream, skipping Py3 support check')
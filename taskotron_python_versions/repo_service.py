@@ -0,0 +1,287 @@
+"""Local service answering provides lookups of Fedora releases.
+
+Each check process would otherwise load its own copy of the DNF sack.
+The service holds one repoquery per release and answers the lookups
+of all the check processes of the host over a Unix socket. Start it with:
+
+    python3 -m taskotron_python_versions.repo_service [SOCKET]
+
+The protocol is JSON lines, a request is
+{"release": "29", "provides": ["python-foo", ...]}, answered by
+{"providers": {"python-foo": ["python2-foo", ...], ...}}
+or {"error": "..."}.
+"""
+
+import argparse
+import collections
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+
+from .common import log
+from .instrumentation import count
+from .provides_index import Provider, local_repoquery
+from .repoquery import DNFQuery, RepoQueryPool
+from .repos import configure_repos, use_provides_indexes
+
+DEFAULT_SOCKET = '/run/taskotron-python-versions/repo.sock'
+
+# seconds; the service may need to load the sack of the release first
+TIMEOUT = 300
+CONNECT_TIMEOUT = 1
+
+
+class RepoServiceError(Exception):
+
+    """The repo service could not answer the request."""
+
+
+class RepoServiceClient:
+
+    """Repoquery API of a release, answered by the service.
+
+    Falls back to a local repoquery if the service goes away.
+    """
+
+    def __init__(self, path, release):
+        self.path = str(path)
+        self.release = release
+        self._lock = threading.Lock()
+        self._socket = None
+        self._file = None
+        self._fallback = None
+
+    @classmethod
+    def connect(cls, path, release):
+        """Return: (RepoServiceClient) Client connected to the service
+        or None if the service is not running
+        """
+        if not os.path.exists(str(path)):
+            return None
+        client = cls(path, release)
+        try:
+            client._connect()
+        except OSError as err:
+            log.warning('Repo service {} is not available: {}'.format(
+                path, err))
+            return None
+        log.debug('Using repo service {} for {}'.format(path, release))
+        return client
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(CONNECT_TIMEOUT)
+            sock.connect(self.path)
+            sock.settimeout(TIMEOUT)
+        except OSError:
+            sock.close()
+            raise
+        self._socket = sock
+        self._file = sock.makefile('rb')
+
+    def _request(self, request):
+        with self._lock:
+            if self._socket is None:
+                self._connect()
+            self._socket.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            line = self._file.readline()
+        if not line:
+            raise ConnectionError('repo service closed the connection')
+        response = json.loads(line.decode('utf-8'))
+        if 'error' in response:
+            raise RepoServiceError(response['error'])
+        return response
+
+    def get_packages_by(self, provides):
+        """Return the packages providing the given name, like hawkey would.
+
+        Return: (list of Provider) Packages providing it
+        """
+        return self.get_providers([provides])[provides]
+
+    def get_providers(self, names):
+        """Return the packages providing any of the names,
+        using a single request.
+
+        Return: (dict) name: list of Providers
+        """
+        names = sorted(set(names))
+        if self._fallback is None:
+            count('service_queries')
+            try:
+                response = self._request(
+                    {'release': self.release, 'provides': names})
+            except (OSError, RepoServiceError) as err:
+                log.warning('Repo service {} failed, loading the repoquery '
+                            'of {} locally: {}'.format(
+                                self.path, self.release, err))
+                self.close()
+                self._fallback = local_repoquery(self.release)
+            else:
+                return {name: [Provider(name=package)
+                               for package in response['providers'][name]]
+                        for name in names}
+        return self._fallback.get_providers(names)
+
+    @property
+    def loaded(self):
+        """False if the local fallback failed to load the repositories,
+        the service reports its failures as errors.
+        """
+        return getattr(self._fallback, 'loaded', True)
+
+    def close(self):
+        with self._lock:
+            if self._socket is not None:
+                self._file.close()
+                self._socket.close()
+                self._socket = self._file = None
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    """Answer the requests of one client connection."""
+
+    def setup(self):
+        super().setup()
+        with self.server._connections_lock:
+            self.server._connections.add(self.request)
+
+    def finish(self):
+        with self.server._connections_lock:
+            self.server._connections.discard(self.request)
+        super().finish()
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+                providers = self.server.resolve(request['release'],
+                                                request['provides'])
+                response = {'providers': providers}
+            except Exception as err:
+                log.exception('Failed to answer {!r}'.format(line))
+                response = {'error': str(err)}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class RepoService(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    """Unix socket server holding one repoquery per release,
+    at most budget KiB of them if given.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, budget=None):
+        path = str(path)
+        if os.path.exists(path):
+            # left behind by a previous service
+            os.unlink(path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.repoqueries = RepoQueryPool(budget)
+        # hawkey queries are not thread safe, but loading the sack
+        # of one release must not hold up the clients of the others
+        self._locks = collections.defaultdict(threading.Lock)
+        self._locks_lock = threading.Lock()
+        # open client connections, closed with the service
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+        super().__init__(path, RequestHandler)
+
+    def lock(self, release):
+        """Return: (threading.Lock) Lock of the repoquery of the release"""
+        with self._locks_lock:
+            return self._locks[release]
+
+    def repoquery(self, release):
+        """Return: (DNFQuery or ProvidesIndex) The query of the release"""
+        return self.repoqueries.get(release, local_repoquery)
+
+    def resolve(self, release, names):
+        """Return: (dict) name: names of the packages providing it"""
+        if not names:
+            return {}
+        release = str(release)
+        with self.lock(release):
+            repoquery = self.repoquery(release)
+            if isinstance(repoquery, DNFQuery):
+                # load the sack now, see below
+                repoquery.query
+            # a release failing to load falls back to rawhide
+            # and shares its sack, so hold the lock of rawhide as well
+            queried = str(getattr(repoquery, 'release', release))
+            if queried == release:
+                providers = repoquery.get_providers(names)
+            else:
+                with self.lock(queried):
+                    providers = repoquery.get_providers(names)
+        if not getattr(repoquery, 'loaded', True):
+            # let the client try on its own rather than answer nothing
+            raise RuntimeError('repositories of {} not loaded'.format(
+                release))
+        return {name: [package.name for package in packages]
+                for name, packages in providers.items()}
+
+    def server_close(self):
+        super().server_close()
+        # the handler threads would keep answering the connected clients
+        with self._connections_lock:
+            for connection in self._connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass  # closed by the client meanwhile
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def parse_args(argv=None):
+    '''Parse the command line arguments'''
+    parser = argparse.ArgumentParser(
+        description='Answer provides lookups of Fedora releases '
+                    'for the python-versions checks')
+    parser.add_argument('socket', nargs='?', default=DEFAULT_SOCKET)
+    parser.add_argument('--repo-config', metavar='FILE',
+                        help='INI file with local repositories of releases')
+    parser.add_argument('--provides-index', metavar='DIR',
+                        help='look up provides in DIR/<release>.sqlite '
+                             'indexes when available')
+    parser.add_argument('--budget', type=int, metavar='MIB',
+                        help='keep at most MIB of loaded repositories, '
+                             'dropping the least recently used')
+    parser.add_argument('--preload', metavar='RELEASE', action='append',
+                        default=[],
+                        help='load the repoquery of RELEASE on start')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    configure_repos(args.repo_config)
+    use_provides_indexes(args.provides_index)
+
+    server = RepoService(args.socket, budget=None if args.budget is None
+                         else args.budget * 1024)
+    for release in args.preload:
+        log.info('Loading repoquery of {}'.format(release))
+        server.resolve(release, ['python'])
+    log.info('Serving on {}'.format(args.socket))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    import logging
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,301 @@
+"""Queries of the packages available in the repositories of a release."""
+
+import collections
+import threading
+
+from .common import log
+from .instrumentation import count, current_rss
+from .repos import repo_sources, repo_url
+
+
+def provides_of(package):
+    """Return: (set) Names provided by the hawkey package"""
+    # e.g. "python2-six = 1.11.0-3.fc29" or "config(foo)"
+    return {str(reldep).split(' ', 1)[0] for reldep in package.provides}
+
+
+class DNFQuery:
+
+    """DNF Qeuery API.
+
+    Initializes the query only when needed
+    and saves it for reuse.
+
+    sources: (dict) reponame: source of the repository, either a URL
+             or a local directory with repodata; by default the
+             configured sources of the release or the Fedora metalinks
+    """
+
+    def __init__(self, release, sources=None):
+        self.release = release
+        self.sources = sources
+        self._query = None
+        # KiB the loaded sack takes, measured as the RSS growth
+        self.memory = 0
+        # held while the query is being loaded
+        self._lock = threading.Lock()
+        # held shortly to store or drop the loaded query, never while loading
+        self._state_lock = threading.Lock()
+        # bumped when the query is dropped, so a load in progress
+        # does not store it back
+        self._generation = 0
+        self._cancelled = threading.Event()
+        # called with a release to get its shared repoquery,
+        # set by the RepoQueryPool holding this one
+        self.sibling = None
+
+    @property
+    def query(self):
+        with self._lock:
+            if not self._query:
+                return self._load()
+            return self._query
+
+    def _load(self, cancelled=None):
+        """Load the query, with the lock held. The query is not kept,
+        if it was dropped meanwhile.
+        """
+        with self._state_lock:
+            generation = self._generation
+        query = self.get_dnf_query(cancelled)
+        with self._state_lock:
+            if generation == self._generation:
+                self._query = query
+            else:
+                log.debug('Repoquery of {} dropped while loading'.format(
+                    self.release))
+                self.memory = 0
+        return query
+
+    def prefetch(self):
+        """Start loading the query in a background thread,
+        accessing the query then waits for it to finish.
+        """
+        if self._query:
+            return
+        self._cancelled.clear()
+        thread = threading.Thread(target=self._prefetch,
+                                  name='prefetch-{}'.format(self.release),
+                                  daemon=True)
+        thread.start()
+
+    def _prefetch(self):
+        with self._lock:
+            if self._query or self._cancelled.is_set():
+                return
+            try:
+                self._load(self._cancelled)
+            except Exception as err:
+                # the query is loaded again when accessed
+                log.warning('Failed to prefetch repoquery for {}: {}'.format(
+                    self.release, err))
+
+    def cancel_prefetch(self):
+        """Stop loading the query in the background, if it did not get
+        to loading the sack yet. Only the repository metadata downloads
+        are skipped, a sack being loaded is loaded anyway.
+        """
+        self._cancelled.set()
+
+    @property
+    def loaded(self):
+        """True unless the repositories failed to load, in which case
+        the lookups return no packages. Does not load them.
+        """
+        return self._query is not None
+
+    def get_packages_by(self, **kwargs):
+        """Return the result of the DNF query execution,
+        filtered by kwargs.
+        """
+        query = self.query
+        if query is not None:
+            count('dnf_queries')
+            return query.filter(**kwargs).run()
+        else:
+            log.debug('No query, we continue, but it is bad...')
+            return []
+
+    def get_providers(self, names):
+        """Return the packages providing any of the names,
+        using a single DNF query.
+
+        Return: (dict) name: list of packages providing it
+        """
+        names = set(names)
+        providers = {name: [] for name in names}
+        for pkg in self.get_packages_by(provides=sorted(names)):
+            for name in provides_of(pkg) & names:
+                providers[name].append(pkg)
+        return providers
+
+    @staticmethod
+    def add_repo(base, reponame, repourl):
+        """Add the enabled repository to the DNF base.
+
+        repourl: metalink repo name, URL or local directory of the repo
+        """
+        kind, url = repo_url(repourl)
+        kwargs = {kind: [url] if kind == 'baseurl' else url}
+        repo = base.repos.add_new_repo(reponame,
+                                       base.conf,
+                                       skip_if_unavailable=False,
+                                       **kwargs)
+        repo.enable()
+        repo.load()
+        return repo
+
+    def get_dnf_query(self, cancelled=None):
+        """Create dnf repoquery for the release.
+
+        cancelled: (threading.Event) if set, give up before the next
+                   repository is loaded and before the sack is filled,
+                   and return None; filling the sack cannot be stopped
+        """
+        # dnf is slow to import and not needed with a provides index
+        import dnf
+
+        def is_cancelled():
+            if cancelled is not None and cancelled.is_set():
+                log.debug('Loading repoquery for {} cancelled'.format(
+                    self.release))
+                return True
+            return False
+
+        log.debug('Creating repoquery for {}'.format(self.release))
+        base = dnf.Base()
+        base.conf.substitutions['releasever'] = self.release
+
+        sources = self.sources or repo_sources(self.release)
+        try:
+            for reponame, repourl in sorted(sources.items()):
+                if is_cancelled():
+                    return
+                self.add_repo(base, reponame, repourl)
+        except dnf.exceptions.RepoError as err:
+            if self.release == 'rawhide' or self.sources:
+                log.error('{} ({})'.format(err, self.release))
+                # TODO Do not silently ignore the error
+                return
+            log.warning('Failed to load repos for {}, '
+                        'assuming rawhide'.format(self.release))
+            self.release = 'rawhide'
+            rawhide = (self.sibling('rawhide') if self.sibling is not None
+                       else None)
+            if isinstance(rawhide, DNFQuery) and rawhide is not self:
+                # share the sack rather than loading it twice
+                return rawhide.query
+            return self.get_dnf_query(cancelled)
+
+        if is_cancelled():
+            return
+        rss = current_rss()
+        base.fill_sack(load_system_repo=False, load_available_repos=True)
+        self.memory = max(current_rss() - rss, 0)
+        return base.sack.query()
+
+    def release_query(self):
+        """Drop the loaded query, so its memory can be freed
+        once no running check uses it.
+        """
+        # not waiting for the lock, a load in progress would block the pool
+        with self._state_lock:
+            self._generation += 1
+            self._query = None
+            self.memory = 0
+
+
+class RepoQueryPool:
+
+    """Repoqueries of releases, the least recently used ones are dropped
+    when their loaded sacks take more than budget KiB together.
+    A budget of None means unlimited.
+
+    stats count the hits, misses and evictions since created.
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.stats = collections.Counter()
+        self._repoqueries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._repoqueries)
+
+    def __contains__(self, release):
+        return release in self._repoqueries
+
+    def get(self, release, factory):
+        """Return the repoquery of the release, calling factory(release)
+        to create it if not in the pool.
+        """
+        with self._lock:
+            if release in self._repoqueries:
+                self._repoqueries.move_to_end(release)
+                self._count('repoquery_hits')
+                return self._repoqueries[release]
+            self._count('repoquery_misses')
+            # make room assuming the new sack is as big as the biggest one
+            self._evict(max(map(self._memory, self._repoqueries.values()),
+                            default=0))
+            repoquery = self._repoqueries[release] = factory(release)
+            if isinstance(repoquery, DNFQuery):
+                # a failing release falls back to rawhide of this pool
+                repoquery.sibling = lambda other: self.get(other, factory)
+            return repoquery
+
+    def peek(self, release):
+        """Return the repoquery of the release or None,
+        without making it recently used.
+        """
+        return self._repoqueries.get(release)
+
+    def put(self, release, repoquery):
+        with self._lock:
+            self._repoqueries[release] = repoquery
+            self._repoqueries.move_to_end(release)
+
+    def clear(self):
+        with self._lock:
+            for release in list(self._repoqueries):
+                self._drop(release)
+
+    @staticmethod
+    def _memory(repoquery):
+        return getattr(repoquery, 'memory', 0)
+
+    def _count(self, counter):
+        self.stats[counter] += 1
+        count(counter)
+
+    def _drop(self, release):
+        repoquery = self._repoqueries.pop(release)
+        if isinstance(repoquery, DNFQuery):
+            repoquery.release_query()
+        elif hasattr(repoquery, 'close'):
+            repoquery.close()
+
+    def _evict(self, needed):
+        """Drop the least recently used repoqueries until needed KiB
+        more fit into the budget.
+        """
+        if self.budget is None:
+            return
+        while self._repoqueries:
+            used = sum(map(self._memory, self._repoqueries.values()))
+            if used + needed <= self.budget:
+                return
+            release, repoquery = next(iter(self._repoqueries.items()))
+            shared = getattr(repoquery, '_query', None)
+            log.debug('Evicting repoquery of {} ({} KiB)'.format(
+                release, self._memory(repoquery)))
+            self._drop(release)
+            self._count('repoquery_evictions')
+            if shared is None:
+                continue
+            # releases that fell back to rawhide share its sack
+            for other, alias in list(self._repoqueries.items()):
+                if getattr(alias, '_query', None) is shared:
+                    self._drop(other)
+                    self._count('repoquery_evictions')
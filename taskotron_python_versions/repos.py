@@ -0,0 +1,117 @@
+"""Configuration of the repositories the requires are looked up in."""
+
+import configparser
+import os
+
+# Repositories used unless configured otherwise, reponame: metalink repo
+# Better to have a false PASSED than false FAILED,
+# so we do NOT add updates-testing
+REPOS = {
+    'fedora': 'fedora-$releasever',
+    'updates': 'updates-released-f$releasever',
+}
+
+# Option of a release in the repository configuration,
+# not a repository but a path to a provides index
+PROVIDES_INDEX_OPTION = 'provides_index'
+
+# Repository configuration, see configure_repos()
+_repo_config = configparser.ConfigParser()
+_repo_config_path = None
+
+# Directory with provides indexes named <release>.sqlite or None
+_provides_index_dir = None
+
+# Bumped whenever the configuration changes, see config_version()
+_version = 0
+
+
+def config_version():
+    """Return: (int) Number changing with the repository configuration,
+    so the queries of the previous configuration can be dropped
+    """
+    return _version
+
+
+def configure_repos(path):
+    """Load the repository sources of releases from an INI file.
+    Each section is named by a release and maps reponames
+    to their sources (URL or local directory with repodata),
+    the DEFAULT section applies to releases without a section.
+    $releasever in the sources is replaced by the release.
+    Instead of repositories, provides_index can name a provides index.
+    Pass None to use the Fedora metalinks.
+
+    Example:
+
+        [DEFAULT]
+        fedora = http://mirror.example.com/fedora/$releasever/x86_64/os/
+        updates = /srv/mirror/updates/$releasever/x86_64/
+
+        [29]
+        provides_index = /srv/indexes/29.sqlite
+    """
+    global _repo_config, _repo_config_path, _version
+    path = None if path is None else str(path)
+    if path == _repo_config_path:
+        return
+    config = configparser.ConfigParser(interpolation=None)
+    if path is not None:
+        with open(path) as f:
+            config.read_file(f)
+    _repo_config, _repo_config_path = config, path
+    _version += 1
+
+
+def _release_options(release):
+    if _repo_config.has_section(release):
+        return dict(_repo_config.items(release))
+    return _repo_config.defaults()
+
+
+def repo_sources(release):
+    """Return: (dict) reponame: source of the repositories of the release"""
+    sources = {reponame: source
+               for reponame, source in _release_options(release).items()
+               if reponame != PROVIDES_INDEX_OPTION}
+    return sources or dict(REPOS)
+
+
+def repo_url(repourl):
+    """Given the source of a repository, as in the repository configuration,
+    return how DNF should load it.
+
+    repourl: metalink repo name, URL or local directory of the repo
+
+    Return: (tuple) 'baseurl' or 'metalink', URL
+    """
+    if '://' in repourl:
+        return 'baseurl', repourl
+    if os.path.isabs(repourl) or os.path.isdir(repourl):
+        return 'baseurl', 'file://' + os.path.abspath(repourl)
+    return 'metalink', ('https://mirrors.fedoraproject.org/'
+                        'metalink?repo={}&arch=$basearch'.format(repourl))
+
+
+def use_provides_indexes(directory):
+    """Answer the queries from the provides indexes in the directory,
+    for releases that have one, instead of loading the DNF sack.
+    Pass None to always use DNF.
+    """
+    global _provides_index_dir, _version
+    directory = None if directory is None else str(directory)
+    if directory != _provides_index_dir:
+        _provides_index_dir = directory
+        _version += 1
+
+
+def provides_index_path(release):
+    """Return: (str) Path to the provides index of the release or None"""
+    index = _release_options(release).get(PROVIDES_INDEX_OPTION)
+    if index is not None:
+        index = index.replace('$releasever', release)
+    elif _provides_index_dir is not None:
+        index = os.path.join(_provides_index_dir, release + '.sqlite')
+    if index and os.path.exists(index):
+        return index
+    return None
@@ -1,7 +1,14 @@
-import dnf
+import time
+import xml.etree.ElementTree as ET
 
+from .cache import VersionedNameCache
 from .common import log, write_to_artifact
+from .instrumentation import count
 from .naming_scheme import is_unversioned
+from .provides_index import local_repoquery, read_revisions, repo_revision
+from .repo_service import RepoServiceClient
+from .repoquery import DNFQuery, RepoQueryPool
+from .repos import config_version, provides_index_path, repo_sources
 
 MESSAGE = """These RPMs use `python-` prefix without Python version in *Requires:
 {}
@@ -13,71 +20,92 @@ the required packages, and use names with either `python2-` or
 
 INFO_URL = 'https://fedoraproject.org/wiki/Packaging:Python#Dependencies'
 
+# DNF queries by release, reused by all the runs in this process
+_repoqueries = RepoQueryPool()
 
-class DNFQuery:
+# Repository configuration the shared queries were created with
+_repoqueries_config = None
 
-    """DNF Qeuery API.
+# Socket of the repo service or None
+_repo_service = None
 
-    Initializes the query only when needed
-    and saves it for reuse.
+
+def use_repo_service(path):
+    """Answer the queries by the repo service listening on the socket,
+    if it is running. Pass None to never use the service.
     """
+    global _repo_service
+    path = None if path is None else str(path)
+    if path != _repo_service:
+        _repo_service = path
+        _repoqueries.clear()
+
+
+def get_repoquery(release):
+    """Return: (DNFQuery, ProvidesIndex or RepoServiceClient)
+    The shared query of the release
+    """
+    global _repoqueries_config
+    if _repoqueries_config != config_version():
+        # created for other repositories
+        _repoqueries.clear()
+        _repoqueries_config = config_version()
+    return _repoqueries.get(release, _new_repoquery)
+
+
+def _new_repoquery(release):
+    repoquery = None
+    # a local index is cheaper than asking the service
+    if _repo_service is not None and provides_index_path(release) is None:
+        repoquery = RepoServiceClient.connect(_repo_service, release)
+    return repoquery or local_repoquery(release)
+
+
+def set_repoquery_budget(budget):
+    """Limit the memory the shared repoqueries take to budget KiB,
+    the least recently used are dropped. Pass None for no limit.
+    """
+    _repoqueries.budget = budget
+
+
+def repoquery_stats():
+    """Return: (dict) Hits, misses and evictions of the shared repoqueries"""
+    return dict(_repoqueries.stats)
+
+
+def release_from_build(koji_build):
+    """Return: (str) Fedora release of the Koji build, e.g. 29"""
+    return koji_build.split('fc')[-1]
 
-    def __init__(self, release):
-        self.release = release
-        self._query = None
-
-    @property
-    def query(self):
-        if not self._query:
-            self._query = self.get_dnf_query()
-        return self._query
-
-    def get_packages_by(self, **kwargs):
-        """Return the result of the DNF query execution,
-        filtered by kwargs.
-        """
-        if self.query is not None:
-            return self.query.filter(**kwargs).run()
-        else:
-            log.debug('No query, we continue, but it is bad...')
-            return []
-
-    @staticmethod
-    def add_repo(base, reponame, repourl):
-        metalink = ('https://mirrors.fedoraproject.org/'
-                    'metalink?repo={}&arch=$basearch'.format(repourl))
-        repo = base.repos.add_new_repo(reponame,
-                                       base.conf,
-                                       metalink=metalink,
-                                       skip_if_unavailable=False)
-        repo.enable()
-        repo.load()
-        return repo
-
-    def get_dnf_query(self):
-        """Create dnf repoquery for the release."""
-        log.debug('Creating repoquery for {}'.format(self.release))
-        base = dnf.Base()
-        base.conf.substitutions['releasever'] = self.release
-
-        # Only add fedora and updates
-        # Better to have a false PASSED than false FAILED,
-        # so we do NOT add updates-testing
-        try:
-            self.add_repo(base, 'fedora', 'fedora-$releasever')
-            self.add_repo(base, 'updates', 'updates-released-f$releasever')
-        except dnf.exceptions.RepoError as err:
-            if self.release == 'rawhide':
-                log.error('{} (rawhide)'.format(err))
-                # TODO Do not silently ignore the error
-                return
-            log.warning('Failed to load repos for {}, '
-                        'assuming rawhide'.format(self.release))
-            self.release = 'rawhide'
-            return self.get_dnf_query()
-
-        base.fill_sack(load_system_repo=False, load_available_repos=True)
-        return base.sack.query()
+
+def prefetch_repoquery(release):
+    """Start loading the shared query of the release in the background,
+    so it is ready once the requires are checked.
+    """
+    repoquery = get_repoquery(release)
+    if isinstance(repoquery, DNFQuery):
+        repoquery.prefetch()
+
+
+def cancel_prefetch(release):
+    """Stop loading the shared query of the release, if not needed
+    and still loading the repositories, see DNFQuery.cancel_prefetch().
+    """
+    repoquery = _repoqueries.peek(release)
+    if isinstance(repoquery, DNFQuery):
+        repoquery.cancel_prefetch()
+
+
+def _first_versioned(packages):
+    """Return: (str) Name of the first package with a versioned
+    Python prefix or None
+    """
+    for pkg in packages:
+        if not is_unversioned(pkg.name):
+            log.debug(
+                'Found a name with a versioned '
+                'Python prefix: {}'.format(pkg.name))
+            return pkg.name
 
 
 def get_versioned_name(require, repoquery):
@@ -90,34 +118,152 @@ def get_versioned_name(require, repoquery):
     log.debug('Checking requirement {}'.format(require))
 
     packages = repoquery.get_packages_by(provides=require)
-    for pkg in packages:
-        if not is_unversioned(pkg.name):
-            log.debug(
-                'Found a name with a versioned '
-                'Python prefix: {}'.format(pkg.name))
-            return pkg.name
+    return _first_versioned(packages)
+
 
+def get_versioned_names(requires, repoquery):
+    """Given the requires with not versioned Python prefix,
+    find ones with the versioned Python prefix
+    using the provided repoquery. Each require is looked up once,
+    all of them in a single query if the repoquery supports it.
+
+    Return: (dict) require: available versioned name or None
+    """
+    requires = sorted(set(requires))
+    if not requires:
+        return {}
+    if not hasattr(repoquery, 'get_providers'):
+        return {require: get_versioned_name(require, repoquery)
+                for require in requires}
 
-def check_requires_naming_scheme(package, repoquery):
+    log.debug('Checking requirements {}'.format(', '.join(requires)))
+    providers = repoquery.get_providers(requires)
+    return {require: _first_versioned(providers.get(require, ()))
+            for require in requires}
+
+
+# Cache of versioned names across runs or None
+_versioned_name_cache = None
+
+# Revisions of the repositories by release: (time fetched, revision)
+_revisions = {}
+
+# seconds a fetched revision is trusted for
+REVISION_TTL = 10 * 60
+
+
+def use_versioned_name_cache(directory, ttl=None):
+    """Remember the versioned names of requires in the directory,
+    for ttl seconds at most. Pass None to always look them up.
+    """
+    global _versioned_name_cache
+    if directory is None:
+        _versioned_name_cache = None
+    elif (_versioned_name_cache is None or
+            _versioned_name_cache.directory != str(directory)):
+        _versioned_name_cache = VersionedNameCache(directory)
+    if _versioned_name_cache is not None and ttl is not None:
+        _versioned_name_cache.ttl = ttl
+
+
+def release_revision(release):
+    """Return the revision of the repositories of the release,
+    read from its provides index or fetched from the repositories.
+
+    Return: (str) Revision or None if not known
+    """
+    index = provides_index_path(release)
+    if index is not None:
+        revisions = read_revisions(index)
+    else:
+        fetched, revision = _revisions.get(release, (0, None))
+        if time.monotonic() - fetched < REVISION_TTL:
+            return revision
+        try:
+            revisions = {reponame: repo_revision(repourl, release)
+                         for reponame, repourl
+                         in repo_sources(release).items()}
+        except (OSError, ValueError, ET.ParseError) as err:
+            log.debug('Revision of {} not known: {}'.format(release, err))
+            revisions = {}
+    revision = ','.join('{}={}'.format(*item)
+                        for item in sorted(revisions.items())) or None
+    if index is None:
+        _revisions[release] = time.monotonic(), revision
+    return revision
+
+
+def resolve_versioned_names(requires, release, repoquery):
+    """Like get_versioned_names(), answered from the versioned name cache
+    when possible. Only the requires not cached are looked up.
+
+    Return: (dict) require: available versioned name or None
+    """
+    requires = set(requires)
+    cache = _versioned_name_cache
+    revision = release_revision(release) if cache and requires else None
+    if revision is None:
+        return get_versioned_names(requires, repoquery)
+
+    resolved = {}
+    for require in requires:
+        entry = cache.get(cache.key_for(release, revision, require))
+        if entry is not None:
+            resolved[require] = entry['versioned']
+    count('name_cache_hits', len(resolved))
+    missing = requires - set(resolved)
+    count('name_cache_misses', len(missing))
+    if not missing:
+        # the repositories are not needed after all
+        cancel_prefetch(release)
+        return resolved
+
+    looked_up = get_versioned_names(missing, repoquery)
+    resolved.update(looked_up)
+    if not getattr(repoquery, 'loaded', True):
+        # every require resolves to None then, do not remember that
+        log.warning('Repositories of {} not loaded, not caching the '
+                    'versioned names'.format(release))
+        return resolved
+    for require, versioned in looked_up.items():
+        cache.put(cache.key_for(release, revision, require),
+                  {'versioned': versioned})
+    return resolved
+
+
+def unversioned_requires(package):
+    """Return: (list) Requires of the package with not versioned
+    Python prefix
+    """
+    return [name for name in package.require_names if is_unversioned(name)]
+
+
+def check_requires_naming_scheme(package, repoquery, resolved=None):
     """Given the package, check the naming scheme of its
     requirements and return a list of those misnamed.
 
+    resolved: (dict) require: versioned name or None, as returned by
+              get_versioned_names(), to share the lookups among packages
+
     Return: (set) Misnamed requirements
     """
     misnamed_requires = set()
 
-    for name in package.require_names:
-        if is_unversioned(name):
-            versioned = get_versioned_name(name, repoquery)
+    requires = unversioned_requires(package)
+    if resolved is None:
+        resolved = get_versioned_names(requires, repoquery)
 
-            if versioned:
-                log.error(
-                    '{} package requires {}, while {} is '
-                    'available'.format(package.filename, name, versioned))
-                misnamed_requires.add('{} ({} is available)'.format(
-                    name, versioned))
-            else:
-                log.debug('A versioned name for {} not found'.format(name))
+    for name in requires:
+        versioned = resolved[name]
+
+        if versioned:
+            log.error(
+                '{} package requires {}, while {} is '
+                'available'.format(package.filename, name, versioned))
+            misnamed_requires.add('{} ({} is available)'.format(
+                name, versioned))
+        else:
+            log.debug('A versioned name for {} not found'.format(name))
 
     return misnamed_requires
 
@@ -130,18 +276,24 @@ def task_requires_naming_scheme(packages, koji_build, artifact):
     # to make the above functions testable anyway
     from libtaskotron import check
 
-    fedora_release = koji_build.split('fc')[-1]
-    repoquery = DNFQuery(fedora_release)
+    fedora_release = release_from_build(koji_build)
+    repoquery = get_repoquery(fedora_release)
 
     outcome = 'PASSED'
 
     problem_rpms = set()
     message_rpms = ''
 
+    # the same requires repeat in the SRPM and all the subpackages
+    resolved = resolve_versioned_names(
+        (name for package in packages
+         for name in unversioned_requires(package)),
+        fedora_release, repoquery)
+
     for package in packages:
         log.debug('Checking requires of {}'.format(package.filename))
 
-        requires = check_requires_naming_scheme(package, repoquery)
+        requires = check_requires_naming_scheme(package, repoquery, resolved)
         if requires:
             outcome = 'FAILED'
             problem_rpms.add(package.nvr)
@@ -0,0 +1,150 @@
+import collections
+import concurrent.futures
+
+from .common import ArtifactWriter, log
+from .instrumentation import measure
+from .executables import task_executables
+from .naming_scheme import task_naming_scheme
+from .requires import task_requires_naming_scheme
+from .two_three import task_two_three
+from .unversioned_shebangs import task_unversioned_shebangs
+from .py3_support import task_py3_support
+from .python_usage import task_python_usage
+
+
+# name: the checkname of the subcheck
+# task: the task_* function, called with inputs, koji_build and artifact
+# inputs: names of the inputs passed to the task, in order
+# after: names of the subchecks that need to finish first
+Subcheck = collections.namedtuple('Subcheck', 'name, task, inputs, after')
+
+# The order of the subchecks is the order of the results
+SUBCHECKS = (
+    Subcheck('two_three', task_two_three, ('packages',), ()),
+    # py_versions of packages are populated in task_two_three
+    Subcheck('naming_scheme', task_naming_scheme,
+             ('packages',), ('two_three',)),
+    Subcheck('requires_naming_scheme', task_requires_naming_scheme,
+             ('all_packages',), ()),
+    Subcheck('executables', task_executables,
+             ('packages',), ('two_three',)),
+    Subcheck('unversioned_shebangs', task_unversioned_shebangs,
+             ('packages', 'logs'), ()),
+    Subcheck('py3_support', task_py3_support,
+             ('all_packages',), ('two_three',)),
+    Subcheck('python_usage', task_python_usage, ('all_packages',), ()),
+)
+
+# Subchecks still able to fail with no Python in the packages,
+# as they inspect the build logs as well
+LOG_SUBCHECKS = ('unversioned_shebangs',)
+
+
+def run_measured(subcheck, args, koji_build, artifact, profile_dir=None):
+    """Run the subcheck and store its measurement in the detail keyvals.
+
+    Return: (tuple) CheckDetail, Measurement
+    """
+    with measure(subcheck.name, profile_dir) as measurement:
+        detail = subcheck.task(*args, koji_build, artifact)
+    detail.keyvals.update(measurement.as_dict())
+    return detail, measurement
+
+
+def run_subchecks(inputs, koji_build, artifact, jobs=1, subchecks=SUBCHECKS,
+                  profile_dir=None, measurements=None):
+    """Run the subchecks in a pool of jobs threads. Each subcheck is started
+    as soon as all the subchecks it runs after are finished, in the order
+    of subchecks. With jobs=1, the subchecks run one after another.
+
+    inputs: (dict) input name: value passed to the tasks
+    artifact: path of the artifact or an ArtifactWriter,
+              each subcheck then gets its own section of it
+    profile_dir: directory to dump the cProfile data of the subchecks into
+    measurements: (list) if given, Measurements are appended to it
+
+    Return: (list) CheckDetails in the order of subchecks
+    """
+    names = {subcheck.name for subcheck in subchecks}
+    for subcheck in subchecks:
+        unknown = set(subcheck.after) - names
+        if unknown:
+            raise ValueError('{} runs after unknown subchecks: {}'.format(
+                subcheck.name, ', '.join(sorted(unknown))))
+
+    # sections are created in advance to be written in this order
+    artifacts = {subcheck.name: artifact.section(subcheck.name)
+                 if isinstance(artifact, ArtifactWriter) else artifact
+                 for subcheck in subchecks}
+
+    details = {}
+    pending = list(subchecks)
+    running = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            for subcheck in list(pending):
+                if len(running) >= jobs:
+                    break
+                if all(name in details for name in subcheck.after):
+                    pending.remove(subcheck)
+                    args = [inputs[name] for name in subcheck.inputs]
+                    future = executor.submit(
+                        run_measured, subcheck, args, koji_build,
+                        artifacts[subcheck.name], profile_dir)
+                    running[future] = subcheck
+            if not running:
+                raise ValueError('Circular dependency among subchecks: '
+                                 '{}'.format(', '.join(s.name
+                                                       for s in pending)))
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                details[running.pop(future).name] = future.result()
+
+    if measurements is not None:
+        measurements.extend(details[subcheck.name][1]
+                            for subcheck in subchecks)
+    return [details[subcheck.name][0] for subcheck in subchecks]
+
+
+def passed_details(koji_build, reason, subchecks=SUBCHECKS):
+    """Report all the subchecks as PASSED without running them.
+
+    Return: (list) CheckDetails in the order of subchecks
+    """
+    # libtaskotron is not available on Python 3, so we do it inside
+    # to make the above functions testable anyway
+    from libtaskotron import check
+
+    details = []
+    for subcheck in subchecks:
+        details.append(check.CheckDetail(
+            checkname=subcheck.name,
+            item=koji_build,
+            report_type=check.ReportType.KOJI_BUILD,
+            outcome='PASSED'))
+        log.info('subcheck {} PASSED for {}. {}'.format(
+            subcheck.name, koji_build, reason))
+    return details
+
+
+def prefiltered_details(inputs, koji_build, artifact, reason,
+                        subchecks=SUBCHECKS, **kwargs):
+    """Report the subchecks as PASSED without running them, except for
+    LOG_SUBCHECKS, which run on the build logs with no packages.
+    Other keyword arguments are passed to run_subchecks().
+
+    Return: (list) CheckDetails in the order of subchecks
+    """
+    logged = [subcheck for subcheck in subchecks
+              if subcheck.name in LOG_SUBCHECKS]
+    inputs = dict(inputs, packages=[], all_packages=[])
+    ran = dict(zip((subcheck.name for subcheck in logged),
+                   run_subchecks(inputs, koji_build, artifact,
+                                 subchecks=logged, **kwargs)))
+    passed = iter(passed_details(
+        koji_build, reason,
+        [subcheck for subcheck in subchecks if subcheck.name not in ran]))
+    return [ran[subcheck.name] if subcheck.name in ran else next(passed)
+            for subcheck in subchecks]
@@ -1,6 +1,14 @@
+import collections
+import concurrent.futures
+import itertools
+import stat
+import time
+
 import libarchive
 
-from .common import log, write_to_artifact, file_contains
+from .cache import ScanCache
+from .common import log, process_pool, write_to_artifact, file_contains
+from .instrumentation import add_worker_cpu_time, count, measure
 
 MESSAGE = """These RPMs contain problematic shebang in some of the scripts:
 {}
@@ -30,76 +38,401 @@ files are affected and need to be fixed:
 INFO_URL = \
     'https://fedoraproject.org/wiki/Packaging:Python#Multiple_Python_Runtimes'
 
+LIMITS_MESSAGE = """The payloads of these RPMs were not fully scanned
+for problematic shebangs:
+{}
+Please check their scripts manually.
+"""
+
 FORBIDDEN_SHEBANGS = ['#!/usr/bin/python', '#!/usr/bin/env python']
 
+# Bytes of a file read to find its first line, enough for any shebang query
+FIRST_LINE_SIZE = 128
+
+
+# Directories of executables, scripts there need not be executable
+SCRIPT_DIRS = ('/bin/', '/sbin/', '/libexec/')
+
+# file(1) descriptions of files that may start with a shebang
+SCRIPT_CLASSES = ('script', 'text')
+
+# Number of processes scanning the payloads, 1 scans them in this process
+_scan_jobs = 1
+
+# Limits of a payload scan, None means unlimited
+# max_bytes: decompressed bytes of the payload
+# max_entries: files in the payload
+# max_time: wall time in seconds
+ScanLimits = collections.namedtuple('ScanLimits',
+                                    'max_bytes, max_entries, max_time')
+ScanLimits.__new__.__defaults__ = (None, None, None)
+
+DEFAULT_SCAN_LIMITS = ScanLimits(max_bytes=16 * 1024 ** 3,
+                                 max_entries=1000000, max_time=600)
+
+_scan_limits = DEFAULT_SCAN_LIMITS
+
+# ScanCache of the first lines of files or None
+_scan_cache = None
+
+
+class PayloadNotScanned(Exception):
+
+    """The payload of the package was not fully scanned."""
+
+
+class ScanLimitExceeded(PayloadNotScanned):
+
+    """The payload scan was given up, the payload is too big."""
+
+
+class PayloadUnavailable(PayloadNotScanned):
+
+    """The package was read from its header only, there is no payload."""
+
+
+def set_scan_jobs(jobs):
+    """Scan the payloads of packages in a pool of jobs processes."""
+    global _scan_jobs
+    _scan_jobs = max(jobs or 1, 1)
+
+
+def set_scan_limits(limits):
+    """Give up payload scans exceeding the ScanLimits."""
+    global _scan_limits
+    _scan_limits = limits
+
+
+def use_scan_cache(directory, max_size=None):
+    """Remember the shebangs found in payloads in the directory,
+    taking at most max_size bytes. Pass None to always scan the payloads.
+    """
+    global _scan_cache
+    if directory is None:
+        _scan_cache = None
+    elif (_scan_cache is None or
+            _scan_cache.directory != str(directory)):
+        _scan_cache = ScanCache(directory)
+    if _scan_cache is not None and max_size is not None:
+        _scan_cache.max_size = max_size
+
+
+def is_candidate(path, mode, size, file_class, min_size):
+    """Check if the file may start with a shebang of min_size bytes,
+    given its metadata from the RPM header. Regular files are candidates
+    if executable, in a directory of executables or described as text.
+    Files without a description are candidates as well.
+
+    Return: (bool) True if the file should be scanned
+    """
+    if not stat.S_ISREG(mode & 0o177777) or size < min_size:
+        return False
+    if mode & 0o111 or any(d in path for d in SCRIPT_DIRS):
+        return True
+    return not file_class or any(c in file_class for c in SCRIPT_CLASSES)
+
+
+def shebang_candidates(package, queries):
+    """Pick the files of the package that may start with any of the
+    queries, using the file metadata from the RPM header.
+
+    Return: (set) Paths of the candidate files
+    """
+    min_size = min(len(query) for query in queries)
+    metadata = itertools.zip_longest(
+        package.files, package.file_modes, package.file_sizes,
+        package.file_classes, fillvalue='')
+    return {path for path, mode, size, file_class in metadata
+            if is_candidate(path, mode or 0, size or 0, file_class, min_size)}
+
 
 def matches(line, query):
     """Both arguments must be of a type bytes"""
     return line == query or line.startswith(query + b' ')
 
 
-def get_problematic_files(archive, query):
-    """Search for the files inside archive with the first line
-    matching given query. Some of the files can contain data, which
-    are not in the plain text format. Bytes are read from the file and
-    the shebang query is encoded as well. We only test for ASCII shebangs.
+def read_first_line(entry, size=FIRST_LINE_SIZE):
+    """Read the first line of the archive entry, at most size bytes of it,
+    without decompressing the rest of the file.
+
+    Return: (bytes) The first line or b'' if the file is empty
     """
-    problematic = set()
+    data = b''
+    for block in entry.get_blocks(size):
+        data += block
+        count('payload_bytes_read', len(block))
+        if len(data) >= size or b'\n' in block or b'\r' in block:
+            break
+    lines = data[:size].splitlines()
+    return lines[0] if lines else b''
+
+
+def scan_first_lines(archive, candidates=None, limits=None):
+    """Collect the first lines of the files inside archive starting
+    with a shebang, decompressing the archive once.
+
+    candidates: (set) if given, the data of other files are not read
+    limits: (ScanLimits) if given, raise ScanLimitExceeded when exceeded
+
+    Return: (dict) file: its first line (bytes)
+    """
+    shebangs = {}
+    if candidates is not None and not candidates:
+        return shebangs
+    limits = limits or ScanLimits()
+    deadline = (None if limits.max_time is None
+                else time.monotonic() + limits.max_time)
+    entries = decompressed = 0
     with libarchive.file_reader(str(archive)) as a:
         for entry in a:
-            try:
-                first_line = next(entry.get_blocks(), '').splitlines()[0]
-            except IndexError:
-                continue  # file is empty
-            if matches(first_line, query.encode('ascii')):
-                problematic.add(entry.pathname.lstrip('.'))
-
+            count('archive_entries')
+            entries += 1
+            # even skipped files are decompressed to get to the next one
+            decompressed += entry.size or 0
+            if limits.max_entries is not None and \
+                    entries > limits.max_entries:
+                raise ScanLimitExceeded(
+                    'more than {} files'.format(limits.max_entries))
+            if limits.max_bytes is not None and \
+                    decompressed > limits.max_bytes:
+                raise ScanLimitExceeded(
+                    'more than {} decompressed bytes'.format(
+                        limits.max_bytes))
+            if deadline is not None and time.monotonic() > deadline:
+                raise ScanLimitExceeded(
+                    'not scanned in {} s'.format(limits.max_time))
+            pathname = entry.pathname.lstrip('.')
+            if candidates is not None and pathname not in candidates:
+                continue
+            first_line = read_first_line(entry)
+            if first_line.startswith(b'#!'):
+                shebangs[pathname] = first_line
+    return shebangs
+
+
+def match_shebangs(shebangs, queries):
+    """Match the first lines of files against the queries.
+
+    shebangs: (dict) file: its first line (bytes)
+
+    Return: (dict) query: set of the matching files
+    """
+    problematic = {query: set() for query in queries}
+    for query in problematic:
+        encoded_query = query.encode('ascii')
+        problematic[query].update(
+            pathname for pathname, first_line in shebangs.items()
+            if matches(first_line, encoded_query))
     return problematic
 
 
+def scan_shebangs(archive, queries, candidates=None, limits=None):
+    """Search for the files inside archive with the first line
+    matching any of the given queries, decompressing the archive once.
+    Some of the files can contain data, which are not in the plain
+    text format. Bytes are read from the file and the shebang queries
+    are encoded as well. We only test for ASCII shebangs.
+
+    candidates: (set) if given, the data of other files are not read
+    limits: (ScanLimits) if given, raise ScanLimitExceeded when exceeded
+
+    Return: (dict) query: set of the matching files
+    """
+    if not queries:
+        return {}
+    return match_shebangs(scan_first_lines(archive, candidates, limits),
+                          queries)
+
+
+def cached_first_lines(package, cache, candidates=None, limits=None):
+    """Collect the first lines of the files of the package starting
+    with a shebang, scanning the payload only if it is not in the
+    ScanCache yet.
+
+    Return: (dict) file: its first line (bytes)
+    """
+    key = cache.key_for(package.payload_digest)
+    cached = cache.get(key)
+    if cached is not None:
+        count('scan_cache_hits')
+        log.debug('{}: shebangs loaded from cache'.format(package.filename))
+        # latin-1 maps the bytes to JSON serializable text and back
+        return {pathname: first_line.encode('latin-1')
+                for pathname, first_line in cached.items()}
+    count('scan_cache_misses')
+    shebangs = scan_first_lines(payload_path(package), candidates, limits)
+    cache.put(key, {pathname: first_line.decode('latin-1')
+                    for pathname, first_line in shebangs.items()})
+    return shebangs
+
+
+def payload_path(package):
+    """Return: (str) Path of the RPM file with the payload of the package
+
+    Raises: PayloadUnavailable for packages read from a stream
+    """
+    if package.path is None:
+        raise PayloadUnavailable('only the header of {} is available'.format(
+            package.filename))
+    return package.path
+
+
+def get_problematic_files(archive, query):
+    """Search for the files inside archive with the first line
+    matching given query.
+
+    Return: (set) Matching files
+    """
+    return scan_shebangs(archive, [query])[query]
+
+
 def shebang_to_require(shebang):
     """Convert shebang to the format of requirement."""
     return shebang.split()[0][2:]
 
 
-def get_scripts_summary(package):
+def get_scripts_summary(package, limits=None, cache=None):
     """Collect problematic scripts data for given RPM package.
     Content of archive is processed only if package requires
     unversioned python binary or env.
-    """
-    scripts_summary = {}
 
+    limits: (ScanLimits) if given, raise ScanLimitExceeded when exceeded
+    cache: (ScanCache) if given, payloads are scanned only once
+
+    Raises: PayloadUnavailable if the payload is to be scanned,
+            but the package has none (see Package.from_stream())
+    """
+    queries = []
     for shebang in FORBIDDEN_SHEBANGS:
         if shebang_to_require(shebang) in package.require_names:
             log.debug('Package {} requires {}'.format(
                 package.filename, shebang_to_require(
                     shebang)))
-            problematic = get_problematic_files(package.path, shebang)
-            if problematic:
-                log.debug('{} shebang was found in scripts: {}'.format(
-                    shebang, ', '.join(problematic)))
-                scripts_summary[shebang] = problematic
+            queries.append(shebang)
+
+    if not queries:
+        return {}
+    if cache is not None and not package.payload_digest:
+        cache = None
+
+    candidates = None
+    if package.file_modes:
+        # cached first lines must do for all the queries
+        candidates = shebang_candidates(
+            package, queries if cache is None else FORBIDDEN_SHEBANGS)
+        log.debug('{} of {} files of {} may have a shebang'.format(
+            len(candidates), len(package.files), package.filename))
+
+    if cache is None:
+        found = scan_shebangs(payload_path(package), queries, candidates,
+                              limits)
+    else:
+        found = match_shebangs(
+            cached_first_lines(package, cache, candidates, limits), queries)
+
+    scripts_summary = {}
+    for shebang, problematic in found.items():
+        if problematic:
+            log.debug('{} shebang was found in scripts: {}'.format(
+                shebang, ', '.join(problematic)))
+            scripts_summary[shebang] = problematic
     return scripts_summary
 
 
-def check_packages(packages):
+def _scan_package(package, limits=None, cache=None):
+    """Collect the problematic scripts of the package, possibly in a pool
+    worker. Counters and CPU time of the worker are returned to be added
+    to the measurement of the subcheck. Runs in the pool workers, hence
+    it does not log the exceeded limits itself.
+
+    Return: (tuple) NVR, scripts summary or PayloadNotScanned,
+            counters and CPU time of the scan
+    """
+    with measure(package.filename) as measurement:
+        try:
+            summary = get_scripts_summary(package, limits, cache)
+        except PayloadNotScanned as err:
+            summary = err
+    return package.nvr, summary, measurement.counters, measurement.cpu_time
+
+
+def scan_packages(packages, jobs=1, limits=None, cache=None):
+    """Collect the problematic scripts of the packages, scanning
+    the payloads in a pool of jobs processes. At most two packages
+    per worker are submitted at once, so only a few of them are pickled
+    and waiting for a worker at any time.
+
+    limits: (ScanLimits) payloads exceeding them are not scanned further
+    cache: (ScanCache) if given, payloads are scanned only once
+
+    Return: (dict) NVR: scripts summary or PayloadNotScanned,
+            in the order of NVRs
+    """
+    packages = list(packages)
+    results = []
+    pooled = jobs > 1 and len(packages) > 1
+    if pooled:
+        pending = iter(packages)
+        running = set()
+        # the subchecks run in threads, so the workers must not be forked
+        with process_pool(jobs) as executor:
+            while True:
+                for package in itertools.islice(
+                        pending, 2 * jobs - len(running)):
+                    log.debug('Checking shebangs of {}'.format(
+                        package.filename))
+                    running.add(executor.submit(
+                        _scan_package, package.snapshot(), limits, cache))
+                if not running:
+                    break
+                done, running = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                results.extend(future.result() for future in done)
+    else:
+        for package in packages:
+            log.debug('Checking shebangs of {}'.format(package.filename))
+            results.append(_scan_package(package, limits, cache))
+
+    summaries = {}
+    results.sort(key=lambda result: result[0])
+    for nvr, summary, counters, cpu_time in results:
+        for counter, n in counters.items():
+            count(counter, n)
+        if pooled:
+            # the CPU time of this thread covers the serial scans
+            add_worker_cpu_time(cpu_time)
+        if isinstance(summary, PayloadNotScanned):
+            log.warning('Gave up scanning {}: {}'.format(nvr, summary))
+        summaries[nvr] = summary
+    return summaries
+
+
+def check_packages(packages, jobs=None, limits=None, cache=None):
     """Check if the packages have executables with shebangs
-    forbidden by the guidelines.
+    forbidden by the guidelines. The payloads are scanned by jobs
+    processes within the limits, unless found in the cache,
+    see set_scan_jobs(), set_scan_limits() and use_scan_cache()
+    for the defaults.
 
-    Return: (str) problem packages along with file names
+    Return: (tuple) problem packages along with file names,
+            packages not fully scanned along with the reason (both str)
     """
-    problem_rpms = {}
-    for package in packages:
-        log.debug('Checking shebangs of {}'.format(package.filename))
-        problem_rpms[package.nvr] = get_scripts_summary(package)
+    problem_rpms = scan_packages(
+        packages, _scan_jobs if jobs is None else jobs,
+        _scan_limits if limits is None else limits,
+        _scan_cache if cache is None else cache)
 
     shebang_message = ''
+    limits_message = ''
     for package, pkg_summary in problem_rpms.items():
+        if isinstance(pkg_summary, PayloadNotScanned):
+            limits_message += '{}\n * {}\n'.format(package, pkg_summary)
+            continue
         for shebang, scripts in pkg_summary.items():
             shebang_message += \
                 '{}\n * Scripts containing `{}` shebang:\n   {}\n'.format(
                     package, shebang, '\n   '.join(sorted(scripts)))
-    return shebang_message
+    return shebang_message, limits_message
 
 
 def check_logs(logs):
@@ -130,7 +463,7 @@ def task_unversioned_shebangs(packages, logs, koji_build, artifact):
     message = ''
     problems = ''
 
-    problems = check_packages(packages)
+    problems, exceeded = check_packages(packages)
     if problems:
         outcome = 'FAILED'
         message = MESSAGE.format(problems)
@@ -141,13 +474,20 @@ def task_unversioned_shebangs(packages, logs, koji_build, artifact):
         message = MANGLED_MESSAGE.format(mangled_on_arches)
         problems = 'Shebangs mangled on: {}'.format(mangled_on_arches)
 
+    if exceeded:
+        # better an inspection than a stalled task
+        if outcome == 'PASSED':
+            outcome = 'NEEDS_INSPECTION'
+            problems = 'Some payloads were not fully scanned.'
+        message += LIMITS_MESSAGE.format(exceeded)
+
     detail = check.CheckDetail(
         checkname='unversioned_shebangs',
         item=koji_build,
         report_type=check.ReportType.KOJI_BUILD,
         outcome=outcome)
 
-    if outcome == 'FAILED':
+    if outcome != 'PASSED':
         write_to_artifact(artifact, message, INFO_URL)
         detail.artifact = str(artifact)
     else:
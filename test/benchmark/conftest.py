@@ -0,0 +1,171 @@
+import json
+import pathlib
+import time
+
+import pytest
+
+from taskotron_python_versions.common import Package
+
+from . import rpmgen
+
+BASELINE = pathlib.Path(__file__).parent / 'baseline.json'
+MIN_ROUND_TIME = 0.2
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('timing')
+    group.addoption('--timing-compare', action='store_true', default=False,
+                    help='fail when slower than the stored baseline; '
+                         'only meaningful on the host it was stored on')
+    group.addoption('--timing-save', action='store_true', default=False,
+                    help='store the measured times as the new baseline')
+    group.addoption('--timing-tolerance', type=float, default=2.0,
+                    help='with --timing-compare, fail when slower than '
+                         'the baseline times this (default: %(default)s)')
+    group.addoption('--timing-rounds', type=int, default=5,
+                    help='take the best of this many rounds '
+                         '(default: %(default)s)')
+
+
+def pytest_configure(config):
+    config.timing_results = {}
+
+
+def pytest_sessionfinish(session):
+    config = session.config
+    if config.getoption('--timing-save') and config.timing_results:
+        baseline = json.loads(BASELINE.read_text())
+        baseline.update(config.timing_results)
+        BASELINE.write_text(json.dumps(baseline, indent=2,
+                                       sort_keys=True) + '\n')
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    if not config.timing_results:
+        return
+    terminalreporter.section('timing')
+    for name, best in sorted(config.timing_results.items()):
+        terminalreporter.write_line('{}: {:.6f} s'.format(name, best))
+
+
+@pytest.fixture
+def timed(request, record_property):
+    '''Time the given function, return its result.
+
+    Fast functions are called repeatedly, so each round takes at least
+    MIN_ROUND_TIME. The best round is reported in the terminal summary.
+    The times recorded in baseline.json (under the test id) depend on the
+    host, so they are only compared with --timing-compare.
+    '''
+    config = request.config
+    name = request.node.name
+
+    def run(function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        loops = max(1, int(MIN_ROUND_TIME / (time.perf_counter() - start)))
+
+        best = None
+        for _ in range(config.getoption('--timing-rounds')):
+            start = time.perf_counter()
+            for _ in range(loops):
+                function(*args, **kwargs)
+            elapsed = (time.perf_counter() - start) / loops
+            best = elapsed if best is None else min(best, elapsed)
+        config.timing_results[name] = round(best, 6)
+        record_property('best_time', round(best, 6))
+
+        if config.getoption('--timing-compare'):
+            baseline = json.loads(BASELINE.read_text()).get(name)
+            if baseline is not None:
+                limit = baseline * config.getoption('--timing-tolerance')
+                assert best <= limit, (
+                    '{} took {:.6f} s, baseline is {:.6f} s'.format(
+                        name, best, baseline))
+        return result
+
+    return run
+
+
+@pytest.fixture(scope='session')
+def corpusdir(tmp_path_factory):
+    return tmp_path_factory.mktemp('corpus')
+
+
+def load(path):
+    return Package(path, verify=False).snapshot()
+
+
+@pytest.fixture(scope='session')
+def many_files(corpusdir):
+    '''A package with 100k files'''
+    files = [rpmgen.File('/usr/share/corpus/d{}/f{}'.format(i // 1000, i))
+             for i in range(100000)]
+    files += [rpmgen.File('/usr/bin/tool{}'.format(i), 0o100755)
+              for i in range(100)]
+    return load(rpmgen.build_rpm(corpusdir, 'many-files', files=files,
+                                 requires=[('python(abi)', '3.7')]))
+
+
+@pytest.fixture(scope='session')
+def many_requires(corpusdir):
+    '''A package with thousands of Requires'''
+    requires = [('python(abi)', '3.7')]
+    for i in range(2000):
+        requires.append('python-dep{}'.format(i))
+        requires.append('python3-dep{}'.format(i))
+        requires.append('libdep{}.so.1()(64bit)'.format(i))
+    return load(rpmgen.build_rpm(corpusdir, 'many-requires',
+                                 requires=requires))
+
+
+@pytest.fixture(scope='session')
+def scripts(corpusdir):
+    '''A package with a large payload full of scripts'''
+    shebangs = ('#!/usr/bin/python', '#!/usr/bin/env python', '#!/bin/sh')
+    files = [rpmgen.script('/usr/libexec/corpus/script{}'.format(i),
+                           shebangs[i % 3], size=4096)
+             for i in range(3000)]
+    files += [rpmgen.blob('/usr/share/corpus/blob{}'.format(i),
+                          1024 * 1024, seed=i)
+              for i in range(16)]
+    return rpmgen.build_rpm(corpusdir, 'scripts', files=files,
+                            requires=['/usr/bin/python', '/usr/bin/env'])
+
+
+@pytest.fixture(scope='session')
+def scripts_package(scripts):
+    return load(scripts)
+
+
+@pytest.fixture(scope='session')
+def subpackages(corpusdir):
+    '''A build with hundreds of subpackages'''
+    packages = []
+    for i in range(100):
+        names = (('python2-sub{}' if i % 2 else 'sub{}', '2.7'),
+                 ('python3-sub{}', '3.7'),
+                 ('sub{}-data', None))
+        for name, abi in names:
+            name = name.format(i)
+            files = [rpmgen.File('/usr/bin/{}-{}'.format(name, j), 0o100755)
+                     for j in range(5)]
+            files += [rpmgen.File('/usr/lib/{}/mod{}.py'.format(name, j))
+                      for j in range(20)]
+            requires = ['glibc']
+            if abi:
+                requires.append(('python(abi)', abi))
+            packages.append(load(rpmgen.build_rpm(
+                corpusdir, name, files=files, requires=requires)))
+    return packages
+
+
+@pytest.fixture(scope='session')
+def build_log(corpusdir):
+    '''A large build.log without any mangled shebangs'''
+    path = corpusdir / 'build.log.x86_64'
+    line = b'+ /usr/bin/python3 setup.py build --executable=/usr/bin/python3\n'
+    with path.open('wb') as f:
+        for _ in range(64 * 1024 * 1024 // len(line)):
+            f.write(line)
+    return str(path)
@@ -0,0 +1,208 @@
+'''Generate synthetic RPM packages without rpmbuild or network access.
+
+Only the tags the checks (and librpm) need are written, the payload is
+a cpio (newc) archive compressed by gzip or xz, as in real packages.
+'''
+
+import collections
+import gzip
+import hashlib
+import lzma
+import os
+import stat
+import struct
+
+LEAD = struct.Struct('>4sBBhh66shh16x')
+INTRO = struct.Struct('>4s4xII')
+ENTRY = struct.Struct('>iIiI')
+
+MAGIC = b'\x8e\xad\xe8\x01'
+
+INT16, INT32, STRING, BIN, STRING_ARRAY, I18NSTRING = 3, 4, 6, 7, 8, 9
+ALIGNMENT = {INT16: 2, INT32: 4}
+FORMATS = {INT16: 'H', INT32: 'I'}
+
+SIGNATURES, IMMUTABLE = 62, 63
+RPMSENSE_EQUAL = 1 << 3
+
+File = collections.namedtuple('File', 'path, mode, content')
+File.__new__.__defaults__ = (0o100644, b'')
+
+
+def script(path, shebang, size=256):
+    '''Return an executable File starting with the given shebang'''
+    body = shebang.encode('ascii') + b'\n'
+    body += b'print("hello world")\n' * (size // 21 + 1)
+    return File(path, 0o100755, body[:max(size, len(shebang) + 1)])
+
+
+def blob(path, size, seed=0):
+    '''Return a File with pseudo-random incompressible content'''
+    chunks = []
+    digest = str(seed).encode('ascii')
+    for _ in range(0, size, hashlib.sha512().digest_size):
+        digest = hashlib.sha512(digest).digest()
+        chunks.append(digest)
+    return File(path, 0o100644, b''.join(chunks)[:size])
+
+
+def file_class(item):
+    '''Return a file(1) like description of the File'''
+    if not stat.S_ISREG(item.mode):
+        return ''
+    if item.content.startswith(b'#!'):
+        return 'script, ASCII text executable'
+    return 'data' if item.content else 'empty'
+
+
+def _encode(value_type, value):
+    if value_type in FORMATS:
+        return struct.pack('>{}{}'.format(len(value), FORMATS[value_type]),
+                           *value)
+    if value_type in (STRING, I18NSTRING, STRING_ARRAY):
+        if isinstance(value, str):
+            value = [value]
+        return b''.join(v.encode('utf-8') + b'\0' for v in value)
+    return value
+
+
+def _count(value_type, value):
+    if value_type in (STRING, BIN):
+        return 1 if value_type == STRING else len(value)
+    if value_type == I18NSTRING and isinstance(value, str):
+        return 1
+    return len(value)
+
+
+def header(tags, region):
+    '''Build a header structure with an immutable region of given tag.
+
+    tags: (dict) tag: (type, value)
+    '''
+    index = []
+    store = b''
+    for tag in sorted(tags):
+        value_type, value = tags[tag]
+        store += b'\0' * (-len(store) % ALIGNMENT.get(value_type, 1))
+        index.append(ENTRY.pack(tag, value_type, len(store),
+                                _count(value_type, value)))
+        store += _encode(value_type, value)
+    count = len(index) + 1
+    trailer = ENTRY.pack(region, BIN, -count * ENTRY.size, ENTRY.size)
+    index.insert(0, ENTRY.pack(region, BIN, len(store), ENTRY.size))
+    store += trailer
+    return INTRO.pack(MAGIC, count, len(store)) + b''.join(index) + store
+
+
+def cpio(files):
+    '''Build a cpio (newc) archive of the files'''
+    out = []
+    trailer = File('TRAILER!!!', 0, b'')
+    for ino, item in enumerate(list(files) + [trailer], 1):
+        name = item.path.encode('utf-8')
+        if item is not trailer:
+            name = b'.' + name
+        name += b'\0'
+        fields = (ino, item.mode, 0, 0, 1, 0, len(item.content),
+                  0, 0, 0, 0, len(name), 0)
+        head = b'070701' + b''.join(b'%08X' % f for f in fields)
+        out.append(head + name + b'\0' * (-(len(head) + len(name)) % 4))
+        out.append(item.content + b'\0' * (-len(item.content) % 4))
+    return b''.join(out)
+
+
+def build_rpm(directory, name, version='1.0', release='1.fc31',
+              arch='noarch', requires=(), provides=(), files=(),
+              compressor='gzip', source=False):
+    '''Write a synthetic RPM package into the directory.
+
+    requires and provides are names or (name, version) tuples.
+    files are File tuples.
+
+    Return: (str) The path to the package
+    '''
+    files = sorted(files, key=lambda f: f.path)
+    dirnames = sorted({os.path.dirname(f.path) + '/' for f in files})
+    dirindex = {d: i for i, d in enumerate(dirnames)}
+
+    def deps(items):
+        items = [(i, '') if isinstance(i, str) else i for i in items]
+        names = [n for n, _ in items]
+        versions = [v for _, v in items]
+        flags = [RPMSENSE_EQUAL if v else 0 for v in versions]
+        return names, flags, versions
+
+    if not provides and not source:
+        provides = [(name, '{}-{}'.format(version, release))]
+
+    compress = {'gzip': gzip.compress, 'xz': lzma.compress}[compressor]
+    payload = compress(cpio(files))
+
+    tags = {
+        100: (STRING_ARRAY, ['C']),
+        1000: (STRING, name),
+        1001: (STRING, version),
+        1002: (STRING, release),
+        1004: (I18NSTRING, 'Synthetic {} package'.format(name)),
+        1005: (I18NSTRING, 'Generated for benchmarking.'),
+        1006: (INT32, [0]),
+        1009: (INT32, [sum(len(f.content) for f in files)]),
+        1014: (STRING, 'Public Domain'),
+        1021: (STRING, 'linux'),
+        1022: (STRING, arch),
+        1124: (STRING, 'cpio'),
+        1125: (STRING, compressor),
+        1126: (STRING, '9'),
+        5092: (STRING_ARRAY, [hashlib.sha256(payload).hexdigest()]),
+        5093: (INT32, [8]),
+    }
+    if not source:
+        tags[1044] = (STRING, '{}-{}-{}.src.rpm'.format(
+            name, version, release))
+    for (names, flags, versions), tag_names in (
+            (deps(requires), (1049, 1048, 1050)),
+            (deps(provides), (1047, 1112, 1113))):
+        if names:
+            tags[tag_names[0]] = (STRING_ARRAY, names)
+            tags[tag_names[1]] = (INT32, flags)
+            tags[tag_names[2]] = (STRING_ARRAY, versions)
+    if files:
+        classes = sorted({file_class(f) for f in files})
+        tags.update({
+            1028: (INT32, [len(f.content) for f in files]),
+            1030: (INT16, [f.mode for f in files]),
+            1033: (INT16, [0] * len(files)),
+            1034: (INT32, [0] * len(files)),
+            1035: (STRING_ARRAY, [hashlib.md5(f.content).hexdigest()
+                                  if stat.S_ISREG(f.mode) else ''
+                                  for f in files]),
+            1036: (STRING_ARRAY, [''] * len(files)),
+            1037: (INT32, [0] * len(files)),
+            1039: (STRING_ARRAY, ['root'] * len(files)),
+            1040: (STRING_ARRAY, ['root'] * len(files)),
+            1116: (INT32, [dirindex[os.path.dirname(f.path) + '/']
+                           for f in files]),
+            1117: (STRING_ARRAY, [os.path.basename(f.path) for f in files]),
+            1118: (STRING_ARRAY, dirnames),
+            1141: (INT32, [classes.index(file_class(f)) for f in files]),
+            1142: (STRING_ARRAY, classes),
+        })
+    main = header(tags, IMMUTABLE)
+
+    signature = header({
+        269: (STRING, hashlib.sha1(main).hexdigest()),
+        273: (STRING, hashlib.sha256(main).hexdigest()),
+        1000: (INT32, [len(main) + len(payload)]),
+        1004: (BIN, hashlib.md5(main + payload).digest()),
+    }, SIGNATURES)
+    signature += b'\0' * (-len(signature) % 8)
+
+    lead = LEAD.pack(b'\xed\xab\xee\xdb', 3, 0, 1 if source else 0, 1,
+                     '{}-{}-{}'.format(name, version, release)
+                     .encode('utf-8')[:65], 1, 5)
+
+    path = os.path.join(str(directory), '{}-{}-{}.{}.rpm'.format(
+        name, version, release, 'src' if source else arch))
+    with open(path, 'wb') as f:
+        f.write(lead + signature + main + payload)
+    return path
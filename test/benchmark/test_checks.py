@@ -0,0 +1,91 @@
+import collections
+
+from taskotron_python_versions.common import file_contains
+from taskotron_python_versions.executables import get_binaries
+from taskotron_python_versions.naming_scheme import check_naming_policy
+from taskotron_python_versions.requires import check_requires_naming_scheme
+from taskotron_python_versions.two_three import check_two_three
+from taskotron_python_versions.unversioned_shebangs import (
+    FORBIDDEN_SHEBANGS,
+    get_problematic_files,
+    get_scripts_summary,
+    scan_shebangs,
+)
+
+
+Package = collections.namedtuple('Package', 'name')
+
+
+class QueryStub:
+
+    """Stub object for dnf repoquery, python-depN is provided
+    by python2-depN for even N, by python-depN otherwise.
+    """
+
+    def get_packages_by(self, provides):
+        number = int(provides.rsplit('dep', 1)[-1] or 0)
+        if number % 2:
+            return [Package(name=provides)]
+        return [Package(name=provides.replace('python-', 'python2-'))]
+
+
+def test_check_two_three_many_requires(timed, many_requires):
+    name, versions = timed(check_two_three, many_requires)
+    assert set(versions) == {2, 3}
+
+
+def test_check_two_three_subpackages(timed, subpackages):
+    def check_all():
+        return [check_two_three(package) for package in subpackages]
+    assert len(timed(check_all)) == 300
+
+
+def test_check_naming_policy_subpackages(timed, subpackages):
+    name_by_version = collections.defaultdict(set)
+    for package in subpackages:
+        check_two_three(package)
+        for version in package.py_versions:
+            name_by_version[version].add(package.name)
+
+    def check_all():
+        return [p.name for p in subpackages
+                if check_naming_policy(p, name_by_version)]
+    assert len(timed(check_all)) == 50
+
+
+def test_get_binaries_many_files(timed, many_files):
+    assert len(timed(get_binaries, [many_files])[many_files.nvr]) == 100
+
+
+def test_get_binaries_subpackages(timed, subpackages):
+    assert len(timed(get_binaries, subpackages)) == 300
+
+
+def test_get_problematic_files_python(timed, scripts):
+    assert len(timed(get_problematic_files,
+                     scripts, '#!/usr/bin/python')) == 1000
+
+
+def test_get_problematic_files_env(timed, scripts):
+    assert len(timed(get_problematic_files,
+                     scripts, '#!/usr/bin/env python')) == 1000
+
+
+def test_scan_shebangs_all(timed, scripts):
+    problematic = timed(scan_shebangs, scripts, FORBIDDEN_SHEBANGS)
+    assert [len(problematic[s]) for s in FORBIDDEN_SHEBANGS] == [1000, 1000]
+
+
+def test_get_scripts_summary_scripts(timed, scripts_package):
+    summary = timed(get_scripts_summary, scripts_package)
+    assert [len(summary[s]) for s in FORBIDDEN_SHEBANGS] == [1000, 1000]
+
+
+def test_check_requires_naming_scheme_many_requires(timed, many_requires):
+    misnamed = timed(check_requires_naming_scheme,
+                     many_requires, QueryStub())
+    assert len(misnamed) == 1000
+
+
+def test_file_contains_build_log(timed, build_log):
+    assert not timed(file_contains, build_log, 'WARNING: mangling')
@@ -0,0 +1,89 @@
+import pathlib
+import sys
+from unittest import mock
+
+import pytest
+
+
+@pytest.fixture
+def batch(monkeypatch):
+    # libtaskotron is not available on Python 3
+    monkeypatch.setitem(sys.modules, 'libtaskotron', mock.Mock())
+    monkeypatch.syspath_prepend(
+        str(pathlib.Path(__file__).parents[2]))
+    modules = 'python_versions_check', 'python_versions_batch'
+    for module in modules:
+        monkeypatch.delitem(sys.modules, module, raising=False)
+    import python_versions_batch
+    yield python_versions_batch
+    # imported with the libtaskotron stub
+    for module in modules:
+        sys.modules.pop(module, None)
+
+
+def test_read_builds(batch, tmpdir):
+    builds = tmpdir.join('builds')
+    builds.write('\n'.join([
+        '# koji build, workdir',
+        'foo-1.0-1.fc27 /tmp/foo',
+        '',
+        '   ',
+        '  bar-2.0-1.fc27   /tmp/with space  ',
+        '#baz-1.0-1.fc27 /tmp/baz',
+        'foo-1.0-1.fc27 /tmp/foo-again',
+    ]))
+    assert batch.read_builds(str(builds)) == [
+        ('foo-1.0-1.fc27', '/tmp/foo'),
+        ('bar-2.0-1.fc27', '/tmp/with space'),
+    ]
+
+
+def test_read_builds_missing_workdir(batch, tmpdir):
+    builds = tmpdir.join('builds')
+    builds.write('foo-1.0-1.fc27\n')
+    with pytest.raises(ValueError):
+        batch.read_builds(str(builds))
+
+
+def test_parse_args(batch, tmpdir):
+    builds = tmpdir.join('builds')
+    builds.write('foo-1.0-1.fc27 /tmp/foo\n')
+    args = batch.parse_args([str(builds), 'out', 'dist.python-versions',
+                             'x86_64,noarch'])
+    assert args.builds == [('foo-1.0-1.fc27', '/tmp/foo')]
+    assert args.arches == ['x86_64', 'noarch']
+
+
+def test_run_batch(batch, monkeypatch, tmpdir):
+    check = sys.modules['python_versions_check']
+    calls = []
+
+    def run(koji_build, workdir, **kwargs):
+        calls.append((koji_build, workdir, kwargs))
+        if koji_build == 'crash-1-1':
+            raise RuntimeError('crashed')
+        return int(koji_build.startswith('fail'))
+
+    monkeypatch.setattr(check, 'run', run)
+    monkeypatch.setattr(check, 'repoquery_stats', lambda: {'hits': 1})
+
+    builds = [('pass-1-1', 'w1'), ('pass-2-1', 'w2')]
+    assert check.run_batch(builds, artifactsdir=str(tmpdir),
+                           jobs=2) == 0
+    assert [call[:2] for call in calls] == builds
+    assert calls[0][2] == {
+        'artifactsdir': pathlib.Path(str(tmpdir)) / 'pass-1-1',
+        'testcase': 'dist.python-versions',
+        'arches': ['x86_64', 'noarch', 'src'],
+        'jobs': 2,
+    }
+
+    del calls[:]
+    builds = [('fail-1-1', 'w1'), ('pass-1-1', 'w2')]
+    assert check.run_batch(builds, artifactsdir=str(tmpdir)) == 1
+    assert len(calls) == 2
+
+    del calls[:]
+    builds = [('crash-1-1', 'w1'), ('pass-1-1', 'w2')]
+    assert check.run_batch(builds, artifactsdir=str(tmpdir)) == 1
+    assert [call[0] for call in calls] == ['crash-1-1', 'pass-1-1']
@@ -0,0 +1,100 @@
+import os
+import time
+
+import pytest
+
+from taskotron_python_versions.cache import (
+    DiskCache,
+    HeaderCache,
+    ScanCache,
+    VersionedNameCache,
+)
+from taskotron_python_versions.common import Package
+
+from .common import gpkg_path
+
+
+def test_disk_cache_roundtrip(tmpdir):
+    cache = DiskCache(str(tmpdir))
+    assert cache.get('foo') is None
+    cache.put('foo', {'bar': ['baz', '\udcff']})
+    assert DiskCache(str(tmpdir)).get('foo') == {'bar': ['baz', '\udcff']}
+
+
+def test_disk_cache_corrupted(tmpdir):
+    cache = DiskCache(str(tmpdir))
+    cache.put('foo', [1])
+    with open(cache.path_for('foo'), 'w') as f:
+        f.write('{')
+    assert cache.get('foo') is None
+
+
+@pytest.mark.parametrize('pkgglob', ('tracer*', 'yum*', 'pyserial*'))
+def test_package_from_header_cache(tmpdir, pkgglob):
+    cache = HeaderCache(str(tmpdir))
+    path = gpkg_path(pkgglob)
+    fresh = Package(path, cache=cache)
+    assert fresh.hdr is not None
+    cached = Package(path, cache=cache)
+    assert cached.hdr is None
+    for attr in Package.TAGS:
+        assert getattr(cached, attr) == getattr(fresh, attr)
+
+
+def test_header_cache_key_changes_with_mtime(tmpdir):
+    path = str(tmpdir.join('tracer.rpm'))
+    with open(gpkg_path('tracer*'), 'rb') as src, open(path, 'wb') as dst:
+        dst.write(src.read())
+    cache = HeaderCache(str(tmpdir.join('cache')))
+    key = cache.key_for(path)
+    os.utime(path, (0, 0))
+    assert cache.key_for(path) != key
+
+
+def test_header_cache_key_of_non_rpm(tmpdir):
+    cache = HeaderCache(str(tmpdir))
+    assert cache.key_for(__file__) is None
+
+
+def test_versioned_name_cache_expires(tmpdir, monkeypatch):
+    cache = VersionedNameCache(str(tmpdir), ttl=60)
+    key = cache.key_for('29', 'fedora=repomd:aaa', 'python-six')
+    cache.put(key, {'versioned': 'python2-six'})
+    assert cache.get(key) == {'versioned': 'python2-six'}
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    assert cache.get(key) is None
+
+
+def test_versioned_name_cache_key_has_revision(tmpdir):
+    cache = VersionedNameCache(str(tmpdir))
+    assert (cache.key_for('29', 'fedora=repomd:aaa', 'python-six') !=
+            cache.key_for('29', 'fedora=repomd:bbb', 'python-six'))
+
+
+def test_scan_cache_evicts_least_recently_used(tmpdir):
+    cache = ScanCache(str(tmpdir), max_size=None)
+    for n in range(10):
+        cache.put(cache.key_for('digest{}'.format(n)), {'x': 'y' * 100})
+        os.utime(cache.path_for(cache.key_for('digest{}'.format(n))),
+                 (n, n))
+    assert cache.get(cache.key_for('digest0')) is not None
+    cache.max_size = 5 * os.path.getsize(cache.path_for(
+        cache.key_for('digest1')))
+    assert cache.evict() == 6
+    kept = [n for n in range(10)
+            if cache.get(cache.key_for('digest{}'.format(n))) is not None]
+    assert kept == [0, 7, 8, 9]
+
+
+def test_scan_cache_within_size(tmpdir):
+    cache = ScanCache(str(tmpdir))
+    cache.put(cache.key_for('digest'), {'x': 'y'})
+    assert cache.evict() == 0
+    assert cache.get(cache.key_for('digest')) == {'x': 'y'}
+
+
+def test_scan_cache_evicts_on_put(tmpdir):
+    cache = ScanCache(str(tmpdir), max_size=0)
+    cache.put(cache.key_for('digest'), {'x': 'y'})
+    assert cache.get(cache.key_for('digest')) is None
@@ -1,8 +1,25 @@
+import glob
+import gzip
+import os
+import pickle
+import threading
+
 import pytest
 
-from taskotron_python_versions.common import file_contains
+from taskotron_python_versions.common import (
+    ArtifactWriter,
+    file_contains,
+    load_packages,
+    Package,
+    PackageException,
+    PackageSnapshot,
+    process_pool,
+    write_to_artifact,
+)
+from taskotron_python_versions.instrumentation import measure
+from taskotron_python_versions.two_three import check_two_three
 
-from .common import gpkg_path
+from .common import gpkg, gpkg_path, pkg_path
 
 
 @pytest.mark.parametrize('thing', ('Whither Canada?',
@@ -25,8 +42,168 @@ def test_this_file_doesnt_contain_things_it_doesnt(thing):
     assert not file_contains(__file__, thing)
 
 
+def test_searching_in_empty_logs(tmpdir):
+    empty = tmpdir.join('build.log.x86_64')
+    empty.write('')
+    assert not file_contains(str(empty), 'python')
+
+
 @pytest.mark.parametrize(('word', 'is_in'), (('python', True),
                                              ('abracadabra', False)))
 def test_searching_in_weird_logs(word, is_in):
     fake_log = gpkg_path('yum*')
     assert file_contains(fake_log, word) == is_in
+
+
+@pytest.mark.parametrize(('jobs', 'pool'), ((1, 'process'),
+                                            (3, 'process'),
+                                            (3, 'thread')))
+def test_load_packages_keeps_order(jobs, pool):
+    paths = sorted(glob.glob(pkg_path('*.rpm')))
+    packages = load_packages(paths, jobs=jobs, pool=pool)
+    assert [p.path for p in packages] == paths
+    assert [p.nvr for p in packages] == [p.nvr for p in load_packages(paths)]
+
+
+@pytest.mark.parametrize(('jobs', 'pool'), ((1, 'process'),
+                                            (3, 'process'),
+                                            (3, 'thread')))
+def test_load_packages_worker_cpu_time(jobs, pool):
+    paths = sorted(glob.glob(pkg_path('*.rpm')))
+    with measure('load_packages') as measurement:
+        load_packages(paths, jobs=jobs, pool=pool)
+    assert (measurement.worker_cpu_time > 0) == (jobs > 1)
+
+
+def test_process_pool_is_not_forked():
+    held = threading.Lock()
+    with held:
+        with process_pool(2) as executor:
+            # a forked worker would inherit the held lock
+            assert executor._mp_context.get_start_method() == 'forkserver'
+            assert executor.submit(os.getpid).result() != os.getpid()
+
+
+@pytest.mark.parametrize('jobs', (1, 2))
+def test_load_packages_skips_broken(tmpdir, jobs):
+    broken = tmpdir.join('broken.rpm')
+    broken.write('this is not an rpm')
+    paths = [gpkg_path('tracer*'), str(broken), gpkg_path('yum*')]
+    packages = load_packages(paths, jobs=jobs, verify=False)
+    assert [p.name for p in packages] == ['tracer', 'yum']
+
+
+@pytest.mark.parametrize('pkgglob', ('tracer*', 'yum*', 'pyserial*'))
+def test_snapshot_matches_package(pkgglob):
+    package = gpkg(pkgglob)
+    snapshot = package.snapshot()
+    assert not hasattr(snapshot, '__dict__')
+    assert snapshot.filename == package.filename
+    assert snapshot.is_srpm == package.is_srpm
+    for tag in Package.TAGS:
+        value = getattr(package, tag)
+        if isinstance(value, list):
+            value = tuple(value)
+        assert getattr(snapshot, tag) == value
+    assert check_two_three(snapshot) == check_two_three(package)
+    assert snapshot.py_versions == package.py_versions
+
+
+def test_snapshot_pickles():
+    snapshot = gpkg('tracer*').snapshot()
+    check_two_three(snapshot)
+    clone = pickle.loads(pickle.dumps(snapshot))
+    assert isinstance(clone, PackageSnapshot)
+    for attr in PackageSnapshot.__slots__:
+        assert getattr(clone, attr) == getattr(snapshot, attr)
+
+
+@pytest.mark.parametrize('pool', ('process', 'thread'))
+def test_load_packages_snapshots(pool):
+    paths = sorted(glob.glob(pkg_path('*.rpm')))
+    snapshots = load_packages(paths, jobs=2, pool=pool, snapshot=True)
+    assert all(isinstance(s, PackageSnapshot) for s in snapshots)
+    assert [s.nvr for s in snapshots] == [p.nvr for p in load_packages(paths)]
+
+
+@pytest.mark.parametrize('pkgglob', ('tracer*', 'yum*', 'libgccjit*'))
+def test_package_from_stream(pkgglob):
+    package = gpkg(pkgglob)
+    with open(gpkg_path(pkgglob), 'rb') as f:
+        streamed = Package.from_stream(f)
+        assert f.tell() < os.path.getsize(gpkg_path(pkgglob))
+    assert streamed.filename == package.filename
+    for tag in Package.TAGS:
+        assert getattr(streamed, tag) == getattr(package, tag)
+
+
+@pytest.mark.parametrize('pkgglob', ('tracer*', 'pyserial*'))
+def test_package_from_truncated_bytes(pkgglob):
+    package = gpkg(pkgglob)
+    with open(gpkg_path(pkgglob), 'rb') as f:
+        Package.from_stream(f)
+        header_size = f.tell()
+        f.seek(0)
+        data = f.read(header_size)
+    streamed = Package.from_stream(data)
+    assert streamed.path is None
+    assert streamed.filename == package.filename
+    assert streamed.require_names == package.require_names
+
+
+def test_package_from_too_truncated_bytes():
+    with open(gpkg_path('tracer*'), 'rb') as f:
+        data = f.read(1000)
+    with pytest.raises(PackageException):
+        Package.from_stream(data)
+
+
+def test_artifact_writer_keeps_section_order(tmpdir):
+    path = tmpdir.join('output.log')
+    writer = ArtifactWriter(str(path))
+    first, second = writer.section('first'), writer.section('second')
+    write_to_artifact(second, 'Second message', 'http://second')
+    write_to_artifact(first, 'First message', 'http://first')
+    assert str(first) == str(path)
+    assert not path.check()
+    writer.flush()
+    text = path.read()
+    assert text.index('First message') < text.index('Second message')
+    assert 'http://second' in text
+    writer.flush()
+    assert path.read() == text
+
+
+def test_artifact_writer_compressed(tmpdir):
+    writer = ArtifactWriter(str(tmpdir.join('output.log')), compress=True)
+    write_to_artifact(writer.section('one'), 'Message', 'http://info')
+    writer.flush()
+    assert str(writer).endswith('output.log.gz')
+    with gzip.open(str(writer), 'rt') as f:
+        assert 'Message' in f.read()
+
+
+def test_artifact_writer_max_size(tmpdir):
+    writer = ArtifactWriter(str(tmpdir.join('output.log')), max_size=100)
+    write_to_artifact(writer.section('one'), 'x' * 1000, 'http://info')
+    writer.flush()
+    text = tmpdir.join('output.log').read()
+    assert text.startswith('\n' + 'x' * 99)
+    assert 'bytes of the output were truncated' in text
+
+
+def test_artifact_writer_without_failures(tmpdir):
+    writer = ArtifactWriter(str(tmpdir.join('output.log')))
+    writer.section('one')
+    writer.flush()
+    assert not tmpdir.join('output.log').check()
+
+
+@pytest.mark.parametrize(('pkgglob', 'digest'), (
+    ('tracer*', 'sigmd5:d2f3dd1e70f11929fbe9f12862225d1c'),
+    ('pyserial*', 'sigmd5:9227f87b95502e29dc9a07f7c41712e2'),
+))
+def test_payload_digest(pkgglob, digest):
+    package = gpkg(pkgglob)
+    assert package.payload_digest == digest
+    assert package.snapshot().payload_digest == digest
@@ -0,0 +1,88 @@
+import io
+
+import pytest
+
+from taskotron_python_versions.cache import HeaderCache
+from taskotron_python_versions.header import (
+    HEADER_INTRO,
+    INDEX_ENTRY,
+    LEAD_SIZE,
+    RPMSIGTAG_MD5,
+    RPMSIGTAG_SHA1,
+    RPMSIGTAG_SHA256,
+    HeaderError,
+    get_binary,
+    header_digest,
+    read_header,
+    read_headers,
+    read_lead,
+)
+
+from .common import gpkg_path
+
+
+@pytest.mark.parametrize(('pkgglob', 'digest'), (
+    ('pyserial*', '293ddadf8e8602bfa0192418326b734fa0dd8083'),
+    ('tracer*', 'be72e80985f57a166a9fc391cc7badcd4f535513'),
+))
+def test_header_digest(pkgglob, digest):
+    with open(gpkg_path(pkgglob), 'rb') as f:
+        assert header_digest(f) == digest
+
+
+def test_header_digest_reads_only_signature():
+    with open(gpkg_path('yum*'), 'rb') as f:
+        header_digest(f)
+        assert f.tell() < 5000
+
+
+@pytest.mark.parametrize(('pkgglob', 'md5'), (
+    ('pyserial*', '9227f87b95502e29dc9a07f7c41712e2'),
+    ('tracer*', 'd2f3dd1e70f11929fbe9f12862225d1c'),
+))
+def test_signature_md5(pkgglob, md5):
+    with open(gpkg_path(pkgglob), 'rb') as f:
+        signature, _ = read_headers(f)
+    assert get_binary(signature, RPMSIGTAG_MD5).hex() == md5
+
+
+@pytest.mark.parametrize('data', (
+    b'',
+    b'\xed\xab\xee\xdb',
+    b'not an rpm at all' * 10,
+))
+def test_bad_lead(data):
+    with pytest.raises(HeaderError):
+        read_lead(io.BytesIO(data))
+
+
+def test_truncated_header():
+    with open(gpkg_path('tracer*'), 'rb') as f:
+        data = f.read(200)
+    stream = io.BytesIO(data)
+    read_lead(stream)
+    with pytest.raises(HeaderError):
+        read_header(stream)
+
+
+def corrupt_signature(data, offset):
+    """Return the RPM data with the signature digests moved to offset"""
+    data = bytearray(data)
+    _, index_count, _ = HEADER_INTRO.unpack_from(data, LEAD_SIZE)
+    for position in range(index_count):
+        start = LEAD_SIZE + HEADER_INTRO.size + position * INDEX_ENTRY.size
+        tag, type_, _, count = INDEX_ENTRY.unpack_from(data, start)
+        if tag in (RPMSIGTAG_SHA1, RPMSIGTAG_SHA256):
+            INDEX_ENTRY.pack_into(data, start, tag, type_, offset, count)
+    return bytes(data)
+
+
+@pytest.mark.parametrize('offset', (-1, 10 ** 6))
+def test_bad_signature_offset(tmpdir, offset):
+    with open(gpkg_path('tracer*'), 'rb') as f:
+        data = corrupt_signature(f.read(), offset)
+    with pytest.raises(HeaderError):
+        header_digest(io.BytesIO(data))
+    path = tmpdir.join('bad.rpm')
+    path.write_binary(data)
+    assert HeaderCache(str(tmpdir.join('cache'))).key_for(str(path)) is None
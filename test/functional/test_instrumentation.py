@@ -0,0 +1,95 @@
+import json
+import threading
+import time
+
+from taskotron_python_versions.instrumentation import (
+    count,
+    current_rss,
+    measure,
+    write_timing,
+)
+
+
+def test_measure_times():
+    with measure('sleepy') as measurement:
+        time.sleep(0.05)
+    assert measurement.wall_time >= 0.05
+    assert measurement.cpu_time < measurement.wall_time
+    assert measurement.peak_rss_delta >= 0
+
+
+def test_count_in_measured_block():
+    with measure('outer') as outer:
+        count('dnf_queries')
+        with measure('inner') as inner:
+            count('dnf_queries', 3)
+            count('bugzilla_queries')
+        count('dnf_queries')
+    assert outer.counters == {'dnf_queries': 2}
+    assert inner.counters == {'dnf_queries': 3, 'bugzilla_queries': 1}
+
+
+def test_count_outside_measured_block():
+    count('dnf_queries')  # does not explode
+
+
+def test_profile(tmpdir):
+    with measure('profiled', profile_dir=str(tmpdir.join('profile'))):
+        sum(range(1000))
+    assert tmpdir.join('profile', 'profiled.prof').check()
+
+
+def test_write_timing(tmpdir):
+    with measure('one') as one:
+        count('archive_entries', 42)
+    with measure('two') as two:
+        pass
+    path = tmpdir.join('timing.json')
+    write_timing(str(path), [one, two])
+    timing = json.loads(path.read())
+    assert set(timing) == {'one', 'two'}
+    assert timing['one']['archive_entries'] == 42
+    assert set(timing['two']) == {'wall_time', 'cpu_time',
+                                  'peak_rss_delta_kib'}
+
+
+def test_current_rss():
+    assert current_rss() > 0
+
+
+def test_peak_rss_delta_not_reported_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+    measurements = []
+
+    def measured(name):
+        with measure(name) as measurement:
+            barrier.wait()
+            barrier.wait()
+        measurements.append(measurement)
+
+    threads = [threading.Thread(target=measured, args=(name,))
+               for name in ('one', 'two')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [m.peak_rss_delta for m in measurements] == [None, None]
+    assert all('peak_rss_delta_kib' not in m.as_dict()
+               for m in measurements)
+    # nested in one thread is still serial
+    with measure('outer') as outer:
+        with measure('inner'):
+            pass
+    assert outer.peak_rss_delta is not None
+
+
+def test_skipped_profile_is_reported(tmpdir, monkeypatch):
+    class BusyProfile:
+        def enable(self):
+            raise ValueError('Another profiling tool is already active')
+
+    monkeypatch.setattr('cProfile.Profile', BusyProfile)
+    with measure('busy', profile_dir=str(tmpdir)) as measurement:
+        pass
+    assert measurement.as_dict()['profile_skipped']
+    assert not tmpdir.join('busy.prof').check()
@@ -0,0 +1,75 @@
+from collections import namedtuple
+
+import pytest
+
+from taskotron_python_versions.prefilter import (
+    involves_python,
+    python_related,
+)
+
+from .common import gpkg
+
+
+PackageStub = namedtuple('PackageStub',
+                         'require_names, provide_names, files')
+PackageStub.__new__.__defaults__ = ((), (), ())
+
+
+@pytest.mark.parametrize('name', (
+    'python',
+    'python(abi)',
+    'python3-foo',
+    'foo-python',
+    'libpython2.7.so.1.0()(64bit)',
+    '/usr/bin/python',
+    '/usr/bin/env',
+    '/usr/lib/python3.7/site-packages/foo.py',
+    '/usr/share/doc/Python-foo',
+    'pygtk2',
+    'pycairo',
+    'py-foo',
+    'system-python',
+))
+def test_python_related(name):
+    assert python_related(name)
+
+
+@pytest.mark.parametrize('name', (
+    'glibc',
+    'libc.so.6()(64bit)',
+    '/bin/sh',
+    '/usr/bin/perl',
+    '/usr/bin/pydoc-like-tool',
+    '/usr/share/doc/foo/README',
+    'rtld(GNU_HASH)',
+))
+def test_not_python_related(name):
+    assert not python_related(name)
+
+
+@pytest.mark.parametrize('package', (
+    PackageStub(require_names=('glibc', 'python3')),
+    PackageStub(provide_names=('python3-foo',)),
+    PackageStub(files=('/usr/lib/python3.7/site-packages/foo.py',)),
+    PackageStub(require_names=('/usr/bin/env',)),
+))
+def test_stub_involves_python(package):
+    assert involves_python(package)
+
+
+def test_stub_does_not_involve_python():
+    assert not involves_python(PackageStub(
+        require_names=('glibc', '/bin/sh'),
+        provide_names=('foo', 'foo(x86-64)'),
+        files=('/usr/bin/foo', '/usr/share/man/man1/foo.1.gz')))
+
+
+@pytest.mark.parametrize('pkgglob', ('tracer*', 'yum*', 'pyserial*',
+                                     'python2-geoip2*', 'python-peak-rules*',
+                                     'nodejs-semver*'))
+def test_involves_python(pkgglob):
+    assert involves_python(gpkg(pkgglob))
+
+
+def test_does_not_involve_python():
+    assert not involves_python(gpkg('libgccjit-devel*'))
@@ -0,0 +1,284 @@
+import os
+import sqlite3
+import sys
+from collections import namedtuple
+from unittest import mock
+
+import pytest
+
+from taskotron_python_versions import provides_index
+from taskotron_python_versions.provides_index import (
+    basearch,
+    export_query,
+    main,
+    metalink_revision,
+    ProvidesIndex,
+    read_revisions,
+    refresh_index,
+    repo_revision,
+    repomd_revision,
+)
+from taskotron_python_versions.repos import use_provides_indexes
+from taskotron_python_versions.requires import (
+    check_requires_naming_scheme,
+    get_repoquery,
+    get_versioned_name,
+)
+
+from .common import gpkg
+
+
+HawkeyPackageStub = namedtuple('HawkeyPackageStub',
+                               'name, reponame, provides')
+
+QUERY = (
+    HawkeyPackageStub('python2-six', 'fedora',
+                      ['python2-six = 1.11.0-3.fc29',
+                       'python-six = 1.11.0-3.fc29']),
+    HawkeyPackageStub('python2-six', 'updates',
+                      ['python2-six = 1.11.0-4.fc29',
+                       'python-six = 1.11.0-4.fc29']),
+    HawkeyPackageStub('python-iniparse', 'fedora',
+                      ['python-iniparse = 0.4-30.fc29']),
+    HawkeyPackageStub('python2', 'fedora',
+                      ['python2 = 2.7.15-1.fc29', 'python = 2.7.15-1.fc29',
+                       'python(abi) = 2.7']),
+    HawkeyPackageStub('python2-rpm', 'fedora',
+                      ['python2-rpm = 4.14.2-1.fc29',
+                       'rpm-python = 4.14.2-1.fc29']),
+    HawkeyPackageStub('python2-psutil', 'fedora', ['python-psutil']),
+)
+
+
+@pytest.fixture
+def index(tmpdir):
+    path = str(tmpdir.join('provides.sqlite'))
+    export_query(QUERY, path)
+    index = ProvidesIndex(path)
+    yield index
+    index.close()
+
+
+@pytest.mark.parametrize(('provides', 'expected'), (
+    ('python-six', ['python2-six']),
+    ('python-iniparse', ['python-iniparse']),
+    ('python(abi)', ['python2']),
+    ('python2-six = 1.11.0-3.fc29', []),
+    ('python-nope', []),
+))
+def test_get_packages_by(index, provides, expected):
+    assert [p.name for p in index.get_packages_by(provides)] == expected
+
+
+@pytest.mark.parametrize('batch', (1, 2, 500))
+def test_get_providers(index, monkeypatch, batch):
+    monkeypatch.setattr(ProvidesIndex, 'BATCH', batch)
+    providers = index.get_providers(
+        ['python-six', 'python', 'python-nope', 'python-six'])
+    assert {name: [p.name for p in packages]
+            for name, packages in providers.items()} == {
+        'python': ['python2'],
+        'python-nope': [],
+        'python-six': ['python2-six']}
+
+
+@pytest.mark.parametrize(('require', 'expected'), (
+    ('python-six', 'python2-six'),
+    ('python-iniparse', None),
+    ('python', 'python2'),
+    ('python-nope', None),
+))
+def test_get_versioned_name_from_index(index, require, expected):
+    assert get_versioned_name(require, index) == expected
+
+
+def test_check_requires_naming_scheme_with_index(index):
+    assert check_requires_naming_scheme(gpkg('yum*'), index) == {
+        'python (python2 is available)',
+        'rpm-python (python2-rpm is available)'}
+
+
+def test_export_replaces_index(tmpdir):
+    path = str(tmpdir.join('provides.sqlite'))
+    export_query(QUERY, path)
+    export_query(QUERY[:1], path)
+    assert [p.name for p in ProvidesIndex(path).get_packages_by(
+        'python-iniparse')] == []
+    assert tmpdir.listdir() == [tmpdir.join('provides.sqlite')]
+
+
+def test_get_repoquery_uses_index(tmpdir):
+    export_query(QUERY, str(tmpdir.join('29.sqlite')))
+    use_provides_indexes(tmpdir)
+    try:
+        assert isinstance(get_repoquery('29'), ProvidesIndex)
+        assert get_repoquery('29') is get_repoquery('29')
+        assert not isinstance(get_repoquery('30'), ProvidesIndex)
+    finally:
+        use_provides_indexes(None)
+
+
+REPOMD = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">
+  <revision>{revision}</revision>
+  <data type="primary">
+    <checksum type="sha256">{checksum}</checksum>
+    <location href="repodata/{checksum}-primary.xml.gz"/>
+  </data>
+  <data type="filelists">
+    <checksum type="sha256">0123</checksum>
+  </data>
+</repomd>
+"""
+
+METALINK = """<?xml version="1.0" encoding="utf-8"?>
+<metalink version="3.0" xmlns="http://www.metalinker.org/"
+  xmlns:mm0="http://fedorahosted.org/mirrormanager">
+  <files>
+    <file name="repomd.xml">
+      <mm0:timestamp>1540000000</mm0:timestamp>
+      <size>4232</size>
+      <verification>
+        <hash type="md5">abcd</hash>
+        <hash type="sha256">cafe</hash>
+      </verification>
+    </file>
+  </files>
+</metalink>
+"""
+
+
+def test_repomd_revision():
+    assert repomd_revision(REPOMD.format(
+        revision='1540', checksum='beef')) == 'repomd:beef'
+
+
+def test_metalink_revision():
+    assert metalink_revision(METALINK) == 'metalink:cafe'
+
+
+@pytest.mark.parametrize(('machine', 'expected'), (
+    ('x86_64', 'x86_64'),
+    ('i686', 'i386'),
+    ('armv7l', 'armhfp'),
+    ('ppc64le', 'ppc64le'),
+    ('aarch64', 'aarch64'),
+))
+def test_basearch_without_dnf(monkeypatch, machine, expected):
+    monkeypatch.setitem(sys.modules, 'dnf.rpm', None)
+    monkeypatch.setattr('platform.machine', lambda: machine)
+    assert basearch() == expected
+
+
+def test_basearch_from_dnf(monkeypatch):
+    dnf = mock.Mock()
+    dnf.rpm.basearch.side_effect = {'armv7hnl': 'armhfp'}.get
+    monkeypatch.setitem(sys.modules, 'dnf', dnf)
+    monkeypatch.setitem(sys.modules, 'dnf.rpm', dnf.rpm)
+    monkeypatch.setitem(sys.modules, 'hawkey',
+                        mock.Mock(detect_arch=lambda: 'armv7hnl'))
+    assert basearch() == 'armhfp'
+
+
+@pytest.mark.parametrize('arch', ('i386', 'armhfp'))
+def test_repo_revision_arch(monkeypatch, arch):
+    urls = []
+
+    def fetch(url):
+        urls.append(url)
+        return METALINK
+
+    monkeypatch.setattr(provides_index, '_fetch', fetch)
+    monkeypatch.setattr(provides_index, 'basearch', lambda: arch)
+    assert repo_revision('fedora-$releasever', '29') == 'metalink:cafe'
+    assert repo_revision('fedora-$releasever', '29', arch='s390x')
+    assert urls == [
+        'https://mirrors.fedoraproject.org/'
+        'metalink?repo=fedora-29&arch={}'.format(arch),
+        'https://mirrors.fedoraproject.org/'
+        'metalink?repo=fedora-29&arch=s390x',
+    ]
+
+
+def write_repo(directory, revision, checksum):
+    directory.join('repodata', 'repomd.xml').write(
+        REPOMD.format(revision=revision, checksum=checksum), ensure=True)
+    return str(directory)
+
+
+class DNFQueryStub:
+
+    """Stub of DNFQuery, loads QUERY packages of the given sources."""
+
+    loaded = []
+
+    def __init__(self, release, sources):
+        self.loaded.append(sorted(sources))
+        self.query = [p for p in QUERY if p.reponame in sources]
+
+
+@pytest.fixture
+def repos(tmpdir, monkeypatch):
+    monkeypatch.setattr(provides_index, 'DNFQuery', DNFQueryStub)
+    monkeypatch.setattr(DNFQueryStub, 'loaded', [])
+    return {'fedora': write_repo(tmpdir.join('fedora'), '1', 'aaa'),
+            'updates': write_repo(tmpdir.join('updates'), '1', 'bbb')}
+
+
+def providers(path, provides):
+    return [p.name for p in ProvidesIndex(path).get_packages_by(provides)]
+
+
+def test_refresh_index_creates(tmpdir, repos):
+    path = str(tmpdir.join('29.sqlite'))
+    assert refresh_index(path, '29', repos) == ['fedora', 'updates']
+    assert read_revisions(path) == {'fedora': 'repomd:aaa',
+                                    'updates': 'repomd:bbb'}
+    assert providers(path, 'python-six') == ['python2-six']
+
+
+def test_refresh_index_up_to_date(tmpdir, repos):
+    path = str(tmpdir.join('29.sqlite'))
+    refresh_index(path, '29', repos)
+    mtime = os.stat(path).st_mtime_ns
+    assert refresh_index(path, '29', repos) == []
+    assert DNFQueryStub.loaded == [['fedora', 'updates']]
+    assert os.stat(path).st_mtime_ns == mtime
+
+
+def test_refresh_index_changed_repo_only(tmpdir, repos):
+    path = str(tmpdir.join('29.sqlite'))
+    refresh_index(path, '29', repos)
+    # revision bumped, primary unchanged
+    write_repo(tmpdir.join('fedora'), '2', 'aaa')
+    write_repo(tmpdir.join('updates'), '2', 'ccc')
+    assert refresh_index(path, '29', repos) == ['updates']
+    assert DNFQueryStub.loaded == [['fedora', 'updates'], ['updates']]
+    assert read_revisions(path) == {'fedora': 'repomd:aaa',
+                                    'updates': 'repomd:ccc'}
+    # provides of both repos are there, none duplicated
+    assert providers(path, 'python-six') == ['python2-six']
+    assert providers(path, 'python(abi)') == ['python2']
+
+
+def test_refresh_index_removed_repo(tmpdir, repos):
+    path = str(tmpdir.join('29.sqlite'))
+    refresh_index(path, '29', repos)
+    assert refresh_index(path, '29', {'fedora': repos['fedora']}) == []
+    assert read_revisions(path) == {'fedora': 'repomd:aaa'}
+    assert providers(path, 'python-six') == ['python2-six']
+
+
+def test_refresh_index_without_revisions(tmpdir, repos):
+    path = str(tmpdir.join('29.sqlite'))
+    sqlite3.connect(path).executescript(
+        'CREATE TABLE provides (provide, package, repo);')
+    assert read_revisions(path) == {}
+    assert refresh_index(path, '29', repos) == ['fedora', 'updates']
+    assert providers(path, 'python-six') == ['python2-six']
+
+
+def test_main_not_xml(monkeypatch, tmpdir):
+    monkeypatch.setattr(provides_index, '_fetch',
+                        lambda url: b'<html>proxy error')
+    assert main(['29', str(tmpdir.join('29.sqlite'))]) == 1
@@ -1,14 +1,26 @@
+import threading
+import time
 from collections import namedtuple
 
 import pytest
 
+from taskotron_python_versions import py3_support
 from taskotron_python_versions.py3_support import (
+    bug_url,
+    fetch_tracker_bugs,
+    bugzilla_session,
+    BugzillaTimeout,
+    call_with_deadline,
+    get_py3_bugzillas_for,
     ignored,
     filter_urls,
     ported_to_py3,
     PY3_TRACKER_BUG,
     IGNORE_TRACKER_BUGS,
+    TrackerSnapshot,
+    use_tracker_snapshot,
 )
+from taskotron_python_versions.instrumentation import count, measure
 from taskotron_python_versions.two_three import check_two_three
 from .common import gpkg
 
@@ -64,3 +76,175 @@ def test_ported_to_py3(pkgglobs, expected):
     for package in packages:
         check_two_three(package)
     assert ported_to_py3(packages) == expected
+
+
+def test_bugzilla_sessions_are_reused(monkeypatch):
+    sessions = []
+    monkeypatch.setattr(py3_support, '_bzapis', [])
+    monkeypatch.setattr(py3_support.bugzilla, 'Bugzilla',
+                        lambda *args, **kwargs: sessions.append(object()) or
+                        sessions[-1])
+    with bugzilla_session() as first:
+        pass
+    with bugzilla_session() as second:
+        assert second is first
+        # in use, so a new one is created
+        with bugzilla_session() as third:
+            assert third is not first
+    assert len(sessions) == 2
+
+
+def test_failed_bugzilla_session_is_dropped(monkeypatch):
+    monkeypatch.setattr(py3_support, '_bzapis', [])
+    monkeypatch.setattr(py3_support.bugzilla, 'Bugzilla',
+                        lambda *args, **kwargs: object())
+    with pytest.raises(ValueError):
+        with bugzilla_session():
+            raise ValueError('broken')
+    assert py3_support._bzapis == []
+
+
+class BugzillaStub:
+
+    """Stub object for bugzilla.Bugzilla, answers queries with bugs."""
+
+    def __init__(self, bugs):
+        self.bugs = bugs
+        self.queries = []
+
+    def build_query(self, **kwargs):
+        return dict(kwargs)
+
+    def query(self, query):
+        self.queries.append(dict(query))
+        if 'limit' in query:
+            return self.bugs[query['offset']:query['offset'] + query['limit']]
+        return self.bugs
+
+
+class BzBugStub(namedtuple('BzBugStub', 'id, component, status, blocks')):
+
+    @property
+    def weburl(self):
+        return bug_url(self.id)
+
+
+TRACKED = [
+    BzBugStub(1, 'python-foo', 'NEW', [PY3_TRACKER_BUG]),
+    BzBugStub(2, 'python-foo', 'CLOSED', [PY3_TRACKER_BUG]),
+    BzBugStub(3, 'python-bar', 'ASSIGNED',
+              [PY3_TRACKER_BUG] + IGNORE_TRACKER_BUGS),
+    BzBugStub(4, ['python-baz', 'python-qux'], 'NEW', [PY3_TRACKER_BUG]),
+]
+
+
+@pytest.fixture
+def bzapi(monkeypatch):
+    bzapi = BugzillaStub(TRACKED)
+    monkeypatch.setattr(py3_support, '_bzapis', [bzapi])
+    return bzapi
+
+
+def test_fetch_tracker_bugs(bzapi):
+    bugs = fetch_tracker_bugs(bzapi)
+    assert sorted(bugs) == ['python-bar', 'python-baz', 'python-foo',
+                            'python-qux']
+    assert [bug.id for bug in bugs['python-foo']] == [1, 2]
+    assert bugs['python-qux'][0].weburl == bug_url(4)
+    assert bzapi.queries[0]['blocks'] == PY3_TRACKER_BUG
+    assert set(bzapi.queries[0]['include_fields']) == {
+        'id', 'component', 'status', 'blocks'}
+
+
+@pytest.mark.parametrize('page', (1, 2, 3, 4, 5))
+def test_fetch_tracker_bugs_pages(bzapi, page):
+    assert fetch_tracker_bugs(bzapi, page=page) == fetch_tracker_bugs(bzapi)
+    queries = bzapi.queries[:-1]
+    assert len(queries) == len(TRACKED) // page + 1
+    assert [query['offset'] for query in queries] == [
+        n * page for n in range(len(queries))]
+
+
+@pytest.fixture
+def snapshot(tmpdir, bzapi):
+    path = tmpdir.join('tracker.json')
+    use_tracker_snapshot(path)
+    yield path
+    use_tracker_snapshot(None)
+
+
+@pytest.mark.parametrize(('component', 'expected'), (
+    ('python-foo', [bug_url(1)]),
+    ('python-bar', []),
+    ('python-qux', [bug_url(4)]),
+    ('python-unknown', []),
+))
+def test_get_py3_bugzillas_from_snapshot(snapshot, bzapi,
+                                         component, expected):
+    assert get_py3_bugzillas_for(component) == expected
+    assert get_py3_bugzillas_for('python-foo') == [bug_url(1)]
+    assert len(bzapi.queries) == 1
+
+
+def test_snapshot_is_shared(snapshot, bzapi):
+    get_py3_bugzillas_for('python-foo')
+    # another process reads the stored snapshot
+    assert TrackerSnapshot(snapshot).bugs_for('python-foo') == (
+        py3_support._snapshot.bugs_for('python-foo'))
+    assert len(bzapi.queries) == 1
+
+
+def test_snapshot_expires(snapshot, bzapi, monkeypatch):
+    get_py3_bugzillas_for('python-foo')
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 60 * 60 + 1)
+    get_py3_bugzillas_for('python-foo')
+    assert len(bzapi.queries) == 2
+
+
+def test_snapshot_failure_is_remembered(snapshot, bzapi, monkeypatch):
+    def fail(query):
+        bzapi.queries.append(query)
+        raise OSError('Bugzilla is down')
+
+    monkeypatch.setattr(bzapi, 'query', fail)
+    monkeypatch.setattr(py3_support, '_bzapis', [bzapi])
+    for _ in range(3):
+        with pytest.raises(OSError):
+            py3_support._snapshot.bugs()
+    assert len(bzapi.queries) == 1
+    # the next run tries again, the failed session was dropped
+    use_tracker_snapshot(snapshot)
+    py3_support._bzapis.append(bzapi)
+    with pytest.raises(OSError):
+        py3_support._snapshot.bugs()
+    assert len(bzapi.queries) == 2
+
+
+def test_get_py3_bugzillas_for_fields(bzapi):
+    # the stub answers all the bugs, whatever the component
+    assert get_py3_bugzillas_for('python-foo') == [bug_url(1), bug_url(4)]
+    assert bzapi.queries == [{
+        'product': 'Fedora',
+        'component': 'python-foo',
+        'include_fields': ['id', 'status', 'blocks'],
+        'blocks': PY3_TRACKER_BUG}]
+
+
+def test_call_with_deadline():
+    assert call_with_deadline(sum, [1, 2], deadline=1) == 3
+    with pytest.raises(ZeroDivisionError):
+        call_with_deadline(lambda: 1 / 0, deadline=1)
+
+
+def test_call_with_deadline_expires():
+    event = threading.Event()
+    with pytest.raises(BugzillaTimeout):
+        call_with_deadline(event.wait, 5, deadline=0.05)
+    event.set()
+
+
+def test_call_with_deadline_counts():
+    with measure('py3_support') as measurement:
+        call_with_deadline(count, 'bugzilla_queries', deadline=1)
+    assert measurement.counters['bugzilla_queries'] == 1
@@ -0,0 +1,127 @@
+import json
+import os
+import pathlib
+import sys
+from unittest import mock
+
+import pytest
+import yaml
+
+from taskotron_python_versions import py3_support
+from taskotron_python_versions.provides_index import export_query
+from taskotron_python_versions.repos import use_provides_indexes
+from taskotron_python_versions.subchecks import SUBCHECKS
+
+from .common import gpkg_path
+
+TESTCASE = 'dist.python-versions'
+MEASURED = {'wall_time', 'cpu_time'}
+
+
+class CheckDetailStub:
+
+    """Stub object for CheckDetail, keeps what export_YAML() needs."""
+
+    def __init__(self, checkname, item, report_type, outcome, keyvals=None):
+        self.checkname = checkname
+        self.item = item
+        self.outcome = outcome
+        self.keyvals = keyvals or {}
+        self.artifact = None
+
+
+def export_yaml(details):
+    return yaml.safe_dump({'results': [
+        {'checkname': detail.checkname, 'outcome': detail.outcome,
+         'item': detail.item, 'keyvals': detail.keyvals}
+        for detail in details]})
+
+
+@pytest.fixture
+def run(monkeypatch):
+    # libtaskotron is not available on Python 3
+    check = mock.Mock(CheckDetail=CheckDetailStub, export_YAML=export_yaml)
+    monkeypatch.setitem(sys.modules, 'libtaskotron', mock.Mock(check=check))
+    monkeypatch.syspath_prepend(
+        str(pathlib.Path(__file__).parents[2]))
+    monkeypatch.delitem(sys.modules, 'python_versions_check', raising=False)
+    # no Bugzilla here
+    monkeypatch.setattr(py3_support, 'get_py3_bugzillas_for', lambda name: [])
+    import python_versions_check
+    yield python_versions_check.run
+    # imported with the libtaskotron stub
+    sys.modules.pop('python_versions_check', None)
+    use_provides_indexes(None)
+
+
+def workdir_with(tmpdir, pkgglobs, buildlog=''):
+    workdir = tmpdir.mkdir('workdir')
+    for pkgglob in pkgglobs:
+        path = gpkg_path(pkgglob)
+        os.symlink(os.path.abspath(path),
+                   str(workdir.join(os.path.basename(path))))
+    workdir.join('build.log.noarch').write(buildlog)
+    return workdir
+
+
+def run_on(run, tmpdir, koji_build, workdir):
+    # the requires are looked up in an empty provides index, not in DNF
+    indexes = tmpdir.mkdir('indexes')
+    export_query([], str(indexes.join(koji_build.split('fc')[-1] +
+                                      '.sqlite')))
+    artifactsdir = tmpdir.join('artifacts')
+    rc = run(koji_build, str(workdir), artifactsdir=str(artifactsdir),
+             testcase=TESTCASE, arches=['noarch'],
+             provides_index=str(indexes))
+    results = yaml.safe_load(
+        artifactsdir.join('taskotron', 'results.yml').read())['results']
+    timing = json.loads(artifactsdir.join('taskotron', 'timing.json').read())
+    return rc, results, timing
+
+
+def test_run_python_build(run, tmpdir):
+    workdir = workdir_with(tmpdir, ('pyserial*', 'python3-pyserial*'))
+    rc, results, timing = run_on(run, tmpdir, 'pyserial-2.7-6.fc25', workdir)
+
+    assert [result['checkname'] for result in results] == [
+        '{}.{}'.format(TESTCASE, subcheck.name)
+        for subcheck in SUBCHECKS] + [TESTCASE]
+    for result in results[:-1]:
+        assert MEASURED <= set(result['keyvals'])
+        assert result['keyvals']['arch'] == ['noarch']
+    assert results[-1]['keyvals'] == {'arch': ['noarch']}
+    overall = ('FAILED' if any(result['outcome'] == 'FAILED'
+                               for result in results[:-1]) else 'PASSED')
+    assert results[-1]['outcome'] == overall
+    assert rc == (overall == 'FAILED')
+
+    assert set(timing) == ({'load_packages', 'prefilter'} |
+                           {subcheck.name for subcheck in SUBCHECKS})
+    assert all(MEASURED <= set(values) for values in timing.values())
+
+
+def test_run_build_without_python(run, tmpdir):
+    workdir = workdir_with(
+        tmpdir, ('libgccjit*',),
+        buildlog='WARNING: mangling shebang in /usr/bin/foo\n')
+    rc, results, timing = run_on(run, tmpdir, 'libgccjit-6.1.1-3.fc24',
+                                 workdir)
+
+    assert [result['checkname'] for result in results] == [
+        '{}.{}'.format(TESTCASE, subcheck.name)
+        for subcheck in SUBCHECKS] + [TESTCASE]
+    outcomes = {result['checkname']: result['outcome']
+                for result in results}
+    # only the build log is checked, the mangled shebangs still fail
+    shebangs = '{}.unversioned_shebangs'.format(TESTCASE)
+    assert outcomes.pop(shebangs) == 'FAILED'
+    assert outcomes.pop(TESTCASE) == 'FAILED'
+    assert set(outcomes.values()) == {'PASSED'}
+    assert rc == 1
+
+    for result in results[:-1]:
+        measured = result['checkname'] == shebangs
+        assert (MEASURED <= set(result['keyvals'])) == measured
+        assert result['keyvals']['arch'] == ['noarch']
+    assert set(timing) == {'load_packages', 'prefilter',
+                           'unversioned_shebangs'}
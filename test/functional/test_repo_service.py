@@ -0,0 +1,215 @@
+import threading
+from collections import namedtuple
+
+import pytest
+
+from taskotron_python_versions import repo_service, requires
+from taskotron_python_versions.repo_service import (
+    RepoService,
+    RepoServiceClient,
+    RepoServiceError,
+)
+
+
+Package = namedtuple('Package', 'name')
+
+
+class BatchQueryStub:
+
+    """Stub object for a repoquery of the service."""
+
+    def __init__(self, data):
+        self.data = data
+        self.batches = []
+
+    def get_providers(self, names):
+        self.batches.append(sorted(names))
+        return {name: [Package(n) for n in self.data.get(name, [])]
+                for name in names}
+
+
+class FailingQueryStub:
+
+    def get_providers(self, names):
+        raise ValueError('no repositories')
+
+
+DATA = {
+    'python': ['python2'],
+    'rpm-python': ['rpm-python', 'python2-rpm'],
+}
+
+
+@pytest.fixture
+def service(tmpdir):
+    server = RepoService(str(tmpdir.join('repo.sock')))
+    server.repoqueries.put('29', BatchQueryStub(DATA))
+    server.repoqueries.put('30', FailingQueryStub())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def names(providers):
+    return {name: [p.name for p in packages]
+            for name, packages in providers.items()}
+
+
+def test_get_providers(service):
+    client = RepoServiceClient.connect(service.server_address, '29')
+    assert names(client.get_providers(
+        ['rpm-python', 'python', 'python-no', 'python'])) == {
+        'python': ['python2'],
+        'python-no': [],
+        'rpm-python': ['rpm-python', 'python2-rpm']}
+    assert [p.name for p in client.get_packages_by('python')] == ['python2']
+    assert service.repoqueries.peek('29').batches == [
+        ['python', 'python-no', 'rpm-python'], ['python']]
+    client.close()
+
+
+def test_error_is_reported(service):
+    client = RepoServiceClient.connect(service.server_address, '30')
+    with pytest.raises(RepoServiceError, match='no repositories'):
+        client._request({'release': '30', 'provides': ['python']})
+    client.close()
+
+
+def test_fallback_on_error(service, monkeypatch):
+    local = BatchQueryStub({'python': ['python3-local']})
+    monkeypatch.setattr(repo_service, 'local_repoquery', lambda release: local)
+    client = RepoServiceClient.connect(service.server_address, '30')
+    assert names(client.get_providers(['python'])) == {
+        'python': ['python3-local']}
+    assert names(client.get_providers(['python'])) == {
+        'python': ['python3-local']}
+    assert len(local.batches) == 2
+
+
+class UnloadedQueryStub(BatchQueryStub):
+
+    loaded = False
+
+
+def test_fallback_when_service_not_loaded(service, monkeypatch):
+    service.repoqueries.put('32', UnloadedQueryStub(DATA))
+    local = BatchQueryStub({'python': ['python3-local']})
+    monkeypatch.setattr(repo_service, 'local_repoquery', lambda release: local)
+    client = RepoServiceClient.connect(service.server_address, '32')
+    assert names(client.get_providers(['python'])) == {
+        'python': ['python3-local']}
+    assert client.loaded
+
+
+def test_releases_do_not_block_each_other(service):
+    loading = threading.Event()
+    release = threading.Event()
+
+    class BlockingQueryStub(BatchQueryStub):
+        def get_providers(self, names):
+            loading.set()
+            release.wait(5)
+            return super().get_providers(names)
+
+    service.repoqueries.put('31', BlockingQueryStub(DATA))
+    slow = RepoServiceClient.connect(service.server_address, '31')
+    thread = threading.Thread(target=slow.get_providers, args=(['python'],))
+    thread.start()
+    try:
+        assert loading.wait(5)
+        client = RepoServiceClient.connect(service.server_address, '29')
+        assert names(client.get_providers(['python'])) == {
+            'python': ['python2']}
+        assert thread.is_alive()
+        client.close()
+    finally:
+        release.set()
+        thread.join()
+        slow.close()
+
+
+def test_fallen_back_release_waits_for_rawhide(service):
+    querying = threading.Event()
+    release = threading.Event()
+    log = []
+
+    class BlockingQueryStub(BatchQueryStub):
+        def get_providers(self, names):
+            querying.set()
+            release.wait(5)
+            log.append('rawhide')
+            return super().get_providers(names)
+
+    class FallenBackQueryStub(BatchQueryStub):
+        def get_providers(self, names):
+            log.append('33')
+            return super().get_providers(names)
+
+    # 33 failed to load and shares the sack of rawhide
+    fallen_back = FallenBackQueryStub(DATA)
+    fallen_back.release = 'rawhide'
+    service.repoqueries.put('33', fallen_back)
+    service.repoqueries.put('rawhide', BlockingQueryStub(DATA))
+    rawhide = RepoServiceClient.connect(service.server_address, 'rawhide')
+    client = RepoServiceClient.connect(service.server_address, '33')
+    threads = [
+        threading.Thread(target=rawhide.get_providers, args=(['python'],)),
+        threading.Thread(target=client.get_providers, args=(['python'],)),
+    ]
+    threads[0].start()
+    try:
+        assert querying.wait(5)
+        threads[1].start()
+        threads[1].join(0.2)
+        assert threads[1].is_alive()
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join()
+        rawhide.close()
+        client.close()
+    assert log == ['rawhide', '33']
+
+
+def test_connect_not_running(tmpdir):
+    assert RepoServiceClient.connect(str(tmpdir.join('no.sock')), '29') is None
+    tmpdir.join('stale.sock').write('')
+    assert RepoServiceClient.connect(
+        str(tmpdir.join('stale.sock')), '29') is None
+
+
+def test_fallback_when_service_stops(service, monkeypatch):
+    local = BatchQueryStub({'python': ['python2-local']})
+    monkeypatch.setattr(repo_service, 'local_repoquery', lambda release: local)
+    client = RepoServiceClient.connect(service.server_address, '29')
+    service.shutdown()
+    service.server_close()
+    assert names(client.get_providers(['python'])) == {
+        'python': ['python2-local']}
+
+
+def test_fallback_when_connected_service_stops(service, monkeypatch):
+    local = BatchQueryStub({'python': ['python2-local']})
+    monkeypatch.setattr(repo_service, 'local_repoquery', lambda release: local)
+    client = RepoServiceClient.connect(service.server_address, '29')
+    # the connection is being served
+    assert names(client.get_providers(['python'])) == {'python': ['python2']}
+    service.shutdown()
+    service.server_close()
+    assert names(client.get_providers(['python'])) == {
+        'python': ['python2-local']}
+
+
+def test_get_repoquery_uses_service(service):
+    requires.use_repo_service(service.server_address)
+    try:
+        repoquery = requires.get_repoquery('29')
+        assert isinstance(repoquery, RepoServiceClient)
+        assert requires.get_versioned_name('rpm-python', repoquery) == (
+            'python2-rpm')
+        assert not isinstance(requires.get_repoquery('30'), BatchQueryStub)
+    finally:
+        requires.use_repo_service(None)
@@ -1,11 +1,29 @@
+import sys
+import threading
 from collections import namedtuple
+from unittest import mock
 
 import pytest
 
+from taskotron_python_versions.provides_index import (
+    export_query,
+    ProvidesIndex,
+)
+from taskotron_python_versions import provides_index, requires
+from taskotron_python_versions.repoquery import DNFQuery, RepoQueryPool
+from taskotron_python_versions.repos import (
+    configure_repos,
+    repo_sources,
+    use_provides_indexes,
+)
 from taskotron_python_versions.requires import (
-    DNFQuery,
+    get_repoquery,
     get_versioned_name,
+    get_versioned_names,
     check_requires_naming_scheme,
+    release_from_build,
+    resolve_versioned_names,
+    use_versioned_name_cache,
 )
 
 from .common import gpkg
@@ -38,6 +56,19 @@ class QueryStub:
         return [Package(name=name) for name in package_names]
 
 
+class BatchQueryStub(QueryStub):
+
+    """Stub object for a repoquery resolving many provides at once."""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.batches = []
+
+    def get_providers(self, names):
+        self.batches.append(list(names))
+        return {name: self.get_packages_by(name) for name in names}
+
+
 @pytest.mark.parametrize(('require', 'repoquery', 'expected'), (
     ('python-foo', QueryStub({'python-foo': []}), None),
     ('python-foo', QueryStub({'python-foo': ['python-foo']}), None),
@@ -89,9 +120,396 @@ def test_package_requires_are_misnamed(pkgglob, repoquery, expected):
         'Repoquery was not called for: {}'.format(repoquery.data))
 
 
+@pytest.mark.parametrize('stub', (QueryStub, BatchQueryStub))
+def test_get_versioned_names(stub):
+    repoquery = stub({
+        'python': ['python2'],
+        'python-foo': ['python-foo'],
+        'rpm-python': ['rpm-python', 'python2-rpm']})
+    assert get_versioned_names(
+        ['rpm-python', 'python', 'python-foo', 'python'], repoquery) == {
+        'python': 'python2',
+        'python-foo': None,
+        'rpm-python': 'python2-rpm'}
+    assert not repoquery.data
+
+
+def test_get_versioned_names_single_batch():
+    repoquery = BatchQueryStub({'python': ['python2'], 'python-foo': []})
+    get_versioned_names(['python-foo', 'python', 'python-foo'], repoquery)
+    assert repoquery.batches == [['python', 'python-foo']]
+
+
+def test_get_versioned_names_empty():
+    assert get_versioned_names([], BatchQueryStub({})) == {}
+
+
+def test_check_requires_naming_scheme_resolved():
+    resolved = {
+        'python': 'python2',
+        'python-iniparse': None,
+        'python-urlgrabber': None,
+        'rpm-python': 'python2-rpm'}
+    # nothing is queried with the requires already resolved
+    assert check_requires_naming_scheme(
+        gpkg('yum*'), QueryStub({}), resolved) == {
+        'python (python2 is available)',
+        'rpm-python (python2-rpm is available)'}
+
+
+class HawkeyQueryStub:
+
+    """Stub object for a hawkey query, filtered by provides only."""
+
+    def __init__(self, packages):
+        self.packages = packages
+        self.filters = []
+
+    def filter(self, provides):
+        self.filters.append(provides)
+        self.result = [p for p in self.packages
+                       if any(p.provides_name(n) for n in provides)]
+        return self
+
+    def run(self):
+        return self.result
+
+
+class HawkeyPackageStub(namedtuple('HawkeyPackageStub', 'name, provides')):
+
+    def provides_name(self, name):
+        return any(str(p).split(' ')[0] == name for p in self.provides)
+
+
+def test_dnfquery_get_providers():
+    repoquery = DNFQuery('29')
+    repoquery._query = HawkeyQueryStub([
+        HawkeyPackageStub('python2', ['python2 = 2.7', 'python = 2.7']),
+        HawkeyPackageStub('python2-rpm', ['python2-rpm', 'rpm-python']),
+        HawkeyPackageStub('rpm-python', ['rpm-python']),
+    ])
+    providers = repoquery.get_providers(['rpm-python', 'python', 'python-no'])
+    assert {name: [p.name for p in packages]
+            for name, packages in providers.items()} == {
+        'python': ['python2'],
+        'python-no': [],
+        'rpm-python': ['python2-rpm', 'rpm-python']}
+    assert repoquery.query.filters == [['python', 'python-no', 'rpm-python']]
+
+
+def test_get_repoquery_is_shared():
+    repoquery = get_repoquery('30')
+    assert isinstance(repoquery, DNFQuery)
+    assert get_repoquery('30') is repoquery
+    assert get_repoquery('31') is not repoquery
+
+
 @pytest.mark.slow
 def test_repoquery():
     repoquery = DNFQuery('25')
     packages = repoquery.get_packages_by(provides='python-setuptools')
     first = packages[0]
     assert first.name == 'python2-setuptools'
+
+
+REPO_CONFIG = '''
+[DEFAULT]
+fedora = http://mirror.example.com/fedora/$releasever/os/
+updates = /srv/updates/$releasever/
+
+[29]
+fedora = /srv/fedora/29/
+
+[30]
+provides_index = {}/$releasever.sqlite
+'''
+
+
+@pytest.fixture
+def repo_config(tmpdir):
+    path = tmpdir.join('repos.ini')
+    path.write(REPO_CONFIG.format(tmpdir))
+    configure_repos(path)
+    yield tmpdir
+    configure_repos(None)
+
+
+def test_repo_sources_default():
+    assert repo_sources('29') == {
+        'fedora': 'fedora-$releasever',
+        'updates': 'updates-released-f$releasever'}
+
+
+@pytest.mark.parametrize(('release', 'expected'), (
+    ('28', {'fedora': 'http://mirror.example.com/fedora/$releasever/os/',
+            'updates': '/srv/updates/$releasever/'}),
+    ('29', {'fedora': '/srv/fedora/29/',
+            'updates': '/srv/updates/$releasever/'}),
+    ('30', {'fedora': 'http://mirror.example.com/fedora/$releasever/os/',
+            'updates': '/srv/updates/$releasever/'}),
+))
+def test_repo_sources_configured(repo_config, release, expected):
+    assert repo_sources(release) == expected
+
+
+def test_get_repoquery_configured_index(repo_config):
+    assert isinstance(get_repoquery('30'), DNFQuery)
+    configure_repos(None)
+    export_query([], str(repo_config.join('30.sqlite')))
+    configure_repos(repo_config.join('repos.ini'))
+    assert isinstance(get_repoquery('30'), ProvidesIndex)
+
+
+class ReposStub:
+
+    """Stub object for dnf base.repos, records the added repos."""
+
+    def __init__(self):
+        self.added = {}
+
+    def add_new_repo(self, reponame, conf, **kwargs):
+        self.added[reponame] = kwargs
+        return mock.Mock()
+
+
+@pytest.mark.parametrize(('repourl', 'expected'), (
+    ('fedora-$releasever',
+     {'metalink': 'https://mirrors.fedoraproject.org/'
+                  'metalink?repo=fedora-$releasever&arch=$basearch'}),
+    ('http://mirror.example.com/fedora/',
+     {'baseurl': ['http://mirror.example.com/fedora/']}),
+    ('/srv/fedora/29/', {'baseurl': ['file:///srv/fedora/29']}),
+))
+def test_add_repo(repourl, expected):
+    base = mock.Mock(repos=ReposStub())
+    DNFQuery.add_repo(base, 'fedora', repourl)
+    expected['skip_if_unavailable'] = False
+    assert base.repos.added == {'fedora': expected}
+
+
+class SlowDNFQuery(DNFQuery):
+
+    """DNFQuery loading its query once allowed to."""
+
+    def __init__(self, release):
+        super().__init__(release)
+        self.loads = []
+        self.started = threading.Event()
+        self.proceed = threading.Event()
+
+    def get_dnf_query(self, cancelled=None):
+        self.loads.append(cancelled)
+        self.started.set()
+        self.proceed.wait(5)
+        if cancelled is not None and cancelled.is_set():
+            return None
+        return 'query for {}'.format(self.release)
+
+
+def test_prefetch_is_waited_for():
+    repoquery = SlowDNFQuery('29')
+    repoquery.prefetch()
+    assert repoquery.started.wait(5)
+    repoquery.proceed.set()
+    assert repoquery.query == 'query for 29'
+    assert len(repoquery.loads) == 1
+
+
+def test_prefetch_cancelled():
+    repoquery = SlowDNFQuery('29')
+    repoquery.prefetch()
+    assert repoquery.started.wait(5)
+    repoquery.cancel_prefetch()
+    repoquery.proceed.set()
+    # loaded again, when needed after all
+    assert repoquery.query == 'query for 29'
+    assert repoquery.loads[1] is None
+
+
+def test_prefetch_loaded_query():
+    repoquery = SlowDNFQuery('29')
+    repoquery._query = 'loaded'
+    repoquery.prefetch()
+    assert repoquery.query == 'loaded'
+    assert not repoquery.loads
+
+
+def test_dropped_while_loading():
+    repoquery = SlowDNFQuery('29')
+    repoquery.prefetch()
+    assert repoquery.started.wait(5)
+    repoquery.release_query()
+    repoquery.proceed.set()
+    # the query dropped meanwhile is loaded again
+    assert repoquery.query == 'query for 29'
+    assert len(repoquery.loads) == 2
+
+
+class RepoErrorStub(Exception):
+    pass
+
+
+class FailingReposDNFQuery(DNFQuery):
+
+    """DNFQuery of a release without repositories."""
+
+    def add_repo(self, base, reponame, repourl):
+        raise RepoErrorStub('no repo for {}'.format(self.release))
+
+
+def test_rawhide_fallback_uses_own_pool(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'dnf', mock.MagicMock(
+        exceptions=mock.Mock(RepoError=RepoErrorStub)))
+    pool = RepoQueryPool()
+    rawhide = pool.get('rawhide', DNFQuery)
+    rawhide._query = 'rawhide query'
+    fallback = pool.get('42', FailingReposDNFQuery)
+    assert fallback.query == 'rawhide query'
+    assert fallback.release == 'rawhide'
+    assert 'rawhide' not in requires._repoqueries
+
+
+@pytest.mark.parametrize(('koji_build', 'release'), (
+    ('python-foo-1.0-1.fc29', '29'),
+    ('tracer-0.6.9-1.fc23', '23'),
+))
+def test_release_from_build(koji_build, release):
+    assert release_from_build(koji_build) == release
+
+
+class SackStub:
+
+    """Stub object for a repoquery with a loaded sack of given size."""
+
+    def __init__(self, release, memory=1000):
+        self.release = release
+        self.memory = memory
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_pool_hits_and_misses():
+    pool = RepoQueryPool()
+    first = pool.get('30', SackStub)
+    assert pool.get('30', pytest.fail) is first
+    pool.get('31', SackStub)
+    assert pool.stats == {'repoquery_hits': 1, 'repoquery_misses': 2}
+
+
+def test_pool_evicts_least_recently_used():
+    pool = RepoQueryPool(budget=2500)
+    first = pool.get('30', SackStub)
+    pool.get('31', SackStub)
+    pool.get('30', pytest.fail)
+    # the new one is assumed as big as the biggest one, 31 must go
+    pool.get('rawhide', SackStub)
+    assert '31' not in pool and '30' in pool and 'rawhide' in pool
+    assert pool.stats['repoquery_evictions'] == 1
+    pool.get('32', SackStub)
+    assert first.closed
+    assert len(pool) == 2
+
+
+def test_pool_unlimited():
+    pool = RepoQueryPool()
+    for release in range(20):
+        pool.get(str(release), SackStub)
+    assert len(pool) == 20
+    assert not pool.stats['repoquery_evictions']
+
+
+def test_pool_evicts_releases_sharing_rawhide():
+    pool = RepoQueryPool(budget=1000)
+    sack = object()
+    rawhide = pool.get('rawhide', DNFQuery)
+    # 32 fell back to rawhide
+    fallback = pool.get('32', DNFQuery)
+    rawhide._query, rawhide.memory = sack, 1000
+    fallback._query = sack
+    pool.get('30', SackStub)
+    assert len(pool) == 1
+    assert rawhide._query is None and fallback._query is None
+
+
+@pytest.fixture
+def name_cache(tmpdir, monkeypatch):
+    revision = {'29': 'fedora=repomd:aaa'}
+    monkeypatch.setattr(requires, 'release_revision', revision.get)
+    use_versioned_name_cache(tmpdir)
+    yield revision
+    use_versioned_name_cache(None)
+
+
+def test_resolve_versioned_names_cached(name_cache):
+    repoquery = BatchQueryStub({'python': ['python2'], 'python-foo': []})
+    expected = {'python': 'python2', 'python-foo': None}
+    assert resolve_versioned_names(
+        ['python', 'python-foo'], '29', repoquery) == expected
+    # answered from the cache, the stub would fail otherwise
+    assert resolve_versioned_names(
+        ['python', 'python-foo'], '29', repoquery) == expected
+    assert repoquery.batches == [['python', 'python-foo']]
+
+
+def test_resolve_versioned_names_only_missing(name_cache):
+    resolve_versioned_names(['python'], '29', BatchQueryStub({
+        'python': ['python2']}))
+    repoquery = BatchQueryStub({'rpm-python': ['python2-rpm']})
+    assert resolve_versioned_names(
+        ['python', 'rpm-python'], '29', repoquery) == {
+        'python': 'python2', 'rpm-python': 'python2-rpm'}
+    assert repoquery.batches == [['rpm-python']]
+
+
+def test_resolve_versioned_names_new_revision(name_cache):
+    resolve_versioned_names(['python'], '29', BatchQueryStub({
+        'python': ['python']}))
+    name_cache['29'] = 'fedora=repomd:bbb'
+    assert resolve_versioned_names(['python'], '29', BatchQueryStub({
+        'python': ['python2']})) == {'python': 'python2'}
+
+
+def test_resolve_versioned_names_unknown_revision(name_cache):
+    for _ in range(2):
+        repoquery = BatchQueryStub({'python': ['python2']})
+        resolve_versioned_names(['python'], '30', repoquery)
+        assert not repoquery.data
+
+
+class UnloadedDNFQuery(DNFQuery):
+
+    """DNFQuery failing to load its repositories."""
+
+    def get_dnf_query(self, cancelled=None):
+        return None
+
+
+def test_resolve_versioned_names_not_loaded(name_cache):
+    repoquery = UnloadedDNFQuery('29')
+    assert resolve_versioned_names(['python'], '29', repoquery) == {
+        'python': None}
+    assert not repoquery.loaded
+    repoquery = BatchQueryStub({'python': ['python2']})
+    assert resolve_versioned_names(['python'], '29', repoquery) == {
+        'python': 'python2'}
+    assert repoquery.batches == [['python']]
+
+
+def test_release_revision_from_provides_index(tmpdir):
+    export_query([], str(tmpdir.join('29.sqlite')),
+                 {'updates': 'repomd:bbb', 'fedora': 'repomd:aaa'})
+    use_provides_indexes(tmpdir)
+    try:
+        assert requires.release_revision('29') == (
+            'fedora=repomd:aaa,updates=repomd:bbb')
+    finally:
+        use_provides_indexes(None)
+
+
+def test_release_revision_not_xml(monkeypatch):
+    monkeypatch.setattr(provides_index, '_fetch',
+                        lambda url: b'<html>proxy error')
+    monkeypatch.setattr(requires, '_revisions', {})
+    assert requires.release_revision('29') is None
@@ -0,0 +1,157 @@
+import sys
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from taskotron_python_versions.common import (
+    ArtifactWriter,
+    write_to_artifact,
+)
+from taskotron_python_versions.subchecks import (
+    prefiltered_details,
+    run_subchecks,
+    Subcheck,
+    SUBCHECKS,
+)
+
+
+class DetailStub:
+
+    """Stub object for CheckDetail."""
+
+    def __init__(self, name):
+        self.name = name
+        self.keyvals = {}
+
+
+def recording_task(name, log, delay=0):
+    def task(*args):
+        time.sleep(delay)
+        log.append((name, args))
+        return DetailStub(name)
+    return task
+
+
+def names(details):
+    return [detail.name for detail in details]
+
+
+def test_details_keep_subchecks_order():
+    log = []
+    subchecks = (
+        Subcheck('slow', recording_task('slow', log, 0.2), ('a',), ()),
+        Subcheck('fast', recording_task('fast', log), ('a', 'b'), ()),
+    )
+    details = run_subchecks({'a': 1, 'b': 2}, 'build', 'artifact',
+                            jobs=2, subchecks=subchecks)
+    assert names(details) == ['slow', 'fast']
+    assert log == [('fast', (1, 2, 'build', 'artifact')),
+                   ('slow', (1, 'build', 'artifact'))]
+
+
+def test_subchecks_run_after_their_dependencies():
+    log = []
+    subchecks = (
+        Subcheck('first', recording_task('first', log, 0.2), (), ()),
+        Subcheck('second', recording_task('second', log), (), ('first',)),
+        Subcheck('third', recording_task('third', log), (), ()),
+    )
+    details = run_subchecks({}, 'build', 'artifact',
+                            jobs=3, subchecks=subchecks)
+    assert names(details) == ['first', 'second', 'third']
+    assert [name for name, _ in log] == ['third', 'first', 'second']
+
+
+def test_independent_subchecks_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+
+    def task(*args):
+        barrier.wait()
+        return DetailStub('done')
+
+    subchecks = (Subcheck('one', task, (), ()),
+                 Subcheck('two', task, (), ()))
+    details = run_subchecks({}, 'b', 'a', jobs=2, subchecks=subchecks)
+    assert names(details) == ['done', 'done']
+
+
+def test_unknown_dependency():
+    subchecks = (Subcheck('one', None, (), ('nope',)),)
+    with pytest.raises(ValueError):
+        run_subchecks({}, 'b', 'a', subchecks=subchecks)
+
+
+def test_circular_dependency():
+    subchecks = (Subcheck('one', None, (), ('two',)),
+                 Subcheck('two', None, (), ('one',)))
+    with pytest.raises(ValueError):
+        run_subchecks({}, 'b', 'a', subchecks=subchecks)
+
+
+def test_registry_is_runnable_serially():
+    log = []
+    subchecks = tuple(
+        subcheck._replace(task=recording_task(subcheck.name, log))
+        for subcheck in SUBCHECKS)
+    inputs = {'packages': [], 'all_packages': [], 'logs': []}
+    details = run_subchecks(inputs, 'b', 'a', subchecks=subchecks)
+    assert names(details) == [subcheck.name for subcheck in SUBCHECKS]
+    assert [name for name, _ in log] == names(details)
+
+
+def test_subchecks_are_measured(tmpdir):
+    log = []
+    subchecks = (
+        Subcheck('one', recording_task('one', log, 0.1), (), ()),
+        Subcheck('two', recording_task('two', log), (), ('one',)),
+    )
+    measurements = []
+    details = run_subchecks({}, 'b', 'a', jobs=2, subchecks=subchecks,
+                            profile_dir=str(tmpdir),
+                            measurements=measurements)
+    assert [m.name for m in measurements] == ['one', 'two']
+    assert details[0].keyvals['wall_time'] >= 0.1
+    assert 'cpu_time' in details[1].keyvals
+    assert tmpdir.join('one.prof').check() or tmpdir.join('two.prof').check()
+
+
+def test_artifact_sections_keep_subchecks_order(tmpdir):
+    def writing_task(name, delay):
+        def task(koji_build, artifact):
+            time.sleep(delay)
+            write_to_artifact(artifact, 'Message from ' + name, 'http://')
+            return DetailStub(name)
+        return task
+
+    subchecks = (
+        Subcheck('slow', writing_task('slow', 0.2), (), ()),
+        Subcheck('fast', writing_task('fast', 0), (), ()),
+    )
+    writer = ArtifactWriter(str(tmpdir.join('output.log')))
+    run_subchecks({}, 'b', writer, jobs=2, subchecks=subchecks)
+    writer.flush()
+    text = tmpdir.join('output.log').read()
+    assert text.index('from slow') < text.index('from fast')
+
+
+def test_prefiltered_details_check_logs(monkeypatch):
+    # libtaskotron is not available on Python 3
+    check = mock.Mock()
+    check.CheckDetail.side_effect = lambda checkname, **kwargs: DetailStub(
+        'passed ' + checkname)
+    monkeypatch.setitem(sys.modules, 'libtaskotron', mock.Mock(check=check))
+    log = []
+    subchecks = tuple(
+        subcheck._replace(task=recording_task(subcheck.name, log))
+        for subcheck in SUBCHECKS)
+    inputs = {'packages': ['pkg'], 'all_packages': ['srpm', 'pkg'],
+              'logs': ['build.log.x86_64']}
+    details = prefiltered_details(inputs, 'b', 'a', 'No Python involved.',
+                                  subchecks=subchecks)
+    assert names(details) == [
+        subcheck.name if subcheck.name == 'unversioned_shebangs'
+        else 'passed ' + subcheck.name for subcheck in SUBCHECKS]
+    assert log == [('unversioned_shebangs',
+                    ([], ['build.log.x86_64'], 'b', 'a'))]
@@ -5,7 +5,20 @@ from taskotron_python_versions.unversioned_shebangs import (
     get_problematic_files,
     shebang_to_require,
     get_scripts_summary,
+    scan_shebangs,
+    FORBIDDEN_SHEBANGS,
+    is_candidate,
+    shebang_candidates,
+    scan_packages,
+    check_packages,
+    ScanLimits,
+    ScanLimitExceeded,
+    PayloadUnavailable,
+    FIRST_LINE_SIZE,
 )
+from taskotron_python_versions.cache import ScanCache
+from taskotron_python_versions.common import Package
+from taskotron_python_versions.instrumentation import measure
 from .common import gpkg, gpkg_path
 
 
@@ -40,6 +53,26 @@ def test_get_problematic_files(archive, query, expected):
     assert get_problematic_files(gpkg_path(archive), query) == expected
 
 
+@pytest.mark.parametrize(('archive', 'expected'), (
+    ('tracer*', {
+        '#!/usr/bin/python': {'/usr/bin/tracer'},
+        '#!/usr/bin/env python': set()}),
+    ('python3-django*', {
+        '#!/usr/bin/python': set(),
+        '#!/usr/bin/env python':
+        {'/usr/lib/python3.6/site-packages/django/bin/django-admin.py',
+         ('/usr/lib/python3.6/site-packages/'
+          'django/conf/project_template/manage.py-tpl')}}),
+))
+def test_scan_shebangs(archive, expected):
+    assert scan_shebangs(gpkg_path(archive), FORBIDDEN_SHEBANGS) == expected
+
+
+def test_scan_shebangs_nothing_to_scan(tmpdir):
+    # the archive is not even opened
+    assert scan_shebangs(tmpdir.join('missing.rpm'), []) == {}
+
+
 @pytest.mark.parametrize(('shebang', 'expected'), (
     ("#!/foo", "/foo"),
     ("#!/usr/bin/python", "/usr/bin/python"),
@@ -62,3 +95,161 @@ def test_shebang_to_require(shebang, expected):
 ))
 def test_get_scripts_summary(glob, expected):
     assert get_scripts_summary(gpkg(glob)) == expected
+
+
+@pytest.mark.parametrize(('path', 'mode', 'size', 'file_class', 'expected'), (
+    ('/usr/bin/foo', 0o100755, 100, 'ELF 64-bit LSB executable', True),
+    ('/usr/bin/foo', 0o100644, 100, 'data', True),
+    ('/usr/libexec/foo/bar', 0o100644, 100, 'data', True),
+    ('/usr/share/foo/bar', 0o100755, 100, 'data', True),
+    ('/usr/share/foo/bar.py', 0o100644, 100,
+     'Python script, ASCII text executable', True),
+    ('/usr/share/doc/foo/README', 0o100644, 100, 'ASCII text', True),
+    ('/usr/share/foo/bar', 0o100644, 100, '', True),
+    ('/usr/share/foo/logo.png', 0o100644, 100, 'PNG image data', False),
+    ('/usr/lib64/libfoo.so.1', 0o100644, 100, 'ELF 64-bit LSB shared object',
+     False),
+    ('/usr/bin/foo', 0o100755, 10, 'ASCII text', False),
+    ('/usr/bin', 0o40755, 4096, 'directory', False),
+    ('/usr/bin/foo', 0o120777, 100, '', False),
+))
+def test_is_candidate(path, mode, size, file_class, expected):
+    assert is_candidate(path, mode, size, file_class, 17) == expected
+
+
+def test_shebang_candidates():
+    package = gpkg('tracer*')
+    candidates = shebang_candidates(package, FORBIDDEN_SHEBANGS)
+    assert '/usr/bin/tracer' in candidates
+    assert candidates < set(package.files)
+
+
+def test_scan_shebangs_candidates_only():
+    path = gpkg_path('tracer*')
+    with measure('all') as scan_all:
+        scan_shebangs(path, FORBIDDEN_SHEBANGS)
+    with measure('candidates') as scan_candidates:
+        problematic = scan_shebangs(path, FORBIDDEN_SHEBANGS,
+                                    {'/usr/bin/tracer'})
+    assert problematic == {
+        '#!/usr/bin/python': {'/usr/bin/tracer'},
+        '#!/usr/bin/env python': set()}
+    assert (scan_candidates.counters['payload_bytes_read'] <
+            scan_all.counters['payload_bytes_read'])
+
+
+SCANNED_GLOBS = ('yum*', 'tracer*', 'pyserial*', 'nodejs-semver*')
+
+
+@pytest.mark.parametrize('jobs', (1, 2, 4))
+def test_scan_packages(jobs):
+    packages = [gpkg(glob) for glob in SCANNED_GLOBS]
+    summaries = scan_packages(packages, jobs=jobs)
+    assert list(summaries) == sorted(package.nvr for package in packages)
+    for package in packages:
+        assert summaries[package.nvr] == get_scripts_summary(package)
+
+
+def test_scan_packages_counts_in_workers():
+    packages = [gpkg(glob) for glob in SCANNED_GLOBS]
+    with measure('serial') as serial:
+        scan_packages(packages, jobs=1)
+    with measure('parallel') as parallel:
+        scan_packages(packages, jobs=2)
+    assert parallel.counters['archive_entries'] > 0
+    assert parallel.counters == serial.counters
+    assert serial.worker_cpu_time == 0
+    assert parallel.worker_cpu_time > 0
+    assert 'worker_cpu_time' in parallel.as_dict()
+
+
+def test_check_packages_parallel_is_deterministic():
+    packages = [gpkg(glob) for glob in SCANNED_GLOBS]
+    message, exceeded = check_packages(packages, jobs=1)
+    assert message.index('tracer') < message.index('yum')
+    assert not exceeded
+    assert check_packages(reversed(packages), jobs=3) == (message, exceeded)
+
+
+def test_scan_shebangs_reads_first_line_only():
+    with measure('scan') as measurement:
+        scan_shebangs(gpkg_path('tracer*'), FORBIDDEN_SHEBANGS)
+    assert (measurement.counters['payload_bytes_read'] <=
+            measurement.counters['archive_entries'] * FIRST_LINE_SIZE)
+
+
+@pytest.mark.parametrize('limits', (
+    ScanLimits(max_bytes=1000),
+    ScanLimits(max_entries=3),
+    ScanLimits(max_time=-1),
+))
+def test_scan_shebangs_limits(limits):
+    with pytest.raises(ScanLimitExceeded):
+        scan_shebangs(gpkg_path('yum*'), FORBIDDEN_SHEBANGS, limits=limits)
+
+
+def test_scan_shebangs_within_limits():
+    limits = ScanLimits(max_bytes=10 ** 9, max_entries=10 ** 6, max_time=60)
+    assert (scan_shebangs(gpkg_path('tracer*'), FORBIDDEN_SHEBANGS,
+                          limits=limits) ==
+            scan_shebangs(gpkg_path('tracer*'), FORBIDDEN_SHEBANGS))
+
+
+@pytest.mark.parametrize('jobs', (1, 2))
+def test_check_packages_limits_exceeded(jobs):
+    packages = [gpkg('yum*'), gpkg('tracer*')]
+    message, exceeded = check_packages(packages, jobs=jobs,
+                                       limits=ScanLimits(max_entries=200))
+    assert 'yum' in message
+    assert 'tracer' not in message
+    assert exceeded == '{}\n * more than 200 files\n'.format(
+        packages[1].nvr)
+
+
+@pytest.mark.parametrize('glob', ('tracer*', 'yum*', 'pyserial*'))
+def test_get_scripts_summary_cached(tmpdir, glob):
+    package = gpkg(glob)
+    cache = ScanCache(str(tmpdir))
+    with measure('miss') as miss:
+        summary = get_scripts_summary(package, cache=cache)
+    with measure('hit') as hit:
+        cached = get_scripts_summary(package.snapshot(), cache=cache)
+    assert summary == cached == get_scripts_summary(package)
+    if summary:
+        assert miss.counters['scan_cache_misses'] == 1
+        assert hit.counters['scan_cache_hits'] == 1
+        assert 'archive_entries' not in hit.counters
+
+
+def test_scan_packages_cached(tmpdir):
+    packages = [gpkg(glob) for glob in SCANNED_GLOBS]
+    cache = ScanCache(str(tmpdir))
+    summaries = scan_packages(packages, jobs=2, cache=cache)
+    with measure('cached') as measurement:
+        assert scan_packages(packages, jobs=2, cache=cache) == summaries
+    assert 'archive_entries' not in measurement.counters
+
+
+def streamed_header(pkgglob):
+    with open(gpkg_path(pkgglob), 'rb') as f:
+        Package.from_stream(f)
+        header_size = f.tell()
+        f.seek(0)
+        return Package.from_stream(f.read(header_size))
+
+
+def test_streamed_package_not_scanned():
+    package = streamed_header('tracer*')
+    with pytest.raises(PayloadUnavailable):
+        get_scripts_summary(package)
+    message, not_scanned = check_packages([package], jobs=1)
+    assert message == ''
+    assert not_scanned == '{}\n * only the header of {} is available\n'.format(
+        package.nvr, package.filename)
+
+
+def test_streamed_package_from_scan_cache(tmpdir):
+    cache = ScanCache(str(tmpdir))
+    summary = get_scripts_summary(gpkg('tracer*'), cache=cache)
+    assert get_scripts_summary(streamed_header('tracer*'),
+                               cache=cache) == summary